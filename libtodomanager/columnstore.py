@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+from libtodomanager.todomanager import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ["ColumnTicketStore", "createColumnTicketStore"]
+
+def createColumnTicketStore(ticketList = []):
+    # NumPy is optional, the default store is used without it
+    if ColumnTicketStore.isAvailable():
+        return ColumnTicketStore(ticketList)
+    else:
+        return TicketStore(ticketList)
+
+class ColumnTicketStore:
+    kInitialCapacity = 1024
+
+    # Status of the rows of removed tickets
+    kNoStatus = 0
+
+    # Rows examined by the first step of a page query, doubled at each step
+    kPageChunkSize = 1024
+
+    def __init__(self, ticketList = []):
+        self.clear()
+
+        for ticket in ticketList:
+            self.insertTicket(ticket)
+
+    def clear(self):
+        self.ticketById = {}
+        self.rowById    = {}
+        self.rowCount   = 0
+        self.deadCount  = 0
+
+        self.idColumn       = numpy.zeros(ColumnTicketStore.kInitialCapacity, dtype=numpy.int64)
+        self.statusColumn   = numpy.zeros(ColumnTicketStore.kInitialCapacity, dtype=numpy.int8)
+        self.priorityColumn = numpy.zeros(ColumnTicketStore.kInitialCapacity, dtype=numpy.int8)
+
+        # Tag id -> list of rows, and the sorted array built from it on first query
+        self.rowsByTag     = {}
+        self.rowArrayByTag = {}
+
+    @staticmethod
+    def isAvailable():
+        return numpy != None
+
+    def grow(self):
+        capacity = len(self.idColumn) * 2
+
+        self.idColumn       = numpy.resize(self.idColumn, capacity)
+        self.statusColumn   = numpy.resize(self.statusColumn, capacity)
+        self.priorityColumn = numpy.resize(self.priorityColumn, capacity)
+
+    def compact(self):
+        # Drop the rows of removed tickets, ids are kept in increasing order
+        ticketList = [self.ticketById[ticketId] for ticketId in self.idColumn[:self.rowCount].tolist()
+                      if ticketId in self.rowById]
+
+        self.clear()
+        for ticket in ticketList:
+            self.insertTicket(ticket)
+
+    def addTagRow(self, tagId, row):
+        self.rowsByTag.setdefault(tagId, []).append(row)
+        self.rowArrayByTag.pop(tagId, None)
+
+    def getTagRows(self, tagId):
+        if tagId not in self.rowArrayByTag:
+            self.rowArrayByTag[tagId] = numpy.array(sorted(self.rowsByTag.get(tagId, [])), dtype=numpy.int64)
+
+        return self.rowArrayByTag[tagId]
+
+    def getTicket(self, ticketId):
+        return self.ticketById.get(ticketId)
+
+    def getTickets(self, ticketIds):
+        return [self.ticketById[ticketId] for ticketId in ticketIds]
+
+    def getTicketsById(self, ticketIds):
+        return dict((ticketId, self.ticketById[ticketId]) for ticketId in ticketIds if ticketId in self.ticketById)
+
+    def getTicketList(self):
+        return self.getTickets(sorted(self.ticketById.keys()))
+
+    def getTicketCount(self):
+        return len(self.ticketById)
+
+    def iterTicketDescriptions(self):
+        for ticket in self.ticketById.itervalues():
+            yield (ticket.id, ticket.description)
+
+    def insertTicket(self, ticket):
+        if self.rowCount == len(self.idColumn):
+            self.grow()
+
+        row = self.rowCount
+        self.rowCount = self.rowCount + 1
+
+        self.idColumn[row]       = ticket.id
+        self.statusColumn[row]   = ticket.status
+        self.priorityColumn[row] = ticket.priority
+
+        self.ticketById[ticket.id] = ticket
+        self.rowById[ticket.id]    = row
+
+        for tagId in ticket.tagIds:
+            self.addTagRow(tagId, row)
+
+        return ErrorCode.kOk
+
+    def insertTickets(self, ticketList):
+        while self.rowCount + len(ticketList) > len(self.idColumn):
+            self.grow()
+
+        # Columns are filled with one assignment per column
+        firstRow = self.rowCount
+        lastRow  = firstRow + len(ticketList)
+        self.rowCount = lastRow
+
+        self.idColumn[firstRow:lastRow]       = [ticket.id for ticket in ticketList]
+        self.statusColumn[firstRow:lastRow]   = [ticket.status for ticket in ticketList]
+        self.priorityColumn[firstRow:lastRow] = [ticket.priority for ticket in ticketList]
+
+        for (row, ticket) in enumerate(ticketList, firstRow):
+            self.ticketById[ticket.id] = ticket
+            self.rowById[ticket.id]    = row
+
+            for tagId in ticket.tagIds:
+                self.addTagRow(tagId, row)
+
+        return ErrorCode.kOk
+
+    def deleteTicket(self, ticket):
+        row = self.rowById.pop(ticket.id)
+        del self.ticketById[ticket.id]
+
+        # The row stays until the next compaction, it never matches a status
+        self.statusColumn[row] = ColumnTicketStore.kNoStatus
+        self.deadCount = self.deadCount + 1
+
+        if self.deadCount > self.rowCount / 2:
+            self.compact()
+
+    # Changed tickets are replaced by an updated copy, see TicketStore
+    def setTicketStatus(self, ticket, status):
+        ticket = ticket.clone()
+        ticket.setStatus(status)
+        self.ticketById[ticket.id] = ticket
+        self.statusColumn[self.rowById[ticket.id]] = status
+
+        return ticket
+
+    def setTicketsStatus(self, ticketList, status):
+        ticketList = [ticket.clone() for ticket in ticketList]
+        for ticket in ticketList:
+            ticket.setStatus(status)
+            self.ticketById[ticket.id] = ticket
+
+        self.statusColumn[[self.rowById[ticket.id] for ticket in ticketList]] = status
+
+        return ticketList
+
+    def addTagToTicket(self, ticket, tag):
+        ticket = ticket.clone()
+        ticket.addTag(tag)
+        self.ticketById[ticket.id] = ticket
+        self.addTagRow(tag.id, self.rowById[ticket.id])
+
+        return ticket
+
+    def addTagToTickets(self, ticketList, tag):
+        ticketList = [ticket.clone() for ticket in ticketList]
+        for ticket in ticketList:
+            ticket.addTag(tag)
+            self.ticketById[ticket.id] = ticket
+
+        self.rowsByTag.setdefault(tag.id, []).extend([self.rowById[ticket.id] for ticket in ticketList])
+        self.rowArrayByTag.pop(tag.id, None)
+
+        return ticketList
+
+    def hasTag(self, ticket, tagId):
+        return tagId in ticket.tagIds
+
+    def findRows(self, status, priority = None, tagId = None):
+        mask = (self.statusColumn[:self.rowCount] == status)
+        if priority != None:
+            mask &= (self.priorityColumn[:self.rowCount] == priority)
+
+        if tagId != None:
+            tagRows = self.getTagRows(tagId)
+            return tagRows[mask[tagRows]]
+        else:
+            return numpy.flatnonzero(mask)
+
+    def findTicketIds(self, status, priority = None, tagId = None):
+        # Rows are appended in id order, selected ids are already sorted
+        return self.idColumn[self.findRows(status, priority, tagId)].tolist()
+
+    def findTicketIdPage(self, status, priority = None, tagId = None, afterId = 0, limit = None):
+        if limit == None:
+            return [ticketId for ticketId in self.findTicketIds(status, priority, tagId) if ticketId > afterId]
+
+        # Ids are sorted, the cursor is found by a binary search
+        startRow = int(numpy.searchsorted(self.idColumn[:self.rowCount], afterId, side="right"))
+        if tagId != None:
+            candidateRows = self.getTagRows(tagId)
+            candidateRows = candidateRows[numpy.searchsorted(candidateRows, startRow):]
+        else:
+            candidateRows = numpy.arange(startRow, self.rowCount)
+
+        # Only mask growing chunks of rows after the cursor until the page is full
+        ticketIds = []
+        position  = 0
+        chunkSize = ColumnTicketStore.kPageChunkSize
+        while position < len(candidateRows) and len(ticketIds) < limit:
+            rows = candidateRows[position:position + chunkSize]
+            mask = (self.statusColumn[rows] == status)
+            if priority != None:
+                mask &= (self.priorityColumn[rows] == priority)
+
+            ticketIds.extend(self.idColumn[rows[mask]].tolist())
+            position  = position + chunkSize
+            chunkSize = chunkSize * 2
+
+        return ticketIds[:limit]
+
+    def countTicketIds(self, status, priority = None, tagId = None):
+        return len(self.findRows(status, priority, tagId))
+
+    def buildTicketCounters(self):
+        ticketCounters = TicketCounters()
+
+        # Status and priority fit in a byte, count each (status, priority) pair at once
+        pairs = self.statusColumn[:self.rowCount].astype(numpy.int64) * 256 + self.priorityColumn[:self.rowCount]
+        pairCounts = numpy.bincount(pairs)
+        for pair in numpy.flatnonzero(pairCounts).tolist():
+            (status, priority) = divmod(pair, 256)
+            if status != ColumnTicketStore.kNoStatus:
+                ticketCounters.addTickets(status, priority, int(pairCounts[pair]))
+
+        for tagId in self.rowsByTag.keys():
+            statusCounts = numpy.bincount(self.statusColumn[self.getTagRows(tagId)])
+            for status in numpy.flatnonzero(statusCounts).tolist():
+                if status != ColumnTicketStore.kNoStatus:
+                    ticketCounters.addTaggedTickets(status, tagId, int(statusCounts[status]))
+
+        return ticketCounters
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asynchat
+import asyncore
+import itertools
+import json
+import os
+import re
+import socket
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+from libtodomanager.todomanager import *
+from libtodomanager.stats import *
+
+__all__ = ["HttpError", "HttpApi", "HttpChannel", "HttpServer"]
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def decodeText(text):
+    # Descriptions and names are stored as typed, they are not always UTF-8
+    if isinstance(text, str):
+        return text.decode("utf-8", "replace")
+
+    return text
+
+class HttpApi:
+    kDefaultPageSize = 100
+    kMaxPageSize     = 1000
+
+    kPriorityByName = {
+        "high":   TicketPriority.kHigh,
+        "normal": TicketPriority.kNormal,
+        "low":    TicketPriority.kLow,
+    }
+
+    def __init__(self, todo):
+        self.todo = todo
+
+        # Generations start from 0 in each process, the prefix tells them apart
+        self.etagPrefix = os.urandom(4).encode("hex")
+
+        self.routeList = [
+            (re.compile(r"^/tags$"), self.getTags),
+            (re.compile(r"^/tags/(\d+)$"), self.getTag),
+            (re.compile(r"^/tickets/opened$"), self.getOpenedTickets),
+            (re.compile(r"^/tickets/opened/count$"), self.getOpenedTicketsCount),
+            (re.compile(r"^/tickets/(\d+)$"), self.getTicket),
+            (re.compile(r"^/search$"), self.searchTickets),
+        ]
+
+    def getETag(self):
+        return '"%s-%d"' % (self.etagPrefix, self.todo.getGeneration())
+
+    def handleRequest(self, method, target, headerByName):
+        start = globalStats.start()
+        try:
+            response = self.buildResponse(method, target, headerByName)
+        except Exception, e:
+            # Only this request fails, the connection and the requests
+            # pipelined after it are kept
+            response = (500, [], json.dumps({"error": "Internal error: %s" % (e.__class__.__name__)}))
+        globalStats.stop("http.request", start)
+        globalStats.addCount("http.status.%d" % (response[0]))
+
+        return response
+
+    def buildResponse(self, method, target, headerByName):
+        # Returns the status, the extra headers and the JSON body
+        if method not in ["GET", "HEAD"]:
+            return (405, [("Allow", "GET, HEAD")], json.dumps({"error": "Method not allowed"}))
+
+        (path, separator, query) = target.partition("?")
+
+        # Stats change without the content, they have no ETag
+        if path == "/stats":
+            return (200, [("Cache-Control", "no-cache")], globalStats.toJson())
+
+        # Any mutation changes the generation, when it did not change the
+        # client copy is still valid and nothing is queried
+        etag = self.getETag()
+        matchList = [match.strip() for match in headerByName.get("if-none-match", "").split(",")]
+        if etag in matchList or "*" in matchList:
+            return (304, [("ETag", etag)], "")
+
+        paramByName = dict([(name, valueList[-1]) for (name, valueList) in urlparse.parse_qs(query).items()])
+
+        try:
+            for (pattern, handler) in self.routeList:
+                match = pattern.match(path)
+                if match != None:
+                    content = handler(paramByName, *match.groups())
+                    return (200, [("ETag", etag)], json.dumps(content))
+
+            raise HttpError(404, "Unknown path '%s'" % path)
+        except HttpError, e:
+            return (e.status, [], json.dumps({"error": decodeText(str(e))}))
+
+    def getIntParam(self, paramByName, name, default):
+        if name not in paramByName:
+            return default
+
+        try:
+            return int(paramByName[name])
+        except ValueError:
+            raise HttpError(400, "Unable to cast '%s' to integer" % name)
+
+    def getPageSize(self, paramByName):
+        limit = self.getIntParam(paramByName, "limit", HttpApi.kDefaultPageSize)
+        if limit <= 0:
+            raise HttpError(400, "The limit must be positive")
+
+        return min(limit, HttpApi.kMaxPageSize)
+
+    def getTagParam(self, paramByName):
+        if "tag" not in paramByName:
+            return None
+
+        tag = self.todo.getTagByName(paramByName["tag"])
+        if tag == None:
+            raise HttpError(404, "Tag '%s' not found" % paramByName["tag"])
+
+        return tag
+
+    def getPriorityParam(self, paramByName):
+        if "priority" not in paramByName:
+            return None
+
+        priority = HttpApi.kPriorityByName.get(paramByName["priority"].lower())
+        if priority == None:
+            raise HttpError(400, "Unknown priority '%s'" % paramByName["priority"])
+
+        return priority
+
+    def tagToJson(self, tag):
+        return {"id": tag.getId(), "name": decodeText(tag.getName())}
+
+    def ticketToJson(self, ticket):
+        return {
+            "id":          ticket.getId(),
+            "description": decodeText(ticket.getDescription()),
+            "priority":    TicketPriority.toString(ticket.getPriority()).lower(),
+            "status":      TicketStatus.toString(ticket.getStatus()).lower(),
+            "tags":        [decodeText(tag.getName()) for tag in ticket.getTagList()],
+        }
+
+    def getTags(self, paramByName):
+        return {"tags": [self.tagToJson(tag) for tag in self.todo.getTagList()]}
+
+    def getTag(self, paramByName, tagId):
+        tag = self.todo.getTagById(int(tagId))
+        if tag == None:
+            raise HttpError(404, "Tag %s not found" % tagId)
+
+        return self.tagToJson(tag)
+
+    def getTicket(self, paramByName, ticketId):
+        ticket = self.todo.getTicketById(int(ticketId))
+        if ticket == None:
+            raise HttpError(404, "Ticket %s not found" % ticketId)
+
+        return self.ticketToJson(ticket)
+
+    def getOpenedTickets(self, paramByName):
+        # Paged like printOpenedTicketList, "next" is the cursor of the next page
+        tag      = self.getTagParam(paramByName)
+        priority = self.getPriorityParam(paramByName)
+        afterId  = self.getIntParam(paramByName, "after", 0)
+        limit    = self.getPageSize(paramByName)
+
+        if tag != None:
+            ticketList = list(itertools.islice(self.todo.iterOpenedTicketsByTag(tag, afterId), limit))
+        elif priority != None:
+            ticketList = list(itertools.islice(self.todo.iterOpenedTicketsByPriority(priority, afterId), limit))
+        else:
+            ticketList = self.todo.getOpenedTicketsPage(limit, afterId).getContent()
+
+        nextId = None
+        if len(ticketList) == limit:
+            nextId = ticketList[-1].getId()
+
+        return {"tickets": [self.ticketToJson(ticket) for ticket in ticketList], "next": nextId}
+
+    def getOpenedTicketsCount(self, paramByName):
+        tag      = self.getTagParam(paramByName)
+        priority = self.getPriorityParam(paramByName)
+
+        if tag != None:
+            count = self.todo.getOpenedTicketsCountByTag(tag)
+        elif priority != None:
+            count = self.todo.getOpenedTicketsCountByPriority(priority)
+        else:
+            count = self.todo.getOpenedTicketsCount()
+
+        return {"count": count}
+
+    def searchTickets(self, paramByName):
+        if "q" not in paramByName:
+            raise HttpError(400, "Missing parameter 'q'")
+
+        ticketList = self.todo.searchTickets(paramByName["q"], self.getPageSize(paramByName)).getContent()
+        return {"tickets": [self.ticketToJson(ticket) for ticket in ticketList]}
+
+class HttpChannel(asynchat.async_chat):
+    kMaxHeaderSize = 64 * 1024
+
+    def __init__(self, sock, api, socketMap = None):
+        asynchat.async_chat.__init__(self, sock, socketMap)
+        self.api       = api
+        self.inputList = []
+        self.inputSize = 0
+        self.closing   = False
+        self.set_terminator("\r\n\r\n")
+
+    def collect_incoming_data(self, data):
+        if self.closing:
+            return
+
+        self.inputList.append(data)
+        self.inputSize = self.inputSize + len(data)
+        if self.inputSize > HttpChannel.kMaxHeaderSize:
+            self.sendResponse("GET", 400, [], json.dumps({"error": "Request header too large"}), False)
+
+    def found_terminator(self):
+        # Pipelined requests are already in the input buffer, asynchat calls
+        # this once for each of them and the responses are pushed in order
+        header = "".join(self.inputList).lstrip("\r\n")
+        self.inputList = []
+        self.inputSize = 0
+        if self.closing:
+            return
+
+        lineList = header.split("\r\n")
+        requestLine = lineList[0].split()
+        if len(requestLine) != 3 or requestLine[2].startswith("HTTP/") == False:
+            self.sendResponse("GET", 400, [], json.dumps({"error": "Malformed request line"}), False)
+            return
+
+        (method, target, version) = requestLine
+
+        headerByName = {}
+        for line in lineList[1:]:
+            (name, separator, value) = line.partition(":")
+            headerByName[name.strip().lower()] = value.strip()
+
+        connection = headerByName.get("connection", "").lower()
+        if version == "HTTP/1.0":
+            keepAlive = (connection == "keep-alive")
+        else:
+            keepAlive = (connection != "close")
+
+        # Without bodies the next request starts right after the headers, one
+        # with a body cannot be skipped reliably
+        if headerByName.get("content-length", "0") != "0" or "transfer-encoding" in headerByName:
+            self.sendResponse(method, 400, [], json.dumps({"error": "Request bodies are not supported"}), False)
+            return
+
+        (status, headerList, body) = self.api.handleRequest(method, target, headerByName)
+        self.sendResponse(method, status, headerList, body, keepAlive)
+
+    def sendResponse(self, method, status, headerList, body, keepAlive):
+        lineList = ["HTTP/1.1 %d %s" % (status, BaseHTTPRequestHandler.responses[status][0])]
+        for (name, value) in headerList:
+            lineList.append("%s: %s" % (name, value))
+
+        if status != 304:
+            lineList.append("Content-Type: application/json")
+            lineList.append("Content-Length: %d" % len(body))
+        lineList.append("Connection: %s" % ("keep-alive" if keepAlive else "close"))
+
+        if method == "HEAD" or status == 304:
+            body = ""
+
+        self.push("\r\n".join(lineList) + "\r\n\r\n" + body)
+
+        if keepAlive == False:
+            self.closing = True
+            self.close_when_done()
+
+class HttpServer(asyncore.dispatcher):
+    # Single threaded, the content is only used from the thread which runs the
+    # asyncore loop, like the other servers registered in the same socket map
+    def __init__(self, address, todo, socketMap = None):
+        asyncore.dispatcher.__init__(self, map=socketMap)
+        self.api       = HttpApi(todo)
+        self.socketMap = socketMap
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(128)
+
+    def getAddress(self):
+        return self.socket.getsockname()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair != None:
+            # Responses to pipelined requests are sent one by one, Nagle's
+            # algorithm would hold them until the client's delayed ACK
+            pair[0].setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            HttpChannel(pair[0], self.api, self.socketMap)
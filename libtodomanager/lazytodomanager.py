@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+
+__all__ = ["LazyTodoManager"]
+
+class LazyTodoManager:
+    # Stands for a TodoManager which is only loaded when it is first used. The
+    # slow part of the load, which must not need the content, may run in the
+    # background meanwhile.
+    def __init__(self, loader, backgroundLoader = None):
+        self.loader       = loader
+        self.todo         = None
+        self.loaderThread = None
+
+        if backgroundLoader != None:
+            self.loaderThread = threading.Thread(target=backgroundLoader)
+            self.loaderThread.start()
+
+    def isLoaded(self):
+        return self.todo != None
+
+    def waitForBackgroundLoader(self):
+        if self.loaderThread != None:
+            self.loaderThread.join()
+            self.loaderThread = None
+
+    def getTodoManager(self):
+        if self.todo == None:
+            self.waitForBackgroundLoader()
+            self.todo = self.loader()
+
+        return self.todo
+
+    def __getattr__(self, name):
+        return getattr(self.getTodoManager(), name)
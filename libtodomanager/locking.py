@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import thread
+import threading
+
+__all__ = ["ReadWriteLock"]
+
+class ReadWriteLock:
+    # Any number of readers or a single writer. Waiting writers are served
+    # before new readers so a steady flow of readers cannot starve them.
+    # Both sides are reentrant and the writer may also take the read side.
+    def __init__(self):
+        self.mutex              = threading.Lock()
+        self.condition          = threading.Condition(self.mutex)
+        self.readerCount        = 0
+        self.waitingWriterCount = 0
+        self.writerId           = None
+        self.writerDepth        = 0
+        self.local              = threading.local()
+
+    def getReadDepth(self):
+        return getattr(self.local, "readDepth", 0)
+
+    def acquireRead(self):
+        readDepth = getattr(self.local, "readDepth", 0)
+        if readDepth > 0:
+            self.local.readDepth = readDepth + 1
+            return
+
+        # The writer is not counted as a reader, which is remembered for the
+        # release as the write lock may be released first
+        if self.writerId != None and self.writerId == thread.get_ident():
+            self.local.readDepth      = 1
+            self.local.readUnderWrite = True
+            return
+
+        # The mutex is used directly, readers are on the hot path
+        self.mutex.acquire()
+        try:
+            while self.writerId != None or self.waitingWriterCount > 0:
+                self.condition.wait()
+            self.readerCount = self.readerCount + 1
+        finally:
+            self.mutex.release()
+
+        self.local.readDepth      = 1
+        self.local.readUnderWrite = False
+
+    def releaseRead(self):
+        readDepth = self.local.readDepth - 1
+        self.local.readDepth = readDepth
+        if readDepth > 0 or self.local.readUnderWrite:
+            return
+
+        self.mutex.acquire()
+        self.readerCount = self.readerCount - 1
+        if self.readerCount == 0 and self.waitingWriterCount > 0:
+            self.condition.notify_all()
+        self.mutex.release()
+
+    def acquireWrite(self):
+        threadId = thread.get_ident()
+        if self.writerId == threadId:
+            self.writerDepth = self.writerDepth + 1
+            return
+
+        # Upgrading would deadlock as soon as two readers try it
+        if self.getReadDepth() > 0:
+            raise RuntimeError("Cannot acquire the write lock while holding the read lock")
+
+        with self.condition:
+            self.waitingWriterCount = self.waitingWriterCount + 1
+            while self.writerId != None or self.readerCount > 0:
+                self.condition.wait()
+            self.waitingWriterCount = self.waitingWriterCount - 1
+            self.writerId    = threadId
+            self.writerDepth = 1
+
+    def releaseWrite(self):
+        self.writerDepth = self.writerDepth - 1
+        if self.writerDepth > 0:
+            return
+
+        with self.condition:
+            self.writerId = None
+            self.condition.notify_all()
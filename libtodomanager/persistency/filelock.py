@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from libtodomanager.todomanager import *
+
+# Advisory locks are only available on Unix, elsewhere locking is a no-op
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ["FileLock"]
+
+class FileLock:
+    # The lock is taken on a side file, the data files are replaced by a rename
+    # when they are saved and cannot hold it
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.lockFile = None
+
+    def acquire(self, operation):
+        if fcntl == None:
+            return ErrorCode.kOk
+
+        try:
+            self.lockFile = open(self.filePath, 'ab')
+        except IOError:
+            return ErrorCode.kFailToOpenFile
+
+        fcntl.flock(self.lockFile.fileno(), operation)
+        return ErrorCode.kOk
+
+    def acquireShared(self):
+        return self.acquire(fcntl.LOCK_SH if fcntl != None else None)
+
+    def acquireExclusive(self):
+        return self.acquire(fcntl.LOCK_EX if fcntl != None else None)
+
+    def release(self):
+        if self.lockFile != None:
+            # Closing the file releases the lock
+            self.lockFile.close()
+            self.lockFile = None
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import pickle
+import os
+from libtodomanager.todomanager import *
+from libtodomanager.persistency.pickleserializer import *
+from libtodomanager.stats import *
+
+__all__ = ["JournalSerializer"]
+
+class JournalSerializer:
+    # Above this size, the journal is merged into a new snapshot
+    kDefaultMaxJournalSize = 1024 * 1024
+
+    def __init__(self, filePath, maxJournalSize = kDefaultMaxJournalSize):
+        self.filePath           = filePath
+        self.journalPath        = "%s.journal" % filePath
+        self.maxJournalSize     = maxJournalSize
+        self.snapshotSerializer = PickleSerializer(filePath)
+        self.fileLock           = self.snapshotSerializer.fileLock
+
+        # Size of the journal the content comes from, with the version of the
+        # snapshot it tells whether another process saved since
+        self.journalSize        = 0
+
+    def load(self):
+        # Shared, a compaction must not remove the journal between the
+        # snapshot and the journal reads
+        res = self.fileLock.acquireShared()
+        if res != ErrorCode.kOk:
+            return (res, TodoManager(serializer=self))
+
+        try:
+            return self.readContent()
+        finally:
+            self.fileLock.release()
+
+    def readContent(self):
+        (res, todo) = self.snapshotSerializer.load()
+        self.journalSize = 0
+
+        try:
+            journalFile = open(self.journalPath, 'r+b')
+        except IOError:
+            todo.setSerializer(self)
+            return (res, todo)
+
+        validSize = 0
+        while True:
+            try:
+                change = pickle.load(journalFile)
+            except EOFError:
+                break
+            except Exception:
+                # Partially written record, the mutation was never acknowledged
+                break
+
+            todo.applyChange(change)
+            validSize = journalFile.tell()
+
+        journalFile.truncate(validSize)
+        journalFile.close()
+        self.journalSize = validSize
+
+        todo.clearChangeList()
+        todo.setSerializer(self)
+        return (ErrorCode.kOk, todo)
+
+    def save(self, todo):
+        changeList = todo.getChangeList()
+        if len(changeList) == 0:
+            return ErrorCode.kOk
+
+        # When another process saved since the content was loaded, its changes
+        # are read and the pending ones are replayed over them, then it is
+        # tried again
+        while True:
+            res = self.fileLock.acquireExclusive()
+            if res != ErrorCode.kOk:
+                return res
+
+            try:
+                if self.isStale() == False:
+                    res = self.appendChanges(todo.getChangeList())
+                    break
+            finally:
+                self.fileLock.release()
+
+            # Without the saved content, the changes would be replayed over
+            # an empty one which would replace it
+            (res, latestTodo) = self.load()
+            if res != ErrorCode.kOk:
+                return res
+
+            todo.rebase(latestTodo)
+
+        if res == ErrorCode.kOk and self.journalSize > self.maxJournalSize:
+            return self.compact(todo)
+
+        return res
+
+    def isStale(self):
+        if self.snapshotSerializer.readVersion() != self.snapshotSerializer.version:
+            return True
+
+        try:
+            return os.path.getsize(self.journalPath) != self.journalSize
+        except OSError:
+            return self.journalSize != 0
+
+    def appendChanges(self, changeList):
+        start = globalStats.start()
+        data = "".join([pickle.dumps(change, pickle.HIGHEST_PROTOCOL) for change in changeList])
+
+        try:
+            journalFile = open(self.journalPath, 'ab')
+        except IOError:
+            return ErrorCode.kFailToOpenFile
+
+        journalFile.write(data)
+        self.journalSize = journalFile.tell()
+        journalFile.close()
+        globalStats.addCount("journal.bytesWritten", len(data))
+        globalStats.stop("journal.append", start)
+
+        return ErrorCode.kOk
+
+    def compact(self, todo):
+        # Pickled without the lock. When another process saved meanwhile, the
+        # compaction is left to one of its next saves.
+        start = globalStats.start()
+        data = pickle.dumps(todo)
+        globalStats.stop("journal.compactDump", start)
+
+        res = self.fileLock.acquireExclusive()
+        if res != ErrorCode.kOk:
+            return res
+
+        try:
+            if self.isStale():
+                return ErrorCode.kOk
+
+            res = self.snapshotSerializer.writeContent(data)
+            if res != ErrorCode.kOk:
+                return res
+
+            # Replaying the journal is idempotent, a crash before this point only
+            # leaves changes which are already part of the snapshot
+            os.remove(self.journalPath)
+            self.journalSize = 0
+        finally:
+            self.fileLock.release()
+
+        return ErrorCode.kOk
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import mmap
+import os
+import pickle
+import struct
+from libtodomanager.todomanager import *
+
+__all__ = ["MmapTicketStore", "MmapSerializer"]
+
+# Record file : header, then one fixed size record per ticket sorted by id
+# Heap file   : magic, then descriptions, tag id arrays and tag tables, appended
+#
+# Header : magic, version, record size, record count, tag last id,
+#          ticket last id, tag table offset, tag table size, heap size
+# Record : id, status, priority, tag count, tag offset, description offset,
+#          description length
+#
+# Both files grow geometrically, the header tells how much of them is used.
+# Files written before the heap size was kept have 0 there, their whole heap
+# is used.
+#
+# Changes are part of the files at the save, when the header is written.
+# Appended data is not referenced before it, changes to the records already
+# saved are kept in memory until it.
+kMagic          = "TODOMMAP"
+kHeapMagic      = "TODOHEAP"
+kVersion        = 1
+kHeaderFormat   = "<8sIIqqqqqq"
+kHeaderSize     = 64
+kRecordFormat   = "<qbbxxIqqI4x"
+kRecordSize     = struct.calcsize(kRecordFormat)
+kIdFormat       = "<q"
+kIdStatusFormat = "<qbb"
+kStatusOffset   = 8
+kTagFieldFormat = "<Iq"
+kTagFieldOffset = 12
+
+class MmapTicketStore:
+    # Decoded tickets are kept until this count is reached, then the cache is flushed
+    kMaxCachedTickets = 10000
+
+    # Status of the records of removed tickets
+    kNoStatus = 0
+
+    def __init__(self, recordFile, heapFile, recordCount, heapSize):
+        self.recordFile  = recordFile
+        self.heapFile    = heapFile
+        self.recordCount = recordCount
+        self.ticketCache = {}
+        self.rowById     = {}
+
+        # Changed records by row, written to the record file by flush
+        self.pendingRecordByRow = {}
+
+        # Data appended after a crash is never referenced by a header, it is overwritten
+        self.heapSize = heapSize
+
+        self.recordMap = None
+        self.heapMap   = None
+        self.remap()
+
+    def remap(self):
+        self.close()
+        self.recordMap = mmap.mmap(self.recordFile.fileno(), 0)
+        self.heapMap   = mmap.mmap(self.heapFile.fileno(), 0)
+
+    def reserve(self, recordCount, heapSize):
+        # Files at least double when they grow, the mappings are rarely rebuilt
+        recordFileSize = self.getRecordOffset(recordCount)
+        if recordFileSize <= len(self.recordMap) and heapSize <= len(self.heapMap):
+            return
+
+        for (dataFile, dataMap, size) in [(self.recordFile, self.recordMap, recordFileSize),
+                                          (self.heapFile, self.heapMap, heapSize)]:
+            if size > len(dataMap):
+                dataFile.truncate(max(size, 2 * len(dataMap)))
+
+        self.remap()
+
+    def close(self):
+        if self.recordMap != None:
+            self.recordMap.close()
+            self.heapMap.close()
+            self.recordMap = None
+            self.heapMap   = None
+
+    def flush(self):
+        for (row, record) in self.pendingRecordByRow.iteritems():
+            offset = self.getRecordOffset(row)
+            self.recordMap[offset:offset + kRecordSize] = str(record)
+        self.pendingRecordByRow = {}
+
+        self.recordMap.flush()
+        self.heapMap.flush()
+
+    def getRecordOffset(self, row):
+        return kHeaderSize + row * kRecordSize
+
+    def getRecordId(self, row):
+        # Ids never change, the pending records are not looked at
+        return struct.unpack_from(kIdFormat, self.recordMap, self.getRecordOffset(row))[0]
+
+    def readRecord(self, row, format, fieldOffset = 0):
+        record = self.pendingRecordByRow.get(row)
+        if record != None:
+            return struct.unpack_from(format, record, fieldOffset)
+
+        return struct.unpack_from(format, self.recordMap, self.getRecordOffset(row) + fieldOffset)
+
+    def writeRecord(self, row, format, fieldOffset, *valueList):
+        record = self.pendingRecordByRow.get(row)
+        if record == None:
+            offset = self.getRecordOffset(row)
+            record = bytearray(self.recordMap[offset:offset + kRecordSize])
+            self.pendingRecordByRow[row] = record
+
+        struct.pack_into(format, record, fieldOffset, *valueList)
+
+    def findFirstRowAfter(self, ticketId):
+        # Records are sorted by id
+        low  = 0
+        high = self.recordCount
+        while low < high:
+            middle = (low + high) / 2
+            if self.getRecordId(middle) <= ticketId:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def findRow(self, ticketId):
+        row = self.rowById.get(ticketId)
+        if row == None:
+            row = self.findFirstRowAfter(ticketId) - 1
+            if row < 0 or self.getRecordId(row) != ticketId:
+                return None
+
+        return row
+
+    def appendHeap(self, data):
+        offset = self.heapSize
+        self.reserve(self.recordCount, offset + len(data))
+        self.heapMap[offset:offset + len(data)] = data
+        self.heapSize = offset + len(data)
+
+        return offset
+
+    def packTagIds(self, tagIds):
+        return struct.pack("<%dq" % len(tagIds), *tagIds)
+
+    def readTagIds(self, tagCount, tagOffset):
+        return struct.unpack_from("<%dq" % tagCount, self.heapMap, tagOffset)
+
+    def decodeTicket(self, row):
+        (ticketId, status, priority, tagCount, tagOffset, descriptionOffset, descriptionLength) = \
+            self.readRecord(row, kRecordFormat)
+        if status == MmapTicketStore.kNoStatus:
+            return None
+
+        ticket = Ticket()
+        ticket.setId(ticketId)
+        ticket.setStatus(status)
+        ticket.setPriority(priority)
+        ticket.setDescription(self.heapMap[descriptionOffset:descriptionOffset + descriptionLength])
+        ticket.tagIds = self.readTagIds(tagCount, tagOffset)
+
+        self.cacheTicket(ticket, row)
+        return ticket
+
+    def cacheTicket(self, ticket, row):
+        if len(self.ticketCache) >= MmapTicketStore.kMaxCachedTickets:
+            self.ticketCache = {}
+            self.rowById     = {}
+
+        self.ticketCache[ticket.id] = ticket
+        self.rowById[ticket.id]     = row
+
+    def iterRows(self, startRow = 0):
+        # Only the id, status and priority of each record are read
+        for row in xrange(startRow, self.recordCount):
+            if row in self.pendingRecordByRow:
+                (ticketId, status, priority) = struct.unpack_from(kIdStatusFormat, self.pendingRecordByRow[row])
+            else:
+                (ticketId, status, priority) = struct.unpack_from(kIdStatusFormat, self.recordMap, self.getRecordOffset(row))
+            if status != MmapTicketStore.kNoStatus:
+                yield (row, ticketId, status, priority)
+
+    def getRowTagIds(self, row):
+        (tagCount, tagOffset) = self.readRecord(row, kTagFieldFormat, kTagFieldOffset)
+        return self.readTagIds(tagCount, tagOffset)
+
+    def getTicket(self, ticketId):
+        ticket = self.ticketCache.get(ticketId)
+        if ticket == None:
+            row = self.findRow(ticketId)
+            if row != None:
+                ticket = self.decodeTicket(row)
+
+        return ticket
+
+    def getTickets(self, ticketIds):
+        return [self.getTicket(ticketId) for ticketId in ticketIds]
+
+    def getTicketsById(self, ticketIds):
+        ticketById = {}
+
+        for ticketId in ticketIds:
+            ticket = self.getTicket(ticketId)
+            if ticket != None:
+                ticketById[ticketId] = ticket
+
+        return ticketById
+
+    def getTicketList(self):
+        return [self.getTicket(ticketId) for (row, ticketId, status, priority) in self.iterRows()]
+
+    def getTicketCount(self):
+        return sum(1 for rowInfo in self.iterRows())
+
+    def iterTicketDescriptions(self):
+        # Descriptions are read from the heap without decoding the tickets
+        for row in xrange(self.recordCount):
+            (ticketId, status, priority, tagCount, tagOffset, descriptionOffset, descriptionLength) = \
+                self.readRecord(row, kRecordFormat)
+            if status != MmapTicketStore.kNoStatus:
+                yield (ticketId, self.heapMap[descriptionOffset:descriptionOffset + descriptionLength])
+
+    def insertTicket(self, ticket):
+        return self.insertTickets([ticket])
+
+    def insertTickets(self, ticketList):
+        # Ids are allocated in increasing order, appending keeps the records sorted
+        heapData   = []
+        recordData = []
+        heapOffset = self.heapSize
+
+        for ticket in ticketList:
+            description = ticket.description
+            if isinstance(description, unicode):
+                description = description.encode("utf-8")
+            tagData = self.packTagIds(ticket.tagIds)
+
+            recordData.append(struct.pack(kRecordFormat, ticket.id, ticket.status, ticket.priority, len(ticket.tagIds),
+                                          heapOffset + len(description), heapOffset, len(description)))
+            heapData.append(description)
+            heapData.append(tagData)
+            heapOffset = heapOffset + len(description) + len(tagData)
+
+        self.appendHeap("".join(heapData))
+
+        recordData = "".join(recordData)
+        recordOffset = self.getRecordOffset(self.recordCount)
+        self.reserve(self.recordCount + len(ticketList), self.heapSize)
+        self.recordMap[recordOffset:recordOffset + len(recordData)] = recordData
+
+        firstRow = self.recordCount
+        self.recordCount = self.recordCount + len(ticketList)
+
+        for (row, ticket) in enumerate(ticketList, firstRow):
+            self.cacheTicket(ticket, row)
+
+        return ErrorCode.kOk
+
+    def deleteTicket(self, ticket):
+        row = self.findRow(ticket.id)
+        self.writeRecord(row, "<b", kStatusOffset, MmapTicketStore.kNoStatus)
+
+        self.ticketCache.pop(ticket.id, None)
+        self.rowById.pop(ticket.id, None)
+
+    # Changed tickets are replaced by an updated copy in the cache, see TicketStore
+    def setTicketStatus(self, ticket, status):
+        # Written in place at the save, the record keeps its size
+        row = self.findRow(ticket.id)
+        self.writeRecord(row, "<b", kStatusOffset, status)
+
+        ticket = ticket.clone()
+        ticket.setStatus(status)
+        self.cacheTicket(ticket, row)
+
+        return ticket
+
+    def setTicketsStatus(self, ticketList, status):
+        return [self.setTicketStatus(ticket, status) for ticket in ticketList]
+
+    def addTagToTicket(self, ticket, tag):
+        return self.addTagToTickets([ticket], tag)[0]
+
+    def addTagToTickets(self, ticketList, tag):
+        # The grown tag array is appended to the heap, the record points to it
+        rowList = [self.findRow(ticket.id) for ticket in ticketList]
+        ticketList = [ticket.clone() for ticket in ticketList]
+        for (row, ticket) in zip(rowList, ticketList):
+            ticket.addTag(tag)
+            self.cacheTicket(ticket, row)
+
+        tagOffsetList = [self.appendHeap(self.packTagIds(ticket.tagIds)) for ticket in ticketList]
+
+        for (row, ticket, tagOffset) in zip(rowList, ticketList, tagOffsetList):
+            self.writeRecord(row, kTagFieldFormat, kTagFieldOffset, len(ticket.tagIds), tagOffset)
+
+        return ticketList
+
+    def hasTag(self, ticket, tagId):
+        return tagId in ticket.tagIds
+
+    def iterMatchingIds(self, status, priority, tagId, startRow = 0):
+        for (row, ticketId, rowStatus, rowPriority) in self.iterRows(startRow):
+            if rowStatus != status:
+                continue
+            elif priority != None and rowPriority != priority:
+                continue
+            elif tagId != None and tagId not in self.getRowTagIds(row):
+                continue
+
+            yield ticketId
+
+    def findTicketIds(self, status, priority = None, tagId = None):
+        return list(self.iterMatchingIds(status, priority, tagId))
+
+    def findTicketIdPage(self, status, priority = None, tagId = None, afterId = 0, limit = None):
+        if limit != None and limit <= 0:
+            return []
+
+        # The scan starts at the cursor and stops at the page size
+        ticketIds = []
+        for ticketId in self.iterMatchingIds(status, priority, tagId, self.findFirstRowAfter(afterId)):
+            if len(ticketIds) == limit:
+                break
+            ticketIds.append(ticketId)
+
+        return ticketIds
+
+    def countTicketIds(self, status, priority = None, tagId = None):
+        return sum(1 for ticketId in self.iterMatchingIds(status, priority, tagId))
+
+    def buildTicketCounters(self):
+        ticketCounters = TicketCounters()
+
+        for (row, ticketId, status, priority) in self.iterRows():
+            ticketCounters.addTickets(status, priority, 1)
+            for tagId in self.getRowTagIds(row):
+                ticketCounters.addTaggedTickets(status, tagId, 1)
+
+        return ticketCounters
+
+class MmapSerializer:
+    def __init__(self, filePath):
+        self.filePath    = filePath
+        self.heapPath    = "%s.heap" % filePath
+        self.ticketStore = None
+
+    def open(self):
+        if self.ticketStore != None:
+            return ErrorCode.kOk
+
+        try:
+            if os.path.exists(self.filePath) == False:
+                self.createFiles(self.filePath, self.heapPath)
+
+            recordFile = open(self.filePath, 'r+b')
+            heapFile   = open(self.heapPath, 'r+b')
+        except IOError:
+            return ErrorCode.kFailToOpenFile
+
+        header = struct.unpack_from(kHeaderFormat, recordFile.read(kHeaderSize))
+        (magic, version, recordSize, recordCount, tagLastId, ticketLastId, tagTableOffset, tagTableSize, heapSize) = header
+        if magic != kMagic or version != kVersion or recordSize != kRecordSize:
+            recordFile.close()
+            heapFile.close()
+            return ErrorCode.kFailToOpenFile
+
+        if heapSize == 0:
+            heapFile.seek(0, os.SEEK_END)
+            heapSize = heapFile.tell()
+
+        self.header      = header
+        self.ticketStore = MmapTicketStore(recordFile, heapFile, recordCount, heapSize)
+
+        return ErrorCode.kOk
+
+    def close(self):
+        if self.ticketStore != None:
+            self.ticketStore.close()
+            self.ticketStore.recordFile.close()
+            self.ticketStore.heapFile.close()
+            self.ticketStore = None
+
+    def createFiles(self, filePath, heapPath):
+        heapFile = open(heapPath, 'wb')
+        heapFile.write(kHeapMagic)
+        heapFile.close()
+
+        recordFile = open(filePath, 'wb')
+        recordFile.write(struct.pack(kHeaderFormat, kMagic, kVersion, kRecordSize, 0, 0, 0, 0, 0, len(kHeapMagic)))
+        recordFile.close()
+
+    def load(self):
+        isNew = (os.path.exists(self.filePath) == False)
+
+        res = self.open()
+        if res != ErrorCode.kOk:
+            return (res, TodoManager(serializer=self))
+
+        todo = TodoManager(serializer=self, ticketStore=self.ticketStore)
+        if isNew:
+            return (ErrorCode.kFailToOpenFile, todo)
+
+        # Only the header and the tags are read, tickets are decoded on access
+        (magic, version, recordSize, recordCount, tagLastId, ticketLastId, tagTableOffset, tagTableSize, heapSize) = self.header
+        if tagTableSize > 0:
+            heapMap = self.ticketStore.heapMap
+            (tagList, removedTagList) = pickle.loads(heapMap[tagTableOffset:tagTableOffset + tagTableSize])
+            for (tagId, tagName) in tagList:
+                todo.insertTag(self.createTag(tagId, tagName))
+            for (tagId, tagName) in removedTagList:
+                todo.removedTagById[tagId] = self.createTag(tagId, tagName)
+
+        todo.tagLastId    = tagLastId
+        todo.ticketLastId = ticketLastId
+
+        return (ErrorCode.kOk, todo)
+
+    def createTag(self, tagId, tagName):
+        tag = Tag()
+        tag.setId(tagId)
+        tag.setName(tagName)
+        return tag
+
+    def save(self, todo):
+        tagsChanged = False
+        for change in todo.getChangeList():
+            if change[0] == ChangeType.kAddTag or change[0] == ChangeType.kRemoveTag:
+                tagsChanged = True
+                break
+
+        return self.writeHeader(todo, tagsChanged)
+
+    def writeHeader(self, todo, writeTagTable):
+        # The ticket store writes the changed records, the header makes the
+        # appended ones visible. Tags are few, a new table is appended to the
+        # heap when they change.
+        ticketStore = self.ticketStore
+        (magic, version, recordSize, recordCount, tagLastId, ticketLastId, tagTableOffset, tagTableSize, heapSize) = self.header
+
+        if writeTagTable:
+            tagTable = pickle.dumps(([(tag.id, tag.name) for tag in todo.tagList],
+                                     [(tag.id, tag.name) for tag in todo.removedTagById.values()]),
+                                    pickle.HIGHEST_PROTOCOL)
+            tagTableOffset = ticketStore.appendHeap(tagTable)
+            tagTableSize   = len(tagTable)
+
+        # The header is written last, it never refers to data which is not on disk
+        ticketStore.flush()
+
+        self.header = (kMagic, kVersion, kRecordSize, ticketStore.recordCount, todo.tagLastId, todo.ticketLastId,
+                       tagTableOffset, tagTableSize, ticketStore.heapSize)
+        struct.pack_into(kHeaderFormat, ticketStore.recordMap, 0, *self.header)
+        ticketStore.recordMap.flush()
+
+        return ErrorCode.kOk
+
+    def importTodoManager(self, sourceTodo):
+        # The content of the files is replaced
+        self.close()
+        try:
+            self.createFiles(self.filePath, self.heapPath)
+        except IOError:
+            return ErrorCode.kFailToOpenFile
+
+        res = self.open()
+        if res != ErrorCode.kOk:
+            return res
+
+        todo = TodoManager(serializer=self, ticketStore=self.ticketStore)
+        for tag in sourceTodo.tagList:
+            todo.insertTag(tag.clone())
+        for tag in sourceTodo.removedTagById.values():
+            todo.removedTagById[tag.id] = tag.clone()
+
+        self.ticketStore.insertTickets([ticket.clone() for ticket in sourceTodo.ticketStore.getTicketList()])
+        todo.tagLastId    = sourceTodo.tagLastId
+        todo.ticketLastId = sourceTodo.ticketLastId
+
+        return self.writeHeader(todo, True)
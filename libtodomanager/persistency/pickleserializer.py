@@ -21,29 +21,101 @@
 import pickle
 import os
 from libtodomanager.todomanager import *
+from libtodomanager.persistency.filelock import *
+from libtodomanager.stats import *
 
 __all__ = ["PickleSerializer"]
 
 class PickleSerializer:
     def __init__(self, filePath):
         self.filePath = filePath
-    
+        self.fileLock = FileLock("%s.lock" % filePath)
+
+        # Version of the file the content comes from, it is stored in front of
+        # the content and increased by each save
+        self.version  = 0
+
     def load(self):
+        # Saves replace the file by a rename, reading it needs no lock
+        (res, version, todo) = self.readContent()
+        self.version = version
+        if res != ErrorCode.kOk:
+            return (res, TodoManager(serializer=self))
+
+        todo.setSerializer(self)
+        return (ErrorCode.kOk, todo)
+
+    def save(self, todo):
+        # Optimistic, the lock only covers the version check and the rename.
+        # When another process saved since the content was loaded, its content
+        # is read and the pending changes are replayed over it, then it is tried
+        # again.
+        while True:
+            start = globalStats.start()
+            data = pickle.dumps(todo)
+            globalStats.stop("pickle.dump", start)
+
+            res = self.fileLock.acquireExclusive()
+            if res != ErrorCode.kOk:
+                return res
+
+            try:
+                if self.readVersion() == self.version:
+                    return self.writeContent(data)
+            finally:
+                self.fileLock.release()
+
+            globalStats.addCount("pickle.rebases")
+            (res, version, latestTodo) = self.readContent()
+            self.version = version
+            if res == ErrorCode.kOk:
+                todo.rebase(latestTodo)
+
+    def readContent(self):
         try:
             srcFile = open(self.filePath, 'rb')
         except IOError:
-            return (ErrorCode.kFailToOpenFile, TodoManager(serializer=self.filePath))
+            return (ErrorCode.kFailToOpenFile, 0, None)
+
+        version = pickle.load(srcFile)
+        if isinstance(version, TodoManager):
+            # Written before the version was stored
+            (version, todo) = (0, version)
+        else:
+            todo = pickle.load(srcFile)
 
-        todo = pickle.load(srcFile)
         srcFile.close()
-        return (ErrorCode.kOk, todo)
+        return (ErrorCode.kOk, version, todo)
 
-    def save(self, todo):
+    def readVersion(self):
+        try:
+            srcFile = open(self.filePath, 'rb')
+        except IOError:
+            return 0
+
+        version = pickle.load(srcFile)
+        srcFile.close()
+
+        if isinstance(version, TodoManager):
+            return 0
+
+        return version
+
+    def writeContent(self, data):
+        # Only called with the exclusive lock held
+        start = globalStats.start()
         tmpPath = "%s.tmp" % self.filePath
-        dumpFile = open(tmpPath, 'wb')
-        if dumpFile == None:
+        try:
+            dumpFile = open(tmpPath, 'wb')
+        except IOError:
             return ErrorCode.kFailToOpenFile
 
-        pickle.dump(todo, dumpFile)
+        pickle.dump(self.version + 1, dumpFile)
+        dumpFile.write(data)
+        globalStats.addCount("pickle.bytesWritten", dumpFile.tell())
         dumpFile.close()
         os.rename(tmpPath, self.filePath)
+        self.version = self.version + 1
+        globalStats.stop("pickle.write", start)
+
+        return ErrorCode.kOk
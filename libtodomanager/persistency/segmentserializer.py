@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import multiprocessing
+import pickle
+import os
+from libtodomanager.todomanager import *
+from libtodomanager.stats import *
+
+__all__ = ["SegmentSerializer"]
+
+def readSegmentStates(segmentPath):
+    # Run by the worker processes. Plain tuples are much cheaper than tickets
+    # to send back to the loading process.
+    try:
+        srcFile = open(segmentPath, 'rb')
+    except IOError:
+        return []
+
+    ticketList = pickle.load(srcFile)
+    srcFile.close()
+
+    return [ticket.__getstate__() for ticket in ticketList]
+
+class SegmentSerializer:
+    # Count of consecutive ticket ids stored in a segment file
+    kDefaultSegmentSize = 1000
+
+    kVersion = 1
+
+    def __init__(self, filePath, segmentSize = kDefaultSegmentSize, processCount = None):
+        self.filePath    = filePath
+        self.segmentSize = segmentSize
+
+        # Segments are loaded by a pool of processes, one per core by default
+        if processCount == None:
+            processCount = multiprocessing.cpu_count()
+        self.processCount = processCount
+
+    def getSegmentPath(self, segment):
+        return "%s.%d" % (self.filePath, segment)
+
+    def getSegment(self, ticketId):
+        return (ticketId - 1) / self.segmentSize
+
+    def writeFile(self, path, content):
+        start = globalStats.start()
+        tmpPath = "%s.tmp" % path
+        try:
+            dumpFile = open(tmpPath, 'wb')
+        except IOError:
+            return ErrorCode.kFailToOpenFile
+
+        pickle.dump(content, dumpFile, pickle.HIGHEST_PROTOCOL)
+        globalStats.addCount("segment.bytesWritten", dumpFile.tell())
+
+        # On disk before the rename, so that after a crash the manifest never
+        # references a segment which was not written
+        dumpFile.flush()
+        os.fsync(dumpFile.fileno())
+        dumpFile.close()
+        os.rename(tmpPath, path)
+        globalStats.stop("segment.write", start)
+
+        return ErrorCode.kOk
+
+    def readFile(self, path):
+        srcFile = open(path, 'rb')
+        content = pickle.load(srcFile)
+        srcFile.close()
+
+        return content
+
+    def load(self):
+        try:
+            manifest = self.readFile(self.filePath)
+        except IOError:
+            return (ErrorCode.kFailToOpenFile, TodoManager(serializer=self))
+
+        # Segments keep the size they were written with
+        self.segmentSize = manifest["segmentSize"]
+
+        todo = TodoManager(serializer=self)
+        for tag in manifest["tagList"]:
+            todo.insertTag(tag)
+        for tag in manifest["removedTagList"]:
+            todo.removedTagById[tag.id] = tag
+
+        segmentPathList = [self.getSegmentPath(segment) for segment in range(self.getSegment(manifest["ticketLastId"]) + 1)]
+        if self.processCount > 1 and len(segmentPathList) > 1:
+            ticketLastId = self.loadSegmentsInParallel(todo, segmentPathList)
+        else:
+            ticketLastId = 0
+            for segmentPath in segmentPathList:
+                try:
+                    ticketList = self.readFile(segmentPath)
+                except IOError:
+                    # Every ticket of the segment has been removed
+                    continue
+
+                todo.insertTickets(ticketList)
+                if len(ticketList) > 0:
+                    ticketLastId = max(ticketLastId, ticketList[-1].id)
+
+        # A save which stopped before the manifest may have written tickets
+        # with greater ids, they are never given again
+        tagIdList = [tag.id for tag in manifest["tagList"] + manifest["removedTagList"]]
+        todo.tagLastId    = max([manifest["tagLastId"]] + tagIdList)
+        todo.ticketLastId = max(manifest["ticketLastId"], ticketLastId)
+
+        return (ErrorCode.kOk, todo)
+
+    def loadSegmentsInParallel(self, todo, segmentPathList):
+        pool = multiprocessing.Pool(min(self.processCount, len(segmentPathList)))
+        ticketLastId = 0
+        try:
+            # Results come back in segment order, tickets are inserted as with a serial load
+            for stateList in pool.imap(readSegmentStates, segmentPathList):
+                ticketList = []
+                for state in stateList:
+                    ticket = Ticket()
+                    ticket.__setstate__(state)
+                    ticketList.append(ticket)
+
+                todo.insertTickets(ticketList)
+                if len(ticketList) > 0:
+                    ticketLastId = max(ticketLastId, ticketList[-1].id)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return ticketLastId
+
+    def save(self, todo):
+        if os.path.exists(self.filePath):
+            dirtySegmentSet = set()
+            manifestDirty = False
+
+            # Each ticket change only dirties the segment of its ticket
+            for change in todo.getChangeList():
+                if change[0] == ChangeType.kAddTag or change[0] == ChangeType.kRemoveTag:
+                    manifestDirty = True
+                else:
+                    dirtySegmentSet.add(self.getSegment(change[1]))
+                    if change[0] == ChangeType.kAddTicket:
+                        manifestDirty = True
+        else:
+            dirtySegmentSet = set(range(self.getSegment(todo.ticketLastId) + 1))
+            manifestDirty = True
+
+        for segment in sorted(dirtySegmentSet):
+            res = self.saveSegment(todo, segment)
+            if res != ErrorCode.kOk:
+                return res
+
+        # The manifest is written last, a new segment is never referenced before it exists
+        if manifestDirty:
+            manifest = {
+                "version":        SegmentSerializer.kVersion,
+                "segmentSize":    self.segmentSize,
+                "tagList":        todo.tagList,
+                "removedTagList": todo.removedTagById.values(),
+                "tagLastId":      todo.tagLastId,
+                "ticketLastId":   todo.ticketLastId,
+            }
+
+            return self.writeFile(self.filePath, manifest)
+
+        return ErrorCode.kOk
+
+    def saveSegment(self, todo, segment):
+        firstId = segment * self.segmentSize + 1
+        ticketIds = range(firstId, firstId + self.segmentSize)
+        ticketList = todo.ticketStore.getTicketsById(ticketIds).values()
+        ticketList.sort(key=lambda ticket: ticket.id)
+
+        segmentPath = self.getSegmentPath(segment)
+        if len(ticketList) > 0:
+            return self.writeFile(segmentPath, ticketList)
+        elif os.path.exists(segmentPath):
+            os.remove(segmentPath)
+
+        return ErrorCode.kOk
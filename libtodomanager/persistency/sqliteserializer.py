@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import sqlite3
+from libtodomanager.todomanager import *
+from libtodomanager.stats import *
+
+__all__ = ["SqliteTicketStore", "SqliteSerializer"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tag (
+    id      INTEGER PRIMARY KEY,
+    name    TEXT NOT NULL,
+    removed INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS ticket (
+    id          INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    priority    INTEGER NOT NULL,
+    status      INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ticket_tag (
+    ticket_id INTEGER NOT NULL,
+    tag_id    INTEGER NOT NULL,
+    PRIMARY KEY (ticket_id, tag_id)
+);
+
+CREATE INDEX IF NOT EXISTS ticket_status ON ticket (status);
+CREATE INDEX IF NOT EXISTS ticket_status_priority ON ticket (status, priority);
+CREATE INDEX IF NOT EXISTS ticket_tag_tag ON ticket_tag (tag_id, ticket_id);
+"""
+
+class SqliteTicketStore:
+    # Loaded tickets are kept until this count is reached, then the cache is flushed
+    kMaxCachedTickets = 10000
+
+    # Max count of ids in a single "IN (...)" clause
+    kMaxQueryIds = 500
+
+    def __init__(self, connection):
+        self.connection  = connection
+        self.ticketCache = {}
+
+    def cacheTicket(self, ticket):
+        if len(self.ticketCache) >= SqliteTicketStore.kMaxCachedTickets:
+            self.ticketCache = {}
+
+        self.ticketCache[ticket.id] = ticket
+
+    def loadTickets(self, ticketIds):
+        ticketById = {}
+
+        for i in range(0, len(ticketIds), SqliteTicketStore.kMaxQueryIds):
+            chunk = ticketIds[i:i + SqliteTicketStore.kMaxQueryIds]
+            placeholders = ", ".join(["?"] * len(chunk))
+
+            cursor = self.connection.execute(
+                "SELECT id, description, priority, status FROM ticket WHERE id IN (%s)" % placeholders, chunk)
+            for (ticketId, description, priority, status) in cursor:
+                ticket = Ticket()
+                ticket.setId(ticketId)
+                ticket.setDescription(description)
+                ticket.setPriority(priority)
+                ticket.setStatus(status)
+                ticketById[ticketId] = ticket
+
+            cursor = self.connection.execute(
+                "SELECT ticket_id, tag_id FROM ticket_tag WHERE ticket_id IN (%s) ORDER BY rowid" % placeholders, chunk)
+            for (ticketId, tagId) in cursor:
+                ticket = ticketById[ticketId]
+                ticket.tagIds = ticket.tagIds + (tagId,)
+
+        for ticket in ticketById.values():
+            self.cacheTicket(ticket)
+
+        return ticketById
+
+    def getTicket(self, ticketId):
+        ticket = self.ticketCache.get(ticketId)
+        if ticket == None:
+            ticket = self.loadTickets([ticketId]).get(ticketId)
+
+        return ticket
+
+    def getTickets(self, ticketIds):
+        ticketById = {}
+        missingIds = []
+
+        for ticketId in ticketIds:
+            ticket = self.ticketCache.get(ticketId)
+            if ticket != None:
+                ticketById[ticketId] = ticket
+            else:
+                missingIds.append(ticketId)
+
+        ticketById.update(self.loadTickets(missingIds))
+
+        return [ticketById[ticketId] for ticketId in ticketIds]
+
+    def getTicketsById(self, ticketIds):
+        ticketById = {}
+        missingIds = []
+
+        for ticketId in set(ticketIds):
+            ticket = self.ticketCache.get(ticketId)
+            if ticket != None:
+                ticketById[ticketId] = ticket
+            else:
+                missingIds.append(ticketId)
+
+        ticketById.update(self.loadTickets(missingIds))
+
+        return ticketById
+
+    def getTicketList(self):
+        cursor = self.connection.execute("SELECT id FROM ticket ORDER BY id")
+        return self.getTickets([row[0] for row in cursor])
+
+    def getTicketCount(self):
+        return self.connection.execute("SELECT COUNT(*) FROM ticket").fetchone()[0]
+
+    def iterTicketDescriptions(self):
+        # Only the descriptions are read, the tickets are not loaded in the cache
+        return self.connection.execute("SELECT id, description FROM ticket")
+
+    def insertTicket(self, ticket):
+        return self.insertTickets([ticket])
+
+    def insertTickets(self, ticketList):
+        # Nothing of the batch is kept when one of its ids is already taken
+        try:
+            self.connection.execute("SAVEPOINT insert_tickets")
+            self.connection.executemany("INSERT INTO ticket (id, description, priority, status) VALUES (?, ?, ?, ?)",
+                                        [(ticket.id, ticket.description, ticket.priority, ticket.status) for ticket in ticketList])
+
+            self.connection.executemany("INSERT INTO ticket_tag (ticket_id, tag_id) VALUES (?, ?)",
+                                        [(ticket.id, tagId) for ticket in ticketList for tagId in ticket.tagIds])
+            self.connection.execute("RELEASE insert_tickets")
+        except sqlite3.IntegrityError:
+            self.connection.execute("ROLLBACK TO insert_tickets")
+            self.connection.execute("RELEASE insert_tickets")
+            return ErrorCode.kWriteConflict
+
+        for ticket in ticketList:
+            self.cacheTicket(ticket)
+
+        return ErrorCode.kOk
+
+    def deleteTicket(self, ticket):
+        self.connection.execute("DELETE FROM ticket_tag WHERE ticket_id = ?", (ticket.id,))
+        self.connection.execute("DELETE FROM ticket WHERE id = ?", (ticket.id,))
+        self.ticketCache.pop(ticket.id, None)
+
+    # Changed tickets are replaced by an updated copy in the cache, see TicketStore
+    def setTicketStatus(self, ticket, status):
+        return self.setTicketsStatus([ticket], status)[0]
+
+    def setTicketsStatus(self, ticketList, status):
+        self.connection.executemany("UPDATE ticket SET status = ? WHERE id = ?", [(status, ticket.id) for ticket in ticketList])
+
+        ticketList = [ticket.clone() for ticket in ticketList]
+        for ticket in ticketList:
+            ticket.setStatus(status)
+            self.cacheTicket(ticket)
+
+        return ticketList
+
+    def addTagToTicket(self, ticket, tag):
+        return self.addTagToTickets([ticket], tag)[0]
+
+    def addTagToTickets(self, ticketList, tag):
+        self.connection.executemany("INSERT INTO ticket_tag (ticket_id, tag_id) VALUES (?, ?)",
+                                    [(ticket.id, tag.id) for ticket in ticketList])
+
+        ticketList = [ticket.clone() for ticket in ticketList]
+        for ticket in ticketList:
+            ticket.addTag(tag)
+            self.cacheTicket(ticket)
+
+        return ticketList
+
+    def hasTag(self, ticket, tagId):
+        cursor = self.connection.execute("SELECT 1 FROM ticket_tag WHERE ticket_id = ? AND tag_id = ?", (ticket.id, tagId))
+        return cursor.fetchone() != None
+
+    def buildCondition(self, status, priority, tagId):
+        condition = "status = ?"
+        params    = [status]
+
+        if priority != None:
+            condition = condition + " AND priority = ?"
+            params.append(priority)
+
+        if tagId != None:
+            condition = condition + " AND id IN (SELECT ticket_id FROM ticket_tag WHERE tag_id = ?)"
+            params.append(tagId)
+
+        return (condition, params)
+
+    def findTicketIds(self, status, priority = None, tagId = None):
+        (condition, params) = self.buildCondition(status, priority, tagId)
+        cursor = self.connection.execute("SELECT id FROM ticket WHERE %s ORDER BY id" % condition, params)
+
+        return [row[0] for row in cursor]
+
+    def findTicketIdPage(self, status, priority = None, tagId = None, afterId = 0, limit = None):
+        (condition, params) = self.buildCondition(status, priority, tagId)
+        if limit == None:
+            # A negative limit means no limit for SQLite
+            limit = -1
+        elif limit <= 0:
+            return []
+
+        # The primary key is walked from the cursor, the query stops at the page size
+        cursor = self.connection.execute("SELECT id FROM ticket WHERE %s AND id > ? ORDER BY id LIMIT ?" % condition,
+                                         params + [afterId, limit])
+
+        return [row[0] for row in cursor]
+
+    def buildTicketCounters(self):
+        ticketCounters = TicketCounters()
+
+        cursor = self.connection.execute("SELECT status, priority, COUNT(*) FROM ticket GROUP BY status, priority")
+        for (status, priority, count) in cursor:
+            ticketCounters.addTickets(status, priority, count)
+
+        cursor = self.connection.execute(
+            "SELECT ticket.status, ticket_tag.tag_id, COUNT(*) FROM ticket_tag JOIN ticket ON ticket.id = ticket_tag.ticket_id "
+            "GROUP BY ticket.status, ticket_tag.tag_id")
+        for (status, tagId, count) in cursor:
+            ticketCounters.addTaggedTickets(status, tagId, count)
+
+        return ticketCounters
+
+    def countTicketIds(self, status, priority = None, tagId = None):
+        (condition, params) = self.buildCondition(status, priority, tagId)
+        cursor = self.connection.execute("SELECT COUNT(*) FROM ticket WHERE %s" % condition, params)
+
+        return cursor.fetchone()[0]
+
+class SqliteSerializer:
+    def __init__(self, filePath):
+        self.filePath      = filePath
+        self.connection    = None
+
+        # Set from the first change to the save, the write lock is held meanwhile
+        self.inTransaction = False
+
+        # Version of the file the content comes from, it is stored in the meta
+        # and increased by each save
+        self.version       = 0
+
+    def open(self):
+        if self.connection != None:
+            return ErrorCode.kOk
+
+        try:
+            # Transactions are started by hand, sqlite3 would only take the
+            # write lock at the first write
+            self.connection = sqlite3.connect(self.filePath, isolation_level=None)
+            self.connection.text_factory = str
+            self.connection.executescript(SCHEMA)
+        except sqlite3.Error:
+            self.connection = None
+            return ErrorCode.kFailToOpenFile
+
+        return ErrorCode.kOk
+
+    def close(self):
+        if self.connection != None:
+            self.connection.close()
+            self.connection = None
+            self.inTransaction = False
+
+    def load(self):
+        res = self.open()
+        if res != ErrorCode.kOk:
+            return (res, TodoManager(serializer=self))
+
+        return self.readContent()
+
+    def readContent(self):
+        self.version = self.readVersion()
+        todo = TodoManager(serializer=self, ticketStore=SqliteTicketStore(self.connection))
+
+        # Tags are few, they are all loaded. Tickets are loaded on demand by the store.
+        cursor = self.connection.execute("SELECT id, name, removed FROM tag ORDER BY id")
+        for (tagId, tagName, removed) in cursor:
+            tag = Tag()
+            tag.setId(tagId)
+            tag.setName(tagName)
+            if removed:
+                todo.removedTagById[tagId] = tag
+            else:
+                todo.insertTag(tag)
+
+        if self.connection.execute("SELECT COUNT(*) FROM meta").fetchone()[0] == 0:
+            return (ErrorCode.kFailToOpenFile, todo)
+
+        (todo.tagLastId, todo.ticketLastId) = self.readLastIds()
+
+        return (ErrorCode.kOk, todo)
+
+    def readLastIds(self):
+        # The meta holds the ids of the last save, the tables the ones of the
+        # changes written since
+        meta = dict(self.connection.execute("SELECT key, value FROM meta"))
+        tagMaxId    = self.connection.execute("SELECT IFNULL(MAX(id), 0) FROM tag").fetchone()[0]
+        ticketMaxId = self.connection.execute("SELECT IFNULL(MAX(id), 0) FROM ticket").fetchone()[0]
+
+        return (max(meta.get("tagLastId", 0), tagMaxId), max(meta.get("ticketLastId", 0), ticketMaxId))
+
+    def readVersion(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row == None:
+            # Written before the version was stored
+            return 0
+
+        return row[0]
+
+    def beginChange(self, todo):
+        # The write lock is taken before the first change and kept until the
+        # save, so the ids are allocated after the ones of the other processes
+        if self.inTransaction:
+            return ErrorCode.kOk
+
+        res = self.open()
+        if res != ErrorCode.kOk:
+            return res
+
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Still locked by another process once the busy timeout expired
+            return ErrorCode.kWriteConflict
+
+        self.inTransaction = True
+
+        # When another process saved since the content was read, its content
+        # is read and the pending changes are replayed over it
+        if self.readVersion() != self.version:
+            globalStats.addCount("sqlite.rebases")
+            (res, latestTodo) = self.readContent()
+            todo.rebase(latestTodo)
+
+        (tagLastId, ticketLastId) = self.readLastIds()
+        todo.tagLastId    = max(todo.tagLastId, tagLastId)
+        todo.ticketLastId = max(todo.ticketLastId, ticketLastId)
+
+        return ErrorCode.kOk
+
+    def endChange(self, todo):
+        # A change which failed left nothing to save, the lock is not kept
+        # until a save which would not come
+        if self.inTransaction and len(todo.getChangeList()) == 0:
+            self.connection.rollback()
+            self.inTransaction = False
+
+    def rollback(self):
+        # The changes written by the store since the save are undone with the
+        # transaction, the content is then read again. A file never saved reads
+        # as an empty content.
+        if self.inTransaction:
+            self.connection.rollback()
+            self.inTransaction = False
+
+        (res, todo) = self.readContent()
+        return (ErrorCode.kOk, todo)
+
+    def save(self, todo):
+        # Ticket changes are already written by the ticket store, only the tags
+        # and the last allocated ids remain
+        try:
+            self.connection.execute("SAVEPOINT save")
+            for change in todo.getChangeList():
+                if change[0] == ChangeType.kAddTag:
+                    (changeType, tagId, tagName) = change
+                    self.connection.execute("INSERT INTO tag (id, name, removed) VALUES (?, ?, 0)", (tagId, tagName))
+                elif change[0] == ChangeType.kRemoveTag:
+                    (changeType, tagId) = change
+                    self.connection.execute("UPDATE tag SET removed = 1 WHERE id = ?", (tagId,))
+
+            self.connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                        [("tagLastId", todo.tagLastId), ("ticketLastId", todo.ticketLastId),
+                                         ("version", self.version + 1)])
+            self.connection.execute("RELEASE save")
+        except (sqlite3.IntegrityError, sqlite3.OperationalError):
+            # A tag id written by another process or its lock held, the changes
+            # stay pending
+            self.connection.execute("ROLLBACK TO save")
+            self.connection.execute("RELEASE save")
+            return ErrorCode.kWriteConflict
+
+        start = globalStats.start()
+        self.connection.commit()
+        self.inTransaction = False
+        self.version = self.version + 1
+        globalStats.stop("sqlite.commit", start)
+
+        return ErrorCode.kOk
+
+    def importTodoManager(self, sourceTodo):
+        res = self.open()
+        if res != ErrorCode.kOk:
+            return res
+
+        ticketStore = SqliteTicketStore(self.connection)
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        for tag in sourceTodo.tagList:
+            self.connection.execute("INSERT OR REPLACE INTO tag (id, name, removed) VALUES (?, ?, 0)", (tag.id, tag.name))
+
+        for tag in sourceTodo.removedTagById.values():
+            self.connection.execute("INSERT OR REPLACE INTO tag (id, name, removed) VALUES (?, ?, 1)", (tag.id, tag.name))
+
+        res = ticketStore.insertTickets([ticket.clone() for ticket in sourceTodo.ticketStore.getTicketList()])
+        if res != ErrorCode.kOk:
+            self.connection.rollback()
+            return res
+
+        self.connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                    [("tagLastId", sourceTodo.tagLastId), ("ticketLastId", sourceTodo.ticketLastId),
+                                     ("version", self.readVersion() + 1)])
+        self.connection.commit()
+
+        return ErrorCode.kOk
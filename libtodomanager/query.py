@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import re
+from libtodomanager.todomanager import *
+from libtodomanager.textindex import *
+from libtodomanager.stats import *
+
+__all__ = ["QueryError", "IndexScan", "StatusIn", "PriorityIn", "HasTag", "TextMatch", "And", "Or", "Not",
+           "QueryPlanner", "QueryParser", "parseQuery"]
+
+class QueryError(Exception):
+    pass
+
+# Terms of a query. Each of them can estimate how many tickets it selects from
+# the counters, find their ids with the indexes and check a single ticket.
+
+class IndexScan:
+    # Looked up by the ticket store, once for each status and priority. A
+    # list left to None does not restrict the scan.
+    def __init__(self, statusList = None, priorityList = None, tag = None):
+        self.statusList   = statusList
+        self.priorityList = priorityList
+        self.tag          = tag
+
+    def getStatusList(self, planner):
+        if self.statusList == None:
+            return planner.getTicketCounters().getStatusList()
+
+        return self.statusList
+
+    def estimate(self, planner):
+        counters = planner.getTicketCounters()
+
+        count = 0
+        for status in self.getStatusList(planner):
+            statusCount = counters.getCount(status)
+            if self.priorityList != None:
+                statusCount = min(statusCount, sum([counters.getCountByPriority(status, priority)
+                                                    for priority in self.priorityList]))
+            if self.tag != None:
+                statusCount = min(statusCount, counters.getCountByTag(status, self.tag.getId()))
+            count = count + statusCount
+
+        return count
+
+    def findIds(self, planner):
+        priorityList = self.priorityList
+        if priorityList == None:
+            priorityList = [None]
+
+        tagId = None
+        if self.tag != None:
+            tagId = self.tag.getId()
+
+        ticketIds = set()
+        for status in self.getStatusList(planner):
+            for priority in priorityList:
+                ticketIds.update(planner.todo.findTicketIds(status, priority, tagId))
+                globalStats.addCount("query.lookups")
+
+        return ticketIds
+
+    def matches(self, ticket):
+        if self.statusList != None and ticket.getStatus() not in self.statusList:
+            return False
+        if self.priorityList != None and ticket.getPriority() not in self.priorityList:
+            return False
+        if self.tag != None and self.tag.getId() not in ticket.getTagIdList():
+            return False
+
+        return True
+
+    def toString(self):
+        termList = []
+        if self.statusList != None:
+            termList.append(StatusIn(self.statusList).toString())
+        if self.priorityList != None:
+            termList.append(PriorityIn(self.priorityList).toString())
+        if self.tag != None:
+            termList.append(HasTag(self.tag).toString())
+
+        if len(termList) == 0:
+            return "scan all"
+
+        return "scan %s" % (" ".join(termList))
+
+class StatusIn:
+    def __init__(self, statusList):
+        self.statusList = sorted(set(statusList))
+
+    def estimate(self, planner):
+        return IndexScan(statusList=self.statusList).estimate(planner)
+
+    def findIds(self, planner):
+        return IndexScan(statusList=self.statusList).findIds(planner)
+
+    def matches(self, ticket):
+        return ticket.getStatus() in self.statusList
+
+    def toString(self):
+        return "status:%s" % (",".join([TicketStatus.toString(status).lower() for status in self.statusList]))
+
+class PriorityIn:
+    def __init__(self, priorityList):
+        self.priorityList = sorted(set(priorityList))
+
+    def estimate(self, planner):
+        return IndexScan(priorityList=self.priorityList).estimate(planner)
+
+    def findIds(self, planner):
+        return IndexScan(priorityList=self.priorityList).findIds(planner)
+
+    def matches(self, ticket):
+        return ticket.getPriority() in self.priorityList
+
+    def toString(self):
+        return "priority:%s" % (",".join([TicketPriority.toString(priority).lower() for priority in self.priorityList]))
+
+class HasTag:
+    def __init__(self, tag):
+        self.tag = tag
+
+    def estimate(self, planner):
+        return IndexScan(tag=self.tag).estimate(planner)
+
+    def findIds(self, planner):
+        return IndexScan(tag=self.tag).findIds(planner)
+
+    def matches(self, ticket):
+        return self.tag.getId() in ticket.getTagIdList()
+
+    def toString(self):
+        return "tag:\"%s\"" % (self.tag.getName())
+
+class TextMatch:
+    # Every word has to be in the description
+    def __init__(self, text):
+        self.text = text
+
+    def estimate(self, planner):
+        return planner.todo.getTextIndex().getMatchCountBound(self.text)
+
+    def findIds(self, planner):
+        return planner.todo.getTextIndex().findDocumentIds(self.text)
+
+    def matches(self, ticket):
+        termSet = set(TextIndex.tokenize(self.text))
+        return len(termSet) != 0 and termSet.issubset(TextIndex.tokenize(ticket.getDescription()))
+
+    def toString(self):
+        return "text:\"%s\"" % (self.text)
+
+class And:
+    def __init__(self, termList):
+        self.termList = termList
+
+    def estimate(self, planner):
+        return min([term.estimate(planner) for term in self.termList])
+
+    def findIds(self, planner):
+        return planner.findConjunctionIds(self.termList)
+
+    def matches(self, ticket):
+        return all(term.matches(ticket) for term in self.termList)
+
+    def toString(self):
+        return "(%s)" % (" and ".join([term.toString() for term in self.termList]))
+
+class Or:
+    def __init__(self, termList):
+        self.termList = termList
+
+    def estimate(self, planner):
+        return sum([term.estimate(planner) for term in self.termList])
+
+    def findIds(self, planner):
+        ticketIds = set()
+        for term in self.termList:
+            ticketIds.update(term.findIds(planner))
+
+        return ticketIds
+
+    def matches(self, ticket):
+        return any(term.matches(ticket) for term in self.termList)
+
+    def toString(self):
+        return "(%s)" % (" or ".join([term.toString() for term in self.termList]))
+
+class Not:
+    def __init__(self, term):
+        self.term = term
+
+    def estimate(self, planner):
+        # Alone, every ticket is scanned
+        return planner.getTicketCounters().getTotalCount()
+
+    def findIds(self, planner):
+        return planner.findConjunctionIds([self])
+
+    def matches(self, ticket):
+        return self.term.matches(ticket) == False
+
+    def toString(self):
+        return "not %s" % (self.term.toString())
+
+class QueryPlanner:
+    # Checking a candidate costs a fetch, about as much as this many ids of an
+    # index. A term which selects more ids than that checks the candidates.
+    kCheckCost = 16
+
+    kStatusList   = [TicketStatus.kOpened, TicketStatus.kClosed, TicketStatus.kDelayed]
+    kPriorityList = [TicketPriority.kHigh, TicketPriority.kNormal, TicketPriority.kLow]
+
+    def __init__(self, todo):
+        self.todo     = todo
+        self.stepList = []
+
+    def getTicketCounters(self):
+        return self.todo.getTicketCounters()
+
+    def getStepList(self):
+        return self.stepList
+
+    def findTicketIds(self, term):
+        return sorted(term.findIds(self))
+
+    def findConjunctionIds(self, termList):
+        # Status, priority and tag terms are merged into a single store lookup,
+        # which is given the most selective tag
+        statusList   = None
+        priorityList = None
+        tagTermList  = []
+        textList     = []
+        positiveList = []
+        negatedList  = []
+
+        # Negated statuses and priorities are the other values, which the store
+        # looks up like any other
+        termList = [self.complement(term) for term in termList]
+
+        for term in termList:
+            if isinstance(term, StatusIn):
+                if statusList == None:
+                    statusList = term.statusList
+                else:
+                    statusList = [status for status in statusList if status in term.statusList]
+            elif isinstance(term, PriorityIn):
+                if priorityList == None:
+                    priorityList = term.priorityList
+                else:
+                    priorityList = [priority for priority in priorityList if priority in term.priorityList]
+            elif isinstance(term, HasTag):
+                tagTermList.append(term)
+            elif isinstance(term, TextMatch):
+                textList.append(term.text)
+            elif isinstance(term, Not):
+                negatedList.append(term.term)
+            else:
+                positiveList.append(term)
+
+        tag = None
+        if len(tagTermList) != 0:
+            tagTermList.sort(key=lambda term: IndexScan(statusList, priorityList, term.tag).estimate(self))
+            tag = tagTermList[0].tag
+            positiveList.extend(tagTermList[1:])
+
+        if len(textList) != 0:
+            positiveList.append(TextMatch(" ".join(textList)))
+
+        if statusList != None or priorityList != None or tag != None or len(positiveList) == 0:
+            positiveList.append(IndexScan(statusList, priorityList, tag))
+
+        # The smallest candidate set is found first, then only narrowed
+        estimateList = sorted([(term.estimate(self), i, term) for (i, term) in enumerate(positiveList)])
+
+        (estimate, i, driver) = estimateList[0]
+        ticketIds = driver.findIds(self)
+        self.stepList.append("find %s : %d ids, %d estimated" % (driver.toString(), len(ticketIds), estimate))
+
+        for (estimate, i, term) in estimateList[1:]:
+            ticketIds = self.narrow(ticketIds, term, estimate, False)
+
+        for term in negatedList:
+            ticketIds = self.narrow(ticketIds, term, term.estimate(self), True)
+
+        return ticketIds
+
+    def complement(self, term):
+        if isinstance(term, Not) and isinstance(term.term, StatusIn):
+            return StatusIn([status for status in QueryPlanner.kStatusList if status not in term.term.statusList])
+        elif isinstance(term, Not) and isinstance(term.term, PriorityIn):
+            return PriorityIn([priority for priority in QueryPlanner.kPriorityList
+                               if priority not in term.term.priorityList])
+
+        return term
+
+    def narrow(self, ticketIds, term, estimate, negated):
+        if len(ticketIds) == 0:
+            return ticketIds
+
+        candidateCount = len(ticketIds)
+        if estimate <= candidateCount * QueryPlanner.kCheckCost:
+            termIds = term.findIds(self)
+            if negated:
+                ticketIds = ticketIds - termIds
+                action = "exclude"
+            else:
+                ticketIds = ticketIds & termIds
+                action = "intersect"
+        else:
+            ticketList = self.todo.getTicketsFromIds(sorted(ticketIds)).getContent()
+            ticketIds = set([ticket.getId() for ticket in ticketList if term.matches(ticket) != negated])
+            globalStats.addCount("query.checkedTickets", candidateCount)
+            action = "check"
+            if negated:
+                action = "check not"
+
+        self.stepList.append("%s %s : %d -> %d ids" % (action, term.toString(), candidateCount, len(ticketIds)))
+        return ticketIds
+
+class QueryParser:
+    # Terms are "field:value[,value...]" or words of the description, they are
+    # combined with "and" (or nothing), "or", "not" (or a leading "-") and
+    # parentheses.
+    kTokenPattern = re.compile(r'\(|\)|(?:[^\s()"]|"[^"]*")+')
+    kValuePattern = re.compile(r'"[^"]*"|[^,]+')
+
+    kStatusByName = {
+        "opened":  TicketStatus.kOpened,
+        "closed":  TicketStatus.kClosed,
+        "delayed": TicketStatus.kDelayed,
+    }
+
+    kPriorityByName = {
+        "high":   TicketPriority.kHigh,
+        "normal": TicketPriority.kNormal,
+        "low":    TicketPriority.kLow,
+    }
+
+    def __init__(self, todo, text):
+        self.todo      = todo
+        self.tokenList = QueryParser.kTokenPattern.findall(text)
+        self.position  = 0
+
+    def peek(self):
+        if self.position == len(self.tokenList):
+            return None
+
+        return self.tokenList[self.position]
+
+    def next(self):
+        token = self.peek()
+        if token == None:
+            raise QueryError("Unexpected end of query")
+
+        self.position = self.position + 1
+        return token
+
+    def isKeyword(self, token, keyword):
+        return token != None and token.lower() == keyword
+
+    def parse(self):
+        if len(self.tokenList) == 0:
+            raise QueryError("Empty query")
+
+        term = self.parseOr()
+        if self.peek() != None:
+            raise QueryError("Unexpected '%s'" % (self.peek()))
+
+        return term
+
+    def parseOr(self):
+        termList = [self.parseAnd()]
+        while self.isKeyword(self.peek(), "or"):
+            self.next()
+            termList.append(self.parseAnd())
+
+        if len(termList) == 1:
+            return termList[0]
+
+        return Or(termList)
+
+    def parseAnd(self):
+        termList = [self.parseUnary()]
+        while self.peek() != None and self.peek() != ")" and self.isKeyword(self.peek(), "or") == False:
+            if self.isKeyword(self.peek(), "and"):
+                self.next()
+            termList.append(self.parseUnary())
+
+        if len(termList) == 1:
+            return termList[0]
+
+        return And(termList)
+
+    def parseUnary(self):
+        token = self.next()
+
+        if self.isKeyword(token, "not") or token == "-":
+            return Not(self.parseUnary())
+        elif token.startswith("-") and len(token) > 1:
+            return Not(self.parseTerm(token[1:]))
+        elif token == "(":
+            term = self.parseOr()
+            if self.peek() != ")":
+                raise QueryError("Missing ')'")
+            self.next()
+            return term
+        elif token == ")" or self.isKeyword(token, "and") or self.isKeyword(token, "or"):
+            raise QueryError("Unexpected '%s'" % (token))
+
+        return self.parseTerm(token)
+
+    def parseTerm(self, token):
+        (field, separator, value) = token.partition(":")
+        if separator == "":
+            return TextMatch(token.replace('"', ''))
+
+        field = field.lower()
+        valueList = [value.strip('"') for value in QueryParser.kValuePattern.findall(value)]
+        if len(valueList) == 0 or "" in valueList:
+            raise QueryError("Missing value of '%s'" % (field))
+
+        if field == "status":
+            return StatusIn([self.getValue(QueryParser.kStatusByName, "status", value) for value in valueList])
+        elif field == "priority":
+            return PriorityIn([self.getValue(QueryParser.kPriorityByName, "priority", value) for value in valueList])
+        elif field == "tag":
+            termList = [HasTag(self.getTag(value)) for value in valueList]
+            if len(termList) == 1:
+                return termList[0]
+            return Or(termList)
+        elif field == "text":
+            return TextMatch(" ".join(valueList))
+
+        raise QueryError("Unknown field '%s'" % (field))
+
+    def getValue(self, valueByName, field, name):
+        value = valueByName.get(name.lower())
+        if value == None:
+            raise QueryError("Unknown %s '%s'" % (field, name))
+
+        return value
+
+    def getTag(self, name):
+        tag = self.todo.getTagByName(name)
+        if tag == None:
+            raise QueryError("Unknown tag '%s'" % (name))
+
+        return tag
+
+def parseQuery(todo, text):
+    return QueryParser(todo, text).parse()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import timeit
+
+__all__ = ["Histogram", "Stats", "globalStats"]
+
+class Histogram:
+    # Bucket i counts the durations below 2^i microseconds
+    kBucketCount = 32
+
+    def __init__(self):
+        self.count    = 0
+        self.total    = 0.0
+        self.minimum  = None
+        self.maximum  = None
+        self.buckets  = [0] * Histogram.kBucketCount
+
+    def add(self, duration):
+        self.count = self.count + 1
+        self.total = self.total + duration
+        if self.minimum == None or duration < self.minimum:
+            self.minimum = duration
+        if self.maximum == None or duration > self.maximum:
+            self.maximum = duration
+
+        bucket = min(int(duration * 1e6).bit_length(), Histogram.kBucketCount - 1)
+        self.buckets[bucket] = self.buckets[bucket] + 1
+
+    def getPercentile(self, ratio):
+        # Upper bound of the bucket, it is never above the longest duration
+        if self.count == 0:
+            return None
+
+        rank = ratio * self.count
+        seen = 0
+        for (bucket, count) in enumerate(self.buckets):
+            seen = seen + count
+            if seen >= rank and count != 0:
+                return min((1 << bucket) / 1e6, self.maximum)
+
+        return self.maximum
+
+    def toDict(self):
+        # Trailing empty buckets are left out
+        lastBucket = max([-1] + [i for (i, count) in enumerate(self.buckets) if count != 0])
+
+        return {
+            "count"   : self.count,
+            "total"   : self.total,
+            "min"     : self.minimum,
+            "max"     : self.maximum,
+            "p50"     : self.getPercentile(0.5),
+            "p90"     : self.getPercentile(0.9),
+            "p99"     : self.getPercentile(0.99),
+            "buckets" : self.buckets[:lastBucket + 1],
+        }
+
+class Stats:
+    # Latency histograms of the phases and counters, nothing is recorded until
+    # it is enabled. Timed code does:
+    #
+    #   start = globalStats.start()
+    #   ...
+    #   globalStats.stop("phase", start)
+    #
+    # start() returns None while disabled, which makes stop() return at once.
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.histogramByPhase = {}
+        self.counterByName    = {}
+
+    def enable(self, enabled = True):
+        self.enabled = enabled
+
+    def isEnabled(self):
+        return self.enabled
+
+    def start(self):
+        if self.enabled:
+            return timeit.default_timer()
+        return None
+
+    def stop(self, phase, start):
+        if start == None:
+            return
+
+        duration = timeit.default_timer() - start
+        histogram = self.histogramByPhase.get(phase)
+        if histogram == None:
+            histogram = Histogram()
+            self.histogramByPhase[phase] = histogram
+        histogram.add(duration)
+
+    def addCount(self, name, count = 1):
+        if self.enabled:
+            self.counterByName[name] = self.counterByName.get(name, 0) + count
+
+    def getHistogram(self, phase):
+        return self.histogramByPhase.get(phase)
+
+    def getCount(self, name):
+        return self.counterByName.get(name, 0)
+
+    def toDict(self):
+        return {
+            "enabled"  : self.enabled,
+            "phases"   : dict([(phase, histogram.toDict()) for (phase, histogram) in self.histogramByPhase.items()]),
+            "counters" : dict(self.counterByName),
+        }
+
+    def toJson(self):
+        # Only imported when dumped, it is not needed to start
+        import json
+
+        return json.dumps(self.toDict(), sort_keys=True)
+
+    def toString(self):
+        lineList = []
+
+        if len(self.histogramByPhase) != 0:
+            lineList.append("%-32s %8s %10s %10s %10s %10s" % ("Phase", "Count", "Mean ms", "p50 ms", "p99 ms", "Max ms"))
+            for phase in sorted(self.histogramByPhase.keys()):
+                histogram = self.histogramByPhase[phase]
+                lineList.append("%-32s %8d %10.3f %10.3f %10.3f %10.3f" % (
+                    phase, histogram.count, histogram.total / histogram.count * 1e3,
+                    histogram.getPercentile(0.5) * 1e3, histogram.getPercentile(0.99) * 1e3,
+                    histogram.maximum * 1e3))
+
+        if len(self.counterByName) != 0:
+            lineList.append("%-32s %8s" % ("Counter", "Value"))
+            for name in sorted(self.counterByName.keys()):
+                lineList.append("%-32s %8d" % (name, self.counterByName[name]))
+
+        return "\n".join(lineList)
+
+# Shared by the shell, the commands and the serializers of the process
+globalStats = Stats()
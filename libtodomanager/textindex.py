@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import heapq
+import math
+import re
+
+__all__ = ["TextIndex"]
+
+class TextIndex:
+    kWordPattern = re.compile(r"\w+", re.UNICODE)
+
+    # Okapi BM25 parameters
+    kTermFrequencyWeight = 1.2
+    kLengthWeight        = 0.75
+
+    def __init__(self):
+        # Term -> {document id: term frequency}
+        self.postingsByTerm = {}
+        self.lengthById     = {}
+        self.totalLength    = 0
+
+    @staticmethod
+    def tokenize(text):
+        if isinstance(text, str):
+            text = text.decode("utf-8", "replace")
+
+        return [word.lower() for word in TextIndex.kWordPattern.findall(text)]
+
+    def getDocumentCount(self):
+        return len(self.lengthById)
+
+    def addDocument(self, documentId, text):
+        termList = TextIndex.tokenize(text)
+        for term in termList:
+            postings = self.postingsByTerm.setdefault(term, {})
+            postings[documentId] = postings.get(documentId, 0) + 1
+
+        self.lengthById[documentId] = len(termList)
+        self.totalLength = self.totalLength + len(termList)
+
+    def removeDocument(self, documentId, text):
+        for term in set(TextIndex.tokenize(text)):
+            postings = self.postingsByTerm[term]
+            del postings[documentId]
+            if len(postings) == 0:
+                del self.postingsByTerm[term]
+
+        self.totalLength = self.totalLength - self.lengthById.pop(documentId)
+
+    def getMatchCountBound(self, query):
+        # No more documents match than contain the rarest term
+        termSet = set(TextIndex.tokenize(query))
+        if len(termSet) == 0:
+            return 0
+
+        return min(len(self.postingsByTerm.get(term, ())) for term in termSet)
+
+    def findDocumentIds(self, query):
+        # Unranked, the documents which contain every term
+        termSet = set(TextIndex.tokenize(query))
+        if len(termSet) == 0:
+            return set()
+
+        postingsList = sorted([self.postingsByTerm.get(term, {}) for term in termSet], key=len)
+        return set(documentId for documentId in postingsList[0]
+                   if all(documentId in postings for postings in postingsList[1:]))
+
+    def search(self, query, limit = None):
+        termSet = set(TextIndex.tokenize(query))
+        if len(termSet) == 0:
+            return []
+
+        postingsList = [self.postingsByTerm.get(term) for term in termSet]
+        if None in postingsList:
+            return []
+
+        # Every term has to match, only the documents of the rarest term are scored
+        postingsList.sort(key=len)
+        documentCount = len(self.lengthById)
+        averageLength = float(self.totalLength) / documentCount
+        weightList = [math.log(1.0 + (documentCount - len(postings) + 0.5) / (len(postings) + 0.5))
+                      for postings in postingsList]
+
+        k1 = TextIndex.kTermFrequencyWeight
+        b  = TextIndex.kLengthWeight
+        scoredIds = []
+        for documentId in postingsList[0]:
+            lengthNorm = k1 * (1.0 - b + b * self.lengthById[documentId] / averageLength)
+            score = 0.0
+            for (postings, weight) in zip(postingsList, weightList):
+                frequency = postings.get(documentId)
+                if frequency == None:
+                    break
+                score = score + weight * frequency * (k1 + 1.0) / (frequency + lengthNorm)
+            else:
+                # Negated ids rank the oldest document first between equal scores
+                scoredIds.append((score, -documentId))
+
+        if limit == None:
+            scoredIds.sort(reverse=True)
+        else:
+            scoredIds = heapq.nlargest(limit, scoredIds)
+
+        return [-negatedId for (score, negatedId) in scoredIds]
@@ -18,14 +18,27 @@
 # along with Todomanager; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import bisect
+import functools
+import heapq
+import warnings
+from libtodomanager.locking import *
+from libtodomanager.textindex import *
+
 __all__ = [
     "ErrorCode",
     "TicketStatus",
     "TicketPriority",
+    "ChangeType",
     "Tag",
+    "TagView",
     "Ticket",
+    "TicketView",
     "TicketList",
-    "TodoManager"
+    "TicketStore",
+    "TicketCounters",
+    "TodoManager",
+    "ThreadSafeTodoManager"
 ]
 
 class ErrorCode:
@@ -39,6 +52,7 @@ class ErrorCode:
     kTicketAlreadyClosed = 8
     kTicketClosed = 9
     kTicketAlreadyHasTag = 10
+    kWriteConflict = 11
 
     @staticmethod
     def toString(errCode):
@@ -53,6 +67,7 @@ class ErrorCode:
             ErrorCode.kTicketAlreadyClosed: "Ticket already closed",
             ErrorCode.kTicketClosed: "Ticket closed",
             ErrorCode.kTicketAlreadyHasTag: "Ticket already has this tag",
+            ErrorCode.kWriteConflict: "The content is being changed by another process",
         }
 
         return errorCodeStr[errCode]
@@ -87,11 +102,31 @@ class TicketPriority:
 
         return ticketPriorityStr[priority]
 
-class Tag:
+class ChangeType:
+    kAddTag         = 1
+    kRemoveTag      = 2
+    kAddTicket      = 3
+    kAddTagToTicket = 4
+    kCloseTicket    = 5
+    kRemoveTicket   = 6
+
+class Tag(object):
+    __slots__ = ["id", "name"]
+
     def __init__(self):
         self.id   = None
         self.name = None
 
+    def __getstate__(self):
+        return (self.id, self.name)
+
+    def __setstate__(self, state):
+        # Tags pickled before __slots__ was used have a dict state
+        if isinstance(state, dict):
+            state = (state["id"], state["name"])
+
+        (self.id, self.name) = state
+
     def clone(self):
         ret = Tag()
 
@@ -122,23 +157,81 @@ class Tag:
     def toString(self):
         return "Tag - Id %d - Name %s" % (self.id, self.name)
 
-class Ticket:
+class TagView(object):
+    def __init__(self, tag):
+        self.tag   = tag
+        self.owned = False
+
+    def __getattr__(self, name):
+        # Attributes are read from the viewed tag. The view's own attributes
+        # and the special methods are not, pickle and copy look for them
+        # before __init__ has run.
+        if name == "tag" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.tag, name)
+
+    def __getstate__(self):
+        return self.tag.clone()
+
+    def __setstate__(self, state):
+        self.tag   = state
+        self.owned = True
+
+    def __copy__(self):
+        return TagView(self.tag)
+
+    def detach(self):
+        # Copy on first write, the managed tag is never modified through a view
+        if self.owned == False:
+            self.tag   = self.tag.clone()
+            self.owned = True
+
+    def clone(self):
+        return self.tag.clone()
+
+    def setId(self, id):
+        self.detach()
+        self.tag.setId(id)
+
+    def getId(self):
+        return self.tag.id
+
+    def setName(self, name):
+        self.detach()
+        self.tag.setName(name)
+
+    def getName(self):
+        return self.tag.name
+
+    def toString(self):
+        return self.tag.toString()
+
+class Ticket(object):
+    __slots__ = ["id", "tagIds", "description", "priority", "status"]
+
     def __init__(self):
         self.id          = None
-        self.tagList     = []
+        self.tagIds      = ()
         self.description = None
         self.priority    = None
         self.status      = None
 
+    def __getstate__(self):
+        return (self.id, self.tagIds, self.description, self.priority, self.status)
+
+    def __setstate__(self, state):
+        # Tickets pickled before __slots__ was used have a dict state with Tag
+        # objects. They are kept until TodoManager registers their names.
+        if isinstance(state, dict):
+            state = (state["id"], tuple(state["tagList"]), state["description"], state["priority"], state["status"])
+
+        (self.id, self.tagIds, self.description, self.priority, self.status) = state
+
     def clone(self):
         ret = Ticket()
 
         ret.id          = self.id
-
-        ret.tagList     = []
-        for tag in self.tagList:
-            ret.tagList.append(tag.clone())
-
+        ret.tagIds      = self.tagIds
         ret.description = self.description
         ret.priority    = self.priority
         ret.status      = self.status
@@ -167,18 +260,29 @@ class Ticket:
         elif False == Tag.isValid(tag, checkId=True):
             return ErrorCode.kWrongParam
         else:
-            self.tagList.append(tag)
+            self.tagIds = self.tagIds + (tag.id,)
             return ErrorCode.kOk
 
-    def getTagList(self):
-        return self.tagList
+    def getTagIdList(self):
+        return self.tagIds
 
-    def hasTag(self, iTag):
-        for tag in self.tagList:
-            if tag.id == iTag.id:
-                return True
+    def getTagList(self, todo = None):
+        # Deprecated, tickets only keep the tag ids. Use getTagIdList, or the
+        # views returned by TodoManager. Without todo the tags only have an id.
+        warnings.warn("Ticket.getTagList is deprecated, use getTagIdList", DeprecationWarning, stacklevel=2)
+        if todo != None:
+            return [TagView(tag) for tag in todo.resolveTags(self.tagIds)]
 
-        return False
+        tagList = []
+        for tagId in self.tagIds:
+            tag = Tag()
+            tag.setId(tagId)
+            tagList.append(tag)
+
+        return tagList
+
+    def hasTag(self, iTag):
+        return iTag.id in self.tagIds
 
     def setDescription(self, description):
         self.description = description
@@ -195,6 +299,90 @@ class Ticket:
     def toString(self):
         return "Ticket - Id %d - Tag %s - Priority %s - Status %s - Description %s" % (self.id, self.tag.getId(), ticketPriorityStr[self.priority], ticketStatusStr[self.status], self.description)
 
+# A view shows the ticket as it was when the view was returned: TodoManager
+# replaces a changed ticket by a copy instead of modifying it
+class TicketView(object):
+    def __init__(self, ticket, todo):
+        self.ticket  = ticket
+        self.todo    = todo
+        self.owned   = False
+        self.tagList = None
+
+    def __getattr__(self, name):
+        # Attributes are read from the viewed ticket, see TagView
+        if name == "ticket" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.ticket, name)
+
+    def __getstate__(self):
+        # The manager is not pickled, the tags are resolved beforehand
+        return (self.ticket.clone(), [tag.clone() for tag in self.getTagList()])
+
+    def __setstate__(self, state):
+        (self.ticket, self.tagList) = state
+        self.todo  = None
+        self.owned = True
+
+    def __copy__(self):
+        ret = TicketView(self.ticket, self.todo)
+        ret.tagList = self.tagList
+        return ret
+
+    def detach(self):
+        # Copy on first write, the managed ticket is never modified through a view
+        if self.owned == False:
+            self.ticket = self.ticket.clone()
+            self.owned  = True
+
+    def clone(self):
+        return self.ticket.clone()
+
+    def setId(self, id):
+        self.detach()
+        self.ticket.setId(id)
+
+    def getId(self):
+        return self.ticket.id
+
+    def setStatus(self, status):
+        self.detach()
+        self.ticket.setStatus(status)
+
+    def getStatus(self):
+        return self.ticket.status
+
+    def addTag(self, tag):
+        self.detach()
+        return self.ticket.addTag(tag)
+
+    def getTagIdList(self):
+        return self.ticket.tagIds
+
+    def getTagList(self):
+        if self.todo == None:
+            return [TagView(tag) for tag in self.tagList]
+        return [TagView(tag) for tag in self.todo.resolveTags(self.ticket.tagIds)]
+
+    def hasTag(self, iTag):
+        return self.ticket.hasTag(iTag)
+
+    def setDescription(self, description):
+        self.detach()
+        self.ticket.setDescription(description)
+
+    def getDescription(self):
+        return self.ticket.description
+
+    def setPriority(self, priority):
+        self.detach()
+        self.ticket.setPriority(priority)
+
+    def getPriority(self):
+        return self.ticket.priority
+
+    def toString(self):
+        return self.ticket.toString()
+
 class TicketList:
     def __init__(self):
         self.ticketList = []
@@ -216,19 +404,620 @@ class TicketList:
     def getContent(self):
         return self.ticketList
 
+class TicketCounters:
+    def __init__(self):
+        self.totalCount      = 0
+        self.countByStatus   = {}
+        self.countByPriority = {}  # status -> priority -> count
+        self.countByTag      = {}  # status -> tag id -> count
+
+    def addTickets(self, status, priority, count):
+        self.totalCount = self.totalCount + count
+        self.countByStatus[status] = self.countByStatus.get(status, 0) + count
+
+        countByPriority = self.countByPriority.setdefault(status, {})
+        countByPriority[priority] = countByPriority.get(priority, 0) + count
+
+    def addTaggedTickets(self, status, tagId, count):
+        countByTag = self.countByTag.setdefault(status, {})
+        countByTag[tagId] = countByTag.get(tagId, 0) + count
+
+    def addTicket(self, ticket, count = 1):
+        self.addTickets(ticket.status, ticket.priority, count)
+        for tagId in ticket.tagIds:
+            self.addTaggedTickets(ticket.status, tagId, count)
+
+    def removeTicket(self, ticket):
+        self.addTicket(ticket, -1)
+
+    def getTotalCount(self):
+        return self.totalCount
+
+    def getCount(self, status):
+        return self.countByStatus.get(status, 0)
+
+    def getStatusList(self):
+        return [status for (status, count) in self.countByStatus.items() if count > 0]
+
+    def getCountByPriority(self, status, priority):
+        countByPriority = self.countByPriority.get(status)
+        if countByPriority == None:
+            return 0
+
+        return countByPriority.get(priority, 0)
+
+    def getCountByTag(self, status, tagId):
+        countByTag = self.countByTag.get(status)
+        if countByTag == None:
+            return 0
+
+        return countByTag.get(tagId, 0)
+
+class TicketStore:
+    def __init__(self, ticketList = []):
+        self.ticketById          = {}
+        self.ticketIdsByStatus   = {}
+        self.ticketIdsByPriority = {}
+        self.ticketIdsByTag      = {}
+
+        # Highest id ever inserted, pages are walked up to it
+        self.lastTicketId        = 0
+
+        for ticket in ticketList:
+            self.insertTicket(ticket)
+
+    def getTicket(self, ticketId):
+        return self.ticketById.get(ticketId)
+
+    def getTickets(self, ticketIds):
+        return [self.ticketById[ticketId] for ticketId in ticketIds]
+
+    def getTicketsById(self, ticketIds):
+        return dict((ticketId, self.ticketById[ticketId]) for ticketId in ticketIds if ticketId in self.ticketById)
+
+    def getTicketList(self):
+        return self.getTickets(sorted(self.ticketById.keys()))
+
+    def getTicketCount(self):
+        return len(self.ticketById)
+
+    def iterTicketDescriptions(self):
+        for ticket in self.ticketById.itervalues():
+            yield (ticket.id, ticket.description)
+
+    def insertTicket(self, ticket):
+        self.ticketById[ticket.id] = ticket
+        self.lastTicketId = max(self.lastTicketId, ticket.id)
+
+        self.ticketIdsByStatus.setdefault(ticket.status, set()).add(ticket.id)
+        self.ticketIdsByPriority.setdefault(ticket.priority, set()).add(ticket.id)
+        for tagId in ticket.tagIds:
+            self.ticketIdsByTag.setdefault(tagId, set()).add(ticket.id)
+
+        return ErrorCode.kOk
+
+    def insertTickets(self, ticketList):
+        for ticket in ticketList:
+            self.insertTicket(ticket)
+
+        return ErrorCode.kOk
+
+    def deleteTicket(self, ticket):
+        del self.ticketById[ticket.id]
+
+        self.ticketIdsByStatus[ticket.status].discard(ticket.id)
+        self.ticketIdsByPriority[ticket.priority].discard(ticket.id)
+        for tagId in ticket.tagIds:
+            self.ticketIdsByTag[tagId].discard(ticket.id)
+
+    # Changed tickets are replaced by an updated copy, the views returned
+    # before keep the ticket they were given. The copy is returned.
+    def setTicketStatus(self, ticket, status):
+        self.ticketIdsByStatus[ticket.status].discard(ticket.id)
+        ticket = ticket.clone()
+        ticket.setStatus(status)
+        self.ticketById[ticket.id] = ticket
+        self.ticketIdsByStatus.setdefault(status, set()).add(ticket.id)
+
+        return ticket
+
+    def setTicketsStatus(self, ticketList, status):
+        return [self.setTicketStatus(ticket, status) for ticket in ticketList]
+
+    def addTagToTicket(self, ticket, tag):
+        ticket = ticket.clone()
+        ticket.addTag(tag)
+        self.ticketById[ticket.id] = ticket
+        self.ticketIdsByTag.setdefault(tag.id, set()).add(ticket.id)
+
+        return ticket
+
+    def addTagToTickets(self, ticketList, tag):
+        return [self.addTagToTicket(ticket, tag) for ticket in ticketList]
+
+    def hasTag(self, ticket, tagId):
+        return ticket.id in self.ticketIdsByTag.get(tagId, ())
+
+    def getIdSetList(self, status, priority, tagId):
+        idSetList = [self.ticketIdsByStatus.get(status, set())]
+        if priority != None:
+            idSetList.append(self.ticketIdsByPriority.get(priority, set()))
+        if tagId != None:
+            idSetList.append(self.ticketIdsByTag.get(tagId, set()))
+
+        idSetList.sort(key=len)
+        return idSetList
+
+    def findTicketIds(self, status, priority = None, tagId = None):
+        # Walk the smallest set, the cost only depends on the number of results
+        idSetList = self.getIdSetList(status, priority, tagId)
+        smallestIdSet = idSetList[0]
+        otherIdSetList = idSetList[1:]
+
+        ticketIds = list(smallestIdSet.intersection(*otherIdSetList))
+
+        # Ids are allocated in increasing order, sorting them keeps the creation order
+        ticketIds.sort()
+        return ticketIds
+
+    def findTicketIdPage(self, status, priority = None, tagId = None, afterId = 0, limit = None):
+        if limit == None:
+            return [ticketId for ticketId in self.findTicketIds(status, priority, tagId) if ticketId > afterId]
+        if limit <= 0:
+            return []
+
+        idSetList = self.getIdSetList(status, priority, tagId)
+        smallestIdSet = idSetList[0]
+
+        # Walk the ids following the cursor, it stops as soon as the page is full.
+        # The walk is bounded by the size of the smallest set so sparse matches
+        # never cost more than selecting the page from that set.
+        ticketIds = []
+        scanEndId = min(self.lastTicketId, afterId + len(smallestIdSet))
+        for ticketId in xrange(afterId + 1, scanEndId + 1):
+            if all(ticketId in idSet for idSet in idSetList):
+                ticketIds.append(ticketId)
+                if len(ticketIds) == limit:
+                    return ticketIds
+
+        if scanEndId < self.lastTicketId:
+            otherIdSetList = idSetList[1:]
+            matchingIds = (ticketId for ticketId in smallestIdSet
+                           if ticketId > scanEndId and all(ticketId in idSet for idSet in otherIdSetList))
+            ticketIds.extend(heapq.nsmallest(limit - len(ticketIds), matchingIds))
+
+        return ticketIds
+
+    def countTicketIds(self, status, priority = None, tagId = None):
+        if priority == None and tagId == None:
+            return len(self.ticketIdsByStatus.get(status, ()))
+        else:
+            return len(self.findTicketIds(status, priority, tagId))
+
+    def buildTicketCounters(self):
+        ticketCounters = TicketCounters()
+
+        for ticket in self.ticketById.itervalues():
+            ticketCounters.addTicket(ticket)
+
+        return ticketCounters
+
 class TodoManager:
-    def __init__(self, serializer=None):
+    kTagIndexList = ["tagById", "tagByName", "tagNameList"]
+
+    # Attributes which are not part of the stored state
+    kTransientList = kTagIndexList + ["serializer", "ticketStore", "ticketCounters", "textIndex", "changeList", "generation", "savedGeneration", "lock"]
+
+    # Number of tickets fetched at once by the ticket iterators
+    kTicketPageSize = 100
+
+    # Mutations, each of them starts with beginChange
+    kChangeMethodList = [
+        "addTag", "removeTag", "addTicket", "addTickets", "addTagToTicket", "addTagToTickets", "closeTicket",
+        "closeTickets", "removeTicket"
+    ]
+
+    def __init__(self, serializer=None, ticketStore=None):
         self.tagList   = []
-        self.ticketList    = []
+        self.removedTagById = {}
         self.tagLastId = 0
         self.ticketLastId  = 0
         self.serializer = serializer
+        self.changeList = []
+        self.generation = 0
+        self.savedGeneration = 0
+
+        # Only set in thread safe mode, see ThreadSafeTodoManager
+        self.lock = None
+
+        if ticketStore != None:
+            self.ticketStore = ticketStore
+        else:
+            self.ticketStore = TicketStore()
+
+        # Built from the store on first use
+        self.ticketCounters = None
+        self.textIndex = None
+
+        self.buildTagIndexes()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+
+        # Indexes are rebuilt on load, no need to store them
+        for attrName in TodoManager.kTransientList:
+            del state[attrName]
+
+        state["ticketList"] = self.ticketStore.getTicketList()
+
+        return state
+
+    def __setstate__(self, state):
+        ticketList = state.pop("ticketList")
+
+        self.__dict__.update(state)
+        self.__dict__.setdefault("removedTagById", {})
+        self.serializer = None
+        self.changeList = []
+        self.generation = 0
+        self.savedGeneration = 0
+        self.buildTagIndexes()
+        self.upgradeTicketTags(ticketList)
+        self.ticketStore = TicketStore(ticketList)
+        self.ticketCounters = None
+        self.textIndex = None
+        self.lock = None
+
+    def upgradeTicketTags(self, ticketList):
+        # Old tickets hold Tag objects, replace them by their ids and keep the
+        # names of the tags which are no longer in the tag list
+        for ticket in ticketList:
+            if len(ticket.tagIds) > 0 and isinstance(ticket.tagIds[0], Tag):
+                for tag in ticket.tagIds:
+                    if self.resolveTag(tag.id) == None:
+                        self.removedTagById[tag.id] = tag
+                ticket.tagIds = tuple([tag.id for tag in ticket.tagIds])
+
+    def setTicketStore(self, ticketStore):
+        for ticket in self.ticketStore.getTicketList():
+            ticketStore.insertTicket(ticket)
+
+        self.ticketStore = ticketStore
+        self.ticketCounters = None
+        self.textIndex = None
+
+    def getTicketCounters(self):
+        if self.ticketCounters == None:
+            self.ticketCounters = self.ticketStore.buildTicketCounters()
+
+        return self.ticketCounters
+
+    def getTextIndex(self):
+        if self.textIndex == None:
+            # Only published once complete, concurrent readers may build it too
+            textIndex = TextIndex()
+            for (ticketId, description) in self.ticketStore.iterTicketDescriptions():
+                textIndex.addDocument(ticketId, description)
+            self.textIndex = textIndex
+
+        return self.textIndex
+
+    def buildTagIndexes(self):
+        self.tagById    = {}
+        self.tagByName  = {}
+
+        for tag in self.tagList:
+            self.tagById[tag.id]     = tag
+            self.tagByName[tag.name] = tag
+
+        # Sorted names, the names sharing a prefix are contiguous
+        self.tagNameList = sorted(self.tagByName.keys())
+
+    def getTicketsFromIds(self, ticketIds):
+        retTicketList = TicketList()
+
+        for ticket in self.ticketStore.getTickets(ticketIds):
+            retTicketList.addTicket(TicketView(ticket, self))
+
+        return retTicketList
+
+    def iterTicketsFromQuery(self, status, priority = None, tagId = None, afterId = 0):
+        # Tickets are fetched one page at a time, the id of the last ticket
+        # of a page is the cursor of the next one
+        while True:
+            ticketList = self.getTicketPageFromQuery(status, priority, tagId, afterId).getContent()
+            for ticket in ticketList:
+                yield ticket
+
+            if len(ticketList) < TodoManager.kTicketPageSize:
+                return
+
+            afterId = ticketList[-1].getId()
+
+    def getTicketPageFromQuery(self, status, priority, tagId, afterId):
+        ticketIds = self.ticketStore.findTicketIdPage(status, priority, tagId, afterId, TodoManager.kTicketPageSize)
+        return self.getTicketsFromIds(ticketIds)
+
+    def enableThreadSafety(self):
+        # The locked methods are only paid for once the mode is enabled
+        if self.lock == None:
+            self.lock = ReadWriteLock()
+            self.__class__ = ThreadSafeTodoManager
+
+    def isThreadSafe(self):
+        return self.lock != None
 
     def setSerializer(self, serializer):
         self.serializer = serializer
 
     def save(self):
-        self.serializer.save(self)
+        res = self.serializer.save(self)
+        if res == ErrorCode.kOk:
+            self.changeList = []
+            self.savedGeneration = self.generation
+
+        return res
+
+    def rollback(self):
+        # The pending changes are dropped and the saved content is read again
+        rollback = getattr(self.serializer, "rollback", None)
+        if rollback != None:
+            (res, savedTodo) = rollback()
+        else:
+            (res, savedTodo) = self.serializer.load()
+
+        if res == ErrorCode.kOk:
+            self.changeList = []
+            self.rebase(savedTodo)
+            self.savedGeneration = self.generation
+
+        return res
+
+    def isDirty(self):
+        return self.generation != self.savedGeneration
+
+    def getGeneration(self):
+        return self.generation
+
+    def recordChange(self, change):
+        self.changeList.append(change)
+        self.generation = self.generation + 1
+
+    def recordChanges(self, changeList):
+        self.changeList.extend(changeList)
+        self.generation = self.generation + len(changeList)
+
+    def getChangeList(self):
+        return self.changeList
+
+    def beginChange(self):
+        # A serializer which writes the changes as they are made takes its
+        # write lock there, and reads the ids allocated by other processes
+        beginChange = getattr(self.serializer, "beginChange", None)
+        if beginChange == None:
+            return ErrorCode.kOk
+
+        return beginChange(self)
+
+    def endChange(self):
+        endChange = getattr(self.serializer, "endChange", None)
+        if endChange != None:
+            endChange(self)
+
+    def clearChangeList(self):
+        self.changeList = []
+        self.savedGeneration = self.generation
+
+    def applyChange(self, change):
+        # Replaying a change which is already part of the content is a no-op, so
+        # a journal can safely be replayed over a more recent snapshot
+        changeType = change[0]
+
+        if changeType == ChangeType.kAddTag:
+            (changeType, tagId, tagName) = change
+            if tagId > self.tagLastId:
+                tag = Tag()
+                tag.setId(tagId)
+                tag.setName(tagName)
+                self.insertTag(tag)
+        elif changeType == ChangeType.kRemoveTag:
+            (changeType, tagId) = change
+            tag = self.getTagByIdInternal(tagId)
+            if tag != None:
+                self.deleteTag(tag)
+        elif changeType == ChangeType.kAddTicket:
+            (changeType, ticketId, description, priority, status, tagIds) = change
+            if ticketId > self.ticketLastId:
+                ticket = Ticket()
+                ticket.setId(ticketId)
+                ticket.setDescription(description)
+                ticket.setPriority(priority)
+                ticket.setStatus(status)
+                for tagId in tagIds:
+                    # Older journals store (id, name) pairs
+                    if isinstance(tagId, tuple):
+                        tagId = tagId[0]
+                    ticket.tagIds = ticket.tagIds + (tagId,)
+                self.insertTicket(ticket)
+        elif changeType == ChangeType.kAddTagToTicket:
+            (ticketId, tagId) = change[1:3]
+            ticket = self.getTicketByIdInternal(ticketId)
+            tag = self.resolveTag(tagId)
+            if ticket != None and tag != None and False == self.ticketStore.hasTag(ticket, tagId):
+                self.insertTagInTicket(ticket, tag)
+        elif changeType == ChangeType.kCloseTicket:
+            (changeType, ticketId) = change
+            ticket = self.getTicketByIdInternal(ticketId)
+            if ticket != None:
+                self.setTicketStatus(ticket, TicketStatus.kClosed)
+        elif changeType == ChangeType.kRemoveTicket:
+            (changeType, ticketId) = change
+            ticket = self.getTicketByIdInternal(ticketId)
+            if ticket != None:
+                self.deleteTicket(ticket)
+
+    def rebase(self, baseTodo):
+        # The pending changes are replayed as new mutations on top of a more
+        # recent content, then this manager takes over the result. Ids allocated
+        # by the pending changes are remapped, the ones they did not allocate
+        # are shared with baseTodo. Changes which no longer apply are dropped.
+        tagIdMap    = {}
+        ticketIdMap = {}
+        droppedChangeList = []
+
+        for change in self.changeList:
+            changeType = change[0]
+            res = ErrorCode.kOk
+
+            if changeType == ChangeType.kAddTag:
+                (changeType, tagId, tagName) = change
+                tag = Tag()
+                tag.setName(tagName)
+                (res, createdTag) = baseTodo.addTag(tag)
+                if res == ErrorCode.kOk:
+                    tagIdMap[tagId] = createdTag.getId()
+                elif res == ErrorCode.kTagAlreadyExist:
+                    tagIdMap[tagId] = baseTodo.getTagByName(tagName).getId()
+            elif changeType == ChangeType.kRemoveTag:
+                (changeType, tagId) = change
+                tag = baseTodo.getTagById(tagIdMap.get(tagId, tagId))
+                res = ErrorCode.kTagNotFound if tag == None else baseTodo.removeTag(tag)
+            elif changeType == ChangeType.kAddTicket:
+                (changeType, ticketId, description, priority, status, tagIds) = change
+                ticket = Ticket()
+                ticket.setDescription(description)
+                ticket.setPriority(priority)
+                ticket.setStatus(status)
+                ticket.tagIds = tuple([tagIdMap.get(tagId, tagId) for tagId in tagIds
+                                       if baseTodo.getTagByIdInternal(tagIdMap.get(tagId, tagId)) != None])
+                (res, createdTicket) = baseTodo.addTicket(ticket)
+                if res == ErrorCode.kOk:
+                    ticketIdMap[ticketId] = createdTicket.getId()
+            elif changeType == ChangeType.kAddTagToTicket:
+                (changeType, ticketId, tagId) = change
+                ticket = baseTodo.getTicketById(ticketIdMap.get(ticketId, ticketId))
+                tag = baseTodo.getTagById(tagIdMap.get(tagId, tagId))
+                res = baseTodo.addTagToTicket(ticket, tag)
+            elif changeType == ChangeType.kCloseTicket:
+                (changeType, ticketId) = change
+                ticket = baseTodo.getTicketById(ticketIdMap.get(ticketId, ticketId))
+                res = ErrorCode.kTicketNotFound if ticket == None else baseTodo.closeTicket(ticket)
+            elif changeType == ChangeType.kRemoveTicket:
+                (changeType, ticketId) = change
+                ticket = baseTodo.getTicketById(ticketIdMap.get(ticketId, ticketId))
+                res = ErrorCode.kTicketNotFound if ticket == None else baseTodo.removeTicket(ticket)
+
+            if res != ErrorCode.kOk:
+                droppedChangeList.append(change)
+
+        # The replayed changes of baseTodo become the pending ones
+        state = baseTodo.__dict__.copy()
+        for attrName in ["serializer", "lock", "generation", "savedGeneration"]:
+            state[attrName] = self.__dict__[attrName]
+        self.__dict__.update(state)
+
+        return droppedChangeList
+
+    def insertTag(self, tag):
+        self.tagLastId = max(self.tagLastId, tag.id)
+        self.tagList.append(tag)
+        self.tagById[tag.id]     = tag
+        self.tagByName[tag.name] = tag
+        bisect.insort(self.tagNameList, tag.name)
+
+    def deleteTag(self, tag):
+        self.tagList.remove(tag)
+        del self.tagById[tag.id]
+        del self.tagByName[tag.name]
+        del self.tagNameList[bisect.bisect_left(self.tagNameList, tag.name)]
+
+        # Tickets may still reference the tag
+        self.removedTagById[tag.id] = tag
+
+    def resolveTag(self, tagId):
+        tag = self.tagById.get(tagId)
+        if tag == None:
+            tag = self.removedTagById.get(tagId)
+
+        return tag
+
+    def resolveTags(self, tagIds):
+        tagList = []
+        for tagId in tagIds:
+            tag = self.resolveTag(tagId)
+            if tag != None:
+                tagList.append(tag)
+
+        return tagList
+
+    def insertTicket(self, ticket):
+        # The id is only taken once the store accepted the ticket
+        res = self.ticketStore.insertTicket(ticket)
+        if res != ErrorCode.kOk:
+            return res
+
+        self.ticketLastId = max(self.ticketLastId, ticket.id)
+        if self.ticketCounters != None:
+            self.ticketCounters.addTicket(ticket)
+        if self.textIndex != None:
+            self.textIndex.addDocument(ticket.id, ticket.description)
+
+        return ErrorCode.kOk
+
+    def insertTickets(self, ticketList):
+        if len(ticketList) == 0:
+            return ErrorCode.kOk
+
+        res = self.ticketStore.insertTickets(ticketList)
+        if res != ErrorCode.kOk:
+            return res
+
+        self.ticketLastId = max(self.ticketLastId, max([ticket.id for ticket in ticketList]))
+        for ticket in ticketList:
+            if self.ticketCounters != None:
+                self.ticketCounters.addTicket(ticket)
+            if self.textIndex != None:
+                self.textIndex.addDocument(ticket.id, ticket.description)
+
+        return ErrorCode.kOk
+
+    def deleteTicket(self, ticket):
+        self.ticketStore.deleteTicket(ticket)
+        if self.ticketCounters != None:
+            self.ticketCounters.removeTicket(ticket)
+        if self.textIndex != None:
+            self.textIndex.removeDocument(ticket.id, ticket.description)
+
+    def insertTagInTicket(self, ticket, tag):
+        self.ticketStore.addTagToTicket(ticket, tag)
+        if self.ticketCounters != None:
+            self.ticketCounters.addTaggedTickets(ticket.status, tag.id, 1)
+
+    def insertTagInTickets(self, ticketList, tag):
+        self.ticketStore.addTagToTickets(ticketList, tag)
+        if self.ticketCounters != None:
+            for ticket in ticketList:
+                self.ticketCounters.addTaggedTickets(ticket.status, tag.id, 1)
+
+    def setTicketStatus(self, ticket, status):
+        if self.ticketCounters != None:
+            self.ticketCounters.removeTicket(ticket)
+
+        ticket = self.ticketStore.setTicketStatus(ticket, status)
+
+        if self.ticketCounters != None:
+            self.ticketCounters.addTicket(ticket)
+
+    def setTicketsStatus(self, ticketList, status):
+        if self.ticketCounters != None:
+            for ticket in ticketList:
+                self.ticketCounters.removeTicket(ticket)
+
+        ticketList = self.ticketStore.setTicketsStatus(ticketList, status)
+
+        if self.ticketCounters != None:
+            for ticket in ticketList:
+                self.ticketCounters.addTicket(ticket)
 
     def addTag(self, tag):
         if tag == None:
@@ -236,63 +1025,74 @@ class TodoManager:
         elif False == Tag.isValid(tag):
             return (ErrorCode.kWrongParam, None)
 
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return (res, None)
+
         existingTag = self.getTagByName(tag.getName())
         if existingTag != None:
             return (ErrorCode.kTagAlreadyExist, None)
 
-        self.tagLastId = self.tagLastId + 1
-        tag.setId(self.tagLastId)
-        self.tagList.append(tag)
+        internalTag = tag.clone()
+        internalTag.setId(self.tagLastId + 1)
+        self.insertTag(internalTag)
+        self.recordChange((ChangeType.kAddTag, internalTag.id, internalTag.name))
 
-        return (ErrorCode.kOk, tag.clone())
+        return (ErrorCode.kOk, TagView(internalTag))
 
     def removeTag(self, tag):
         if tag == None:
             return ErrorCode.kWrongParam
 
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return res
+
         existingTag = self.getTagByIdInternal(tag.getId())
         if existingTag == None:
             return ErrorCode.kTagNotFound
 
-        self.tagList.remove(existingTag)
+        self.deleteTag(existingTag)
+        self.recordChange((ChangeType.kRemoveTag, existingTag.id))
         return ErrorCode.kOk
 
     def getTagList(self):
-        ret = []
-
-        for tag in self.tagList:
-            ret.append(tag.clone())
-
-        return ret
+        return [TagView(tag) for tag in self.tagList]
 
     def getTagCount(self):
         return len(self.tagList)
 
     def getTagByName(self, tagName):
-        retval = None
-        for tag in self.tagList:
-            if tag.name == tagName:
-                retval = tag.clone()
+        tag = self.tagByName.get(tagName)
+        if tag != None:
+            return TagView(tag)
+        else:
+            return None
+
+    def getTagNamesByPrefix(self, prefix, limit = None):
+        tagNameList = []
+
+        index = bisect.bisect_left(self.tagNameList, prefix)
+        while index < len(self.tagNameList) and len(tagNameList) != limit:
+            tagName = self.tagNameList[index]
+            if tagName.startswith(prefix) == False:
                 break
 
-        return retval
+            tagNameList.append(tagName)
+            index = index + 1
+
+        return tagNameList
 
     def getTagByIdInternal(self, tagId):
         if tagId == None:
             return None
 
-        retval = None
-        for tag in self.tagList:
-            if tag.id == tagId:
-                retval = tag
-                break
-
-        return retval
+        return self.tagById.get(tagId)
 
     def getTagById(self, tagId):
         tag = self.getTagByIdInternal(tagId)
         if tag != None:
-            return tag.clone()
+            return TagView(tag)
         else:
             return None
 
@@ -302,13 +1102,51 @@ class TodoManager:
         elif False == Ticket.isValid(ticket):
             return (ErrorCode.kWrongParam, None)
 
-        self.ticketLastId = self.ticketLastId + 1
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return (res, None)
 
         internalTicket = ticket.clone()
-        internalTicket.setId(self.ticketLastId)
-        self.ticketList.append(internalTicket)
+        internalTicket.setId(self.ticketLastId + 1)
+        res = self.insertTicket(internalTicket)
+        if res != ErrorCode.kOk:
+            return (res, None)
+
+        self.recordChange((ChangeType.kAddTicket, internalTicket.id, internalTicket.description,
+                           internalTicket.priority, internalTicket.status, internalTicket.tagIds))
+
+        return (ErrorCode.kOk, TicketView(internalTicket, self))
+
+    def addTickets(self, ticketList):
+        ticketList = list(ticketList)
+
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return [(res, None)] * len(ticketList)
 
-        return (ErrorCode.kOk, internalTicket.clone())
+        resList = []
+        internalTicketList = []
+
+        for ticket in ticketList:
+            if ticket == None:
+                resList.append((ErrorCode.kWrongParam, None))
+            elif False == Ticket.isValid(ticket):
+                resList.append((ErrorCode.kWrongParam, None))
+            else:
+                internalTicket = ticket.clone()
+                internalTicket.setId(self.ticketLastId + len(internalTicketList) + 1)
+                internalTicketList.append(internalTicket)
+                resList.append((ErrorCode.kOk, TicketView(internalTicket, self)))
+
+        res = self.insertTickets(internalTicketList)
+        if res != ErrorCode.kOk:
+            return [(res, None) if ticketRes == ErrorCode.kOk else (ticketRes, createdTicket)
+                    for (ticketRes, createdTicket) in resList]
+
+        self.recordChanges([(ChangeType.kAddTicket, ticket.id, ticket.description, ticket.priority, ticket.status,
+                             ticket.tagIds) for ticket in internalTicketList])
+
+        return resList
 
     def addTagToTicket(self, ticket, tag):
         if ticket == None:
@@ -320,6 +1158,10 @@ class TodoManager:
         elif Tag.isValid(tag, checkId=True) == False:
             return ErrorCode.kWrongParam
 
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return res
+
         existingTag = self.getTagByIdInternal(tag.getId())
         if existingTag == None:
             return ErrorCode.kTagNotFound
@@ -330,30 +1172,111 @@ class TodoManager:
         elif existingTicket.getStatus() == TicketStatus.kClosed:
             return ErrorCode.kTicketClosed
 
-        if existingTicket.hasTag(existingTag):
+        if self.ticketStore.hasTag(existingTicket, existingTag.id):
             return ErrorCode.kTicketAlreadyHasTag
 
-        existingTicket.addTag(existingTag)
+        self.insertTagInTicket(existingTicket, existingTag)
+        self.recordChange((ChangeType.kAddTagToTicket, existingTicket.id, existingTag.id))
 
         return ErrorCode.kOk
 
+    def addTagToTickets(self, ticketIds, tag):
+        ticketIds = list(ticketIds)
+
+        # The tag is checked once, when it is wrong every ticket gets the same error
+        if tag == None:
+            return [ErrorCode.kWrongParam] * len(ticketIds)
+        elif Tag.isValid(tag, checkId=True) == False:
+            return [ErrorCode.kWrongParam] * len(ticketIds)
+
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return [res] * len(ticketIds)
+
+        existingTag = self.getTagByIdInternal(tag.getId())
+        if existingTag == None:
+            return [ErrorCode.kTagNotFound] * len(ticketIds)
+
+        ticketById = self.ticketStore.getTicketsById(ticketIds)
+
+        resList = []
+        taggedTicketList = []
+        taggedIdSet = set()
+
+        for ticketId in ticketIds:
+            existingTicket = ticketById.get(ticketId)
+            if existingTicket == None:
+                resList.append(ErrorCode.kTicketNotFound)
+            elif existingTicket.getStatus() == TicketStatus.kClosed:
+                resList.append(ErrorCode.kTicketClosed)
+            elif existingTicket.hasTag(existingTag) or ticketId in taggedIdSet:
+                resList.append(ErrorCode.kTicketAlreadyHasTag)
+            else:
+                taggedTicketList.append(existingTicket)
+                taggedIdSet.add(ticketId)
+                resList.append(ErrorCode.kOk)
+
+        self.insertTagInTickets(taggedTicketList, existingTag)
+        self.recordChanges([(ChangeType.kAddTagToTicket, ticket.id, existingTag.id) for ticket in taggedTicketList])
+
+        return resList
+
     def closeTicket(self, ticket):
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return res
+
         existingTicket = self.getTicketByIdInternal(ticket.getId())
         if existingTicket == None:
             return ErrorCode.kTicketNotFound
         elif existingTicket.getStatus() == TicketStatus.kClosed:
             return ErrorCode.kTicketAlreadyClosed
 
-        existingTicket.setStatus(TicketStatus.kClosed)
+        self.setTicketStatus(existingTicket, TicketStatus.kClosed)
+        self.recordChange((ChangeType.kCloseTicket, existingTicket.id))
 
         return ErrorCode.kOk
 
+    def closeTickets(self, ticketIds):
+        ticketIds = list(ticketIds)
+
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return [res] * len(ticketIds)
+
+        ticketById = self.ticketStore.getTicketsById(ticketIds)
+
+        resList = []
+        closedTicketList = []
+        closedIdSet = set()
+
+        for ticketId in ticketIds:
+            existingTicket = ticketById.get(ticketId)
+            if existingTicket == None:
+                resList.append(ErrorCode.kTicketNotFound)
+            elif existingTicket.getStatus() == TicketStatus.kClosed or ticketId in closedIdSet:
+                resList.append(ErrorCode.kTicketAlreadyClosed)
+            else:
+                closedTicketList.append(existingTicket)
+                closedIdSet.add(ticketId)
+                resList.append(ErrorCode.kOk)
+
+        self.setTicketsStatus(closedTicketList, TicketStatus.kClosed)
+        self.recordChanges([(ChangeType.kCloseTicket, ticket.id) for ticket in closedTicketList])
+
+        return resList
+
     def removeTicket(self, ticket):
+        res = self.beginChange()
+        if res != ErrorCode.kOk:
+            return res
+
         existingTicket = self.getTicketByIdInternal(ticket.getId())
         if existingTicket == None:
             return ErrorCode.kTicketNotFound
 
-        self.ticketList.remove(existingTicket)
+        self.deleteTicket(existingTicket)
+        self.recordChange((ChangeType.kRemoveTicket, existingTicket.id))
 
         return ErrorCode.kOk
 
@@ -361,51 +1284,126 @@ class TodoManager:
         if ticketId == None:
             return None
 
-        retval = None
-        for ticket in self.ticketList:
-            if ticket.id == ticketId:
-                retval = ticket
-                break
-
-        return retval
+        return self.ticketStore.getTicket(ticketId)
 
     def getTicketById(self, ticketId):
         ticket = self.getTicketByIdInternal(ticketId)
         if ticket != None:
-            return ticket.clone()
+            return TicketView(ticket, self)
         else:
             return None
 
     def getTicketCount(self):
-        return len(self.ticketList)
+        return self.getTicketCounters().getTotalCount()
 
-    def getOpenedTickets(self):
-        retTicketList = TicketList()
+    def getTicketCountByStatus(self, status):
+        return self.getTicketCounters().getCount(status)
 
-        for ticket in self.ticketList:
-            if TicketStatus.kOpened == ticket.getStatus():
-                retTicketList.addTicket(ticket.clone())
+    def findTicketIds(self, status, priority = None, tagId = None):
+        return self.ticketStore.findTicketIds(status, priority, tagId)
 
-        return retTicketList
+    def getOpenedTickets(self):
+        ticketIds = self.ticketStore.findTicketIds(TicketStatus.kOpened)
+        return self.getTicketsFromIds(ticketIds)
 
     def getOpenedTicketsCount(self):
-        return self.getOpenedTickets().getTicketCount()
+        return self.getTicketCounters().getCount(TicketStatus.kOpened)
 
-    def getOpenedTicketsByTag(self, tag):
-        retTicketList = TicketList()
+    def getOpenedTicketsCountByTag(self, tag):
+        return self.getTicketCounters().getCountByTag(TicketStatus.kOpened, tag.id)
 
-        for ticket in self.ticketList:
-            if ticket.hasTag(tag) and TicketStatus.kOpened == ticket.getStatus():
-                retTicketList.addTicket(ticket.clone())
+    def getOpenedTicketsCountByPriority(self, priority):
+        return self.getTicketCounters().getCountByPriority(TicketStatus.kOpened, priority)
 
-        return retTicketList
+    def getOpenedTicketsByTag(self, tag):
+        ticketIds = self.ticketStore.findTicketIds(TicketStatus.kOpened, tagId=tag.id)
+        return self.getTicketsFromIds(ticketIds)
 
     def getOpenedTicketsByPriority(self, priority):
-        retTicketList = TicketList()
-
-        for ticket in self.ticketList:
-            if ticket.getPriority() == priority and TicketStatus.kOpened == ticket.getStatus():
-                retTicketList.addTicket(ticket.clone())
-
-        return retTicketList
-
+        ticketIds = self.ticketStore.findTicketIds(TicketStatus.kOpened, priority=priority)
+        return self.getTicketsFromIds(ticketIds)
+
+    def searchTickets(self, query, limit = None):
+        ticketIds = self.getTextIndex().search(query, limit)
+        return self.getTicketsFromIds(ticketIds)
+
+    def getSearchTicketsCount(self, query):
+        # Every match, searchTickets may stop at its limit
+        return len(self.getTextIndex().findDocumentIds(query))
+
+    def getOpenedTicketsPage(self, limit, afterId = 0):
+        ticketIds = self.ticketStore.findTicketIdPage(TicketStatus.kOpened, afterId=afterId, limit=limit)
+        return self.getTicketsFromIds(ticketIds)
+
+    def iterOpenedTickets(self, afterId = 0):
+        return self.iterTicketsFromQuery(TicketStatus.kOpened, afterId=afterId)
+
+    def iterOpenedTicketsByTag(self, tag, afterId = 0):
+        return self.iterTicketsFromQuery(TicketStatus.kOpened, tagId=tag.id, afterId=afterId)
+
+    def iterOpenedTicketsByPriority(self, priority, afterId = 0):
+        return self.iterTicketsFromQuery(TicketStatus.kOpened, priority=priority, afterId=afterId)
+
+def endsChange(method):
+    @functools.wraps(method)
+    def changeMethod(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.endChange()
+
+    return changeMethod
+
+for methodName in TodoManager.kChangeMethodList:
+    setattr(TodoManager, methodName, endsChange(TodoManager.__dict__[methodName]))
+
+def readLocked(method):
+    @functools.wraps(method)
+    def lockedMethod(self, *args, **kwargs):
+        self.lock.acquireRead()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.releaseRead()
+
+    return lockedMethod
+
+def writeLocked(method):
+    @functools.wraps(method)
+    def lockedMethod(self, *args, **kwargs):
+        self.lock.acquireWrite()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.releaseWrite()
+
+    return lockedMethod
+
+class ThreadSafeTodoManager(TodoManager):
+    # Readers share the lock and never block each other, mutations and save
+    # get it exclusively
+    kReadMethodList = [
+        "getChangeList", "getTagList", "getTagCount", "getTagByName", "getTagNamesByPrefix", "getTagById",
+        "getTicketById", "getTicketCount", "getTicketCountByStatus", "getOpenedTickets", "getOpenedTicketsCount",
+        "getOpenedTicketsCountByTag", "getOpenedTicketsCountByPriority", "getOpenedTicketsByTag",
+        "getOpenedTicketsByPriority", "searchTickets", "getSearchTicketsCount", "getOpenedTicketsPage", "getTicketPageFromQuery",
+        "findTicketIds", "getTicketsFromIds"
+    ]
+    kWriteMethodList = [
+        "setTicketStore", "save", "rollback", "clearChangeList", "applyChange", "rebase", "addTag", "removeTag", "addTicket",
+        "addTickets", "addTagToTicket", "addTagToTickets", "closeTicket", "closeTickets", "removeTicket"
+    ]
+
+    def __init__(self, serializer=None, ticketStore=None):
+        TodoManager.__init__(self, serializer, ticketStore)
+        self.lock = ReadWriteLock()
+
+    def __setstate__(self, state):
+        TodoManager.__setstate__(self, state)
+        self.lock = ReadWriteLock()
+
+for methodName in ThreadSafeTodoManager.kReadMethodList:
+    setattr(ThreadSafeTodoManager, methodName, readLocked(TodoManager.__dict__[methodName]))
+
+for methodName in ThreadSafeTodoManager.kWriteMethodList:
+    setattr(ThreadSafeTodoManager, methodName, writeLocked(TodoManager.__dict__[methodName]))
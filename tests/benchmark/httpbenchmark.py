@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Load generator of the HTTP server.
+#
+# Each connection is kept alive and sends its requests in pipelined batches,
+# the paths are used in turn. The throughput, the latency percentiles and the
+# count of each status are printed. A server is started on a generated store
+# unless the address of a running one is given.
+
+import argparse
+import asyncore
+import multiprocessing
+import socket
+import sys
+import threading
+import timeit
+
+from libtodomanager.httpserver import *
+from todomanagerbenchmark import generateTodoManager
+
+DEFAULT_PATHS = ["/tickets/opened/count", "/tickets/opened?limit=20", "/tickets/1", "/tags"]
+
+def serve(size, seed, addressQueue):
+    todo = generateTodoManager(size, seed)
+    todo.getTicketCounters()
+
+    server = HttpServer(("127.0.0.1", 0), todo)
+    addressQueue.put(server.getAddress())
+    asyncore.loop()
+
+class Connection:
+    def __init__(self, address):
+        self.socket = socket.create_connection(address)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = ""
+
+    def fill(self):
+        data = self.socket.recv(65536)
+        if data == "":
+            raise IOError("Connection closed by the server")
+        self.buffer = self.buffer + data
+
+    def readResponse(self):
+        while "\r\n\r\n" not in self.buffer:
+            self.fill()
+
+        (header, separator, self.buffer) = self.buffer.partition("\r\n\r\n")
+        lineList = header.split("\r\n")
+        headerByName = dict([(name.lower(), value) for (name, value) in [line.split(": ", 1) for line in lineList[1:]]])
+
+        size = int(headerByName.get("content-length", "0"))
+        while len(self.buffer) < size:
+            self.fill()
+        self.buffer = self.buffer[size:]
+
+        return (int(lineList[0].split()[1]), headerByName)
+
+    def close(self):
+        self.socket.close()
+
+class LoadGenerator:
+    def __init__(self, address, pathList, requestCount, pipelineDepth, conditional):
+        self.address       = address
+        self.pathList      = pathList
+        self.requestCount  = requestCount
+        self.pipelineDepth = pipelineDepth
+        self.conditional   = conditional
+        self.latencyList   = []
+        self.countByStatus = {}
+        self.mutex         = threading.Lock()
+
+    def runConnection(self):
+        timer = timeit.default_timer
+        connection = Connection(self.address)
+        etagByPath = {}
+        latencyList = []
+        countByStatus = {}
+
+        sentCount = 0
+        while sentCount < self.requestCount:
+            batchPathList = [self.pathList[(sentCount + i) % len(self.pathList)]
+                             for i in range(min(self.pipelineDepth, self.requestCount - sentCount))]
+
+            requestList = []
+            for path in batchPathList:
+                request = "GET %s HTTP/1.1\r\nHost: localhost\r\n" % path
+                if path in etagByPath:
+                    request = request + "If-None-Match: %s\r\n" % etagByPath[path]
+                requestList.append(request + "\r\n")
+
+            # Latency of a request goes from the send of its batch to its response
+            start = timer()
+            connection.socket.sendall("".join(requestList))
+            for path in batchPathList:
+                (status, headerByName) = connection.readResponse()
+                latencyList.append(timer() - start)
+                countByStatus[status] = countByStatus.get(status, 0) + 1
+                if self.conditional and "etag" in headerByName:
+                    etagByPath[path] = headerByName["etag"]
+
+            sentCount = sentCount + len(batchPathList)
+
+        connection.close()
+
+        with self.mutex:
+            self.latencyList.extend(latencyList)
+            for (status, count) in countByStatus.items():
+                self.countByStatus[status] = self.countByStatus.get(status, 0) + count
+
+    def run(self, connectionCount):
+        threadList = [threading.Thread(target=self.runConnection) for i in range(connectionCount)]
+
+        start = timeit.default_timer()
+        for thread in threadList:
+            thread.start()
+        for thread in threadList:
+            thread.join()
+
+        return timeit.default_timer() - start
+
+def percentile(sortedList, ratio):
+    return sortedList[min(int(len(sortedList) * ratio), len(sortedList) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator of the HTTP server")
+    parser.add_argument("--address", help="HOST:PORT of a running server, one is started otherwise")
+    parser.add_argument("--size", type=int, default=10000, help="ticket count of the store of the started server")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated store")
+    parser.add_argument("--connections", type=int, default=4, help="count of concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=2000, help="count of requests of each connection")
+    parser.add_argument("--pipeline", type=int, default=1, help="count of requests sent before reading the responses")
+    parser.add_argument("--conditional", action="store_true", help="send the last ETag of each path in If-None-Match")
+    parser.add_argument("--path", dest="pathList", action="append", help="requested path, may be repeated")
+    args = parser.parse_args()
+
+    serverProcess = None
+    if args.address != None:
+        (host, separator, port) = args.address.rpartition(":")
+        address = (host, int(port))
+    else:
+        addressQueue = multiprocessing.Queue()
+        serverProcess = multiprocessing.Process(target=serve, args=(args.size, args.seed, addressQueue))
+        serverProcess.start()
+        address = addressQueue.get()
+
+    try:
+        generator = LoadGenerator(address, args.pathList or DEFAULT_PATHS, args.requests, args.pipeline,
+                                  args.conditional)
+        duration = generator.run(args.connections)
+    finally:
+        if serverProcess != None:
+            serverProcess.terminate()
+            serverProcess.join()
+
+    latencyList = sorted(generator.latencyList)
+    print "%d requests in %.2f s, %.0f requests/s" % (len(latencyList), duration, len(latencyList) / duration)
+    print "latency p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, max %.3f ms" % (
+        percentile(latencyList, 0.5) * 1e3, percentile(latencyList, 0.9) * 1e3,
+        percentile(latencyList, 0.99) * 1e3, latencyList[-1] * 1e3)
+    print "status %s" % ", ".join(["%d: %d" % item for item in sorted(generator.countByStatus.items())])
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+# Cold start benchmark of the todo entry point.
+#
+# A store is generated and pickled to todolist.bin, then todo is started in a
+# fresh interpreter and timed until its prompt is written, both before the
+# content is imported to todolist.db and once it is. The time of a single
+# command is printed as well. The median of the runs is compared to the budget
+# of the prompt, the exit status is 1 when it is exceeded.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from libtodomanager.persistency.pickleserializer import *
+from todomanagerbenchmark import generateTodoManager
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+PROMPT = "(Cmd) "
+
+def startTodo(todoPath, workPath, argList=[]):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT_PATH
+
+    return subprocess.Popen([sys.executable, todoPath] + argList, cwd=workPath, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+def timePrompt(todoPath, workPath):
+    start = timeit.default_timer()
+    process = startTodo(todoPath, workPath)
+
+    output = ""
+    while output.endswith(PROMPT) == False:
+        data = os.read(process.stdout.fileno(), 4096)
+        if data == "":
+            raise IOError("todo exited before its prompt")
+        output = output + data
+
+    duration = timeit.default_timer() - start
+
+    process.kill()
+    process.wait()
+    return duration
+
+def timeCommand(todoPath, workPath, command):
+    start = timeit.default_timer()
+    process = startTodo(todoPath, workPath, ["-c", command])
+    process.communicate()
+    return timeit.default_timer() - start
+
+def median(valueList):
+    return sorted(valueList)[len(valueList) / 2]
+
+def removeStore(workPath):
+    for fileName in ["todolist.db", "todolist.db-journal", "todolist.db.import", "todolist.db.import-journal"]:
+        if os.path.exists(os.path.join(workPath, fileName)):
+            os.remove(os.path.join(workPath, fileName))
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the todo entry point")
+    parser.add_argument("--size", type=int, default=100000, help="ticket count of the generated todolist.bin")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated store")
+    parser.add_argument("--runs", type=int, default=11, help="count of starts of each case")
+    parser.add_argument("--budget-ms", dest="budgetMs", type=float, default=100.0,
+                        help="longest median time to the prompt, in milliseconds")
+    parser.add_argument("--todo", dest="todoPath", default=os.path.join(ROOT_PATH, "todo"),
+                        help="path of the started entry point")
+    parser.add_argument("--command", default="printTagList", help="command timed with -c")
+    args = parser.parse_args()
+
+    workPath = tempfile.mkdtemp()
+    try:
+        todo = generateTodoManager(args.size, args.seed)
+        PickleSerializer(os.path.join(workPath, "todolist.bin")).save(todo)
+        print "todolist.bin of %d tickets, %.1f MB" % (
+            args.size, os.path.getsize(os.path.join(workPath, "todolist.bin")) / 1e6)
+
+        # Killed at the prompt, the import never completes
+        importList = []
+        for i in range(args.runs):
+            removeStore(workPath)
+            importList.append(timePrompt(args.todoPath, workPath))
+        removeStore(workPath)
+
+        # Completes the import
+        timeCommand(args.todoPath, workPath, args.command)
+
+        loadedList = [timePrompt(args.todoPath, workPath) for i in range(args.runs)]
+        commandList = [timeCommand(args.todoPath, workPath, args.command) for i in range(args.runs)]
+    finally:
+        shutil.rmtree(workPath)
+
+    res = 0
+    for (name, durationList, hasBudget) in [("prompt, import pending", importList, True),
+                                            ("prompt, imported", loadedList, True),
+                                            ("-c %s" % (args.command), commandList, False)]:
+        duration = median(durationList) * 1e3
+        status = ""
+        if hasBudget:
+            status = "ok"
+            if duration > args.budgetMs:
+                status = "over the %.0f ms budget" % (args.budgetMs)
+                res = 1
+        print "%-24s median %7.1f ms, min %7.1f ms, max %7.1f ms  %s" % (
+            name, duration, min(durationList) * 1e3, max(durationList) * 1e3, status)
+
+    return res
+
+if __name__ == '__main__':
+    sys.exit(main())
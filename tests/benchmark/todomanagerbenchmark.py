@@ -0,0 +1,461 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Benchmark of libtodomanager and of the command line dispatch.
+#
+# Stores of increasing size are generated, every TodoManager operation, the
+# serializers and Shell.onecmd are timed, and the results are written as JSON.
+# When a baseline file is given, results are compared to it and the script
+# exits with an error if an operation got slower than the allowed ratio.
+# Timings depend on the machine, so no baseline is committed. Write one on the
+# machine the checks run on, from the revision to compare with:
+#
+#   ./runBenchmarks.sh --output benchmark-baseline.json
+#   ./runBenchmarks.sh --baseline benchmark-baseline.json
+#
+# Only the sizes and the operations found in both runs are compared.
+# Calls are timed in batches and the fastest batch is kept, operations whose
+# batches are too short for the timer are reported as skipped.
+# The thread safe mode is stressed last, readers run concurrently with and
+# without a writer and their throughput is reported for each thread count.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+
+from libtodomanager.todomanager import *
+from libtodomanager.persistency.pickleserializer import *
+from libtodomanager.persistency.journalserializer import *
+from libtodomanager.persistency.sqliteserializer import *
+from todomanagercli.shell import *
+from todomanagercli.commands import *
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+DEFAULT_THREAD_COUNTS = [1, 2, 4, 8]
+
+# Calls of an operation are split in this many timed batches
+BATCH_COUNT = 5
+
+# A batch shorter than this many timer ticks is not measured
+MIN_TIMER_TICKS = 100
+
+TAG_COUNT = 50
+
+# Most tickets end up closed
+STATUS_WEIGHTS = [
+    (TicketStatus.kOpened,  20),
+    (TicketStatus.kClosed,  70),
+    (TicketStatus.kDelayed, 10),
+]
+
+PRIORITY_WEIGHTS = [
+    (TicketPriority.kHigh,   20),
+    (TicketPriority.kNormal, 60),
+    (TicketPriority.kLow,    20),
+]
+
+TAG_COUNT_WEIGHTS = [
+    (0, 30),
+    (1, 40),
+    (2, 20),
+    (3, 10),
+]
+
+WORDS = ("fix update remove add crash test server client build release document "
+         "review refactor install configure backup network database login report").split()
+
+def weightedChoice(rng, weightList):
+    total = sum([weight for (value, weight) in weightList])
+    pick = rng.uniform(0, total)
+
+    for (value, weight) in weightList:
+        pick = pick - weight
+        if pick <= 0:
+            return value
+
+    return weightList[-1][0]
+
+def pickTags(rng, tagList, count):
+    # A few tags are used much more than the others
+    picked = []
+    while len(picked) < count:
+        tag = tagList[min(int(rng.paretovariate(1.2)) - 1, len(tagList) - 1)]
+        if tag not in picked:
+            picked.append(tag)
+
+    return picked
+
+def generateTodoManager(size, seed):
+    rng = random.Random(seed)
+    todo = TodoManager()
+
+    for i in range(TAG_COUNT):
+        tag = Tag()
+        tag.setName("tag%d" % (i + 1))
+        todo.addTag(tag)
+
+    tagList = todo.getTagList()
+
+    for i in range(size):
+        ticket = Ticket()
+        ticket.setDescription(" ".join([rng.choice(WORDS) for j in range(rng.randint(3, 12))]))
+        ticket.setPriority(weightedChoice(rng, PRIORITY_WEIGHTS))
+        ticket.setStatus(weightedChoice(rng, STATUS_WEIGHTS))
+        for tag in pickTags(rng, tagList, weightedChoice(rng, TAG_COUNT_WEIGHTS)):
+            ticket.addTag(tag)
+        todo.addTicket(ticket)
+
+    todo.clearChangeList()
+    return todo
+
+def getTimerResolution():
+    # Smallest step of the timer seen over a few reads
+    timer = timeit.default_timer
+    resolution = None
+
+    for i in range(100):
+        start = timer()
+        end = timer()
+        while end == start:
+            end = timer()
+        if resolution == None or end - start < resolution:
+            resolution = end - start
+
+    return resolution
+
+class NullSerializer:
+    def save(self, todo):
+        return ErrorCode.kOk
+
+class Benchmark:
+    def __init__(self, repeat, threadCounts):
+        self.repeat  = repeat
+        self.threadCounts = threadCounts
+        self.results = {}
+        self.timerResolution = getTimerResolution()
+
+        # Command output is discarded while the shell is measured
+        self.out = sys.stdout
+
+    def run(self, size, name, func, count):
+        # A single call is often shorter than the timer resolution, calls are
+        # timed in batches. The fastest batch is the least disturbed by the
+        # rest of the machine. func gets a different index on every call.
+        batchCount  = min(BATCH_COUNT, count)
+        number      = count / batchCount
+        callIndex   = itertools.count()
+        timings     = timeit.Timer(lambda: func(callIndex.next())).repeat(repeat=batchCount, number=number)
+
+        timings.sort()
+        if timings[0] < MIN_TIMER_TICKS * self.timerResolution:
+            print >> self.out, "%8d %-34s      skipped, below the timer resolution" % (size, name)
+            return
+
+        result = {
+            "count":  batchCount * number,
+            "number": number,
+            "mean":   sum(timings) / (batchCount * number),
+            "median": timings[batchCount / 2] / number,
+            "min":    timings[0] / number,
+            "max":    timings[-1] / number,
+        }
+
+        self.results.setdefault(str(size), {})[name] = result
+        print >> self.out, "%8d %-34s %12.3f us" % (size, name, result["min"] * 1e6)
+
+    def runStore(self, size, seed):
+        rng = random.Random(seed)
+
+        start = timeit.default_timer()
+        todo = generateTodoManager(size, seed)
+        duration = (timeit.default_timer() - start) / size
+        self.results.setdefault(str(size), {})["generate"] = {
+            "count":  size,
+            "mean":   duration,
+            "median": duration,
+            "min":    duration,
+        }
+
+        tagList   = todo.getTagList()
+        ticketIds = [rng.randint(1, size) for i in range(self.repeat)]
+        ticket    = todo.getTicketById(1)
+        tag       = tagList[0]
+
+        newTicket = Ticket()
+        newTicket.setDescription("benchmark ticket")
+        newTicket.setPriority(TicketPriority.kNormal)
+        newTicket.setStatus(TicketStatus.kOpened)
+
+        newTag = Tag()
+
+        # Counters are built on first use, which is not what is measured here
+        todo.getTicketCounters()
+
+        # Lookups
+        self.run(size, "getTicketById", lambda i: todo.getTicketById(ticketIds[i]), self.repeat)
+        self.run(size, "getTagById", lambda i: todo.getTagById(tagList[i % TAG_COUNT].getId()), self.repeat)
+        self.run(size, "getTagByName", lambda i: todo.getTagByName(tagList[i % TAG_COUNT].getName()), self.repeat)
+        self.run(size, "getTagList", lambda i: todo.getTagList(), self.repeat)
+        self.run(size, "getTicketCount", lambda i: todo.getTicketCount(), self.repeat)
+        self.run(size, "getOpenedTicketsCount", lambda i: todo.getOpenedTicketsCount(), self.repeat)
+        self.run(size, "getOpenedTicketsCountByTag", lambda i: todo.getOpenedTicketsCountByTag(tag), self.repeat)
+        self.run(size, "getOpenedTicketsCountByPriority",
+                 lambda i: todo.getOpenedTicketsCountByPriority(TicketPriority.kHigh), self.repeat)
+
+        # Queries, their cost grows with the result
+        queryRepeat = max(1, self.repeat / 100)
+        self.run(size, "getOpenedTickets", lambda i: todo.getOpenedTickets(), queryRepeat)
+        self.run(size, "getOpenedTicketsByTag", lambda i: todo.getOpenedTicketsByTag(tag), queryRepeat)
+        self.run(size, "getOpenedTicketsByPriority",
+                 lambda i: todo.getOpenedTicketsByPriority(TicketPriority.kHigh), queryRepeat)
+
+        # Mutations
+        def addTag(i):
+            newTag.setName("benchmark%d" % i)
+            todo.addTag(newTag)
+
+        def addTagToTicket(i):
+            ticket = todo.getTicketById(ticketIds[i])
+            if ticket != None:
+                todo.addTagToTicket(ticket, tagList[-1 - i % 10])
+
+        def closeTicket(i):
+            ticket = todo.getTicketById(ticketIds[i])
+            if ticket != None:
+                todo.closeTicket(ticket)
+
+        def removeTicket(i):
+            ticket = todo.getTicketById(ticketIds[i])
+            if ticket != None:
+                todo.removeTicket(ticket)
+
+        self.run(size, "addTicket", lambda i: todo.addTicket(newTicket), self.repeat)
+        self.run(size, "addTag", addTag, self.repeat)
+        self.run(size, "removeTag", lambda i: todo.removeTag(todo.getTagByName("benchmark%d" % i)), self.repeat)
+        self.run(size, "addTagToTicket", addTagToTicket, self.repeat)
+        self.run(size, "closeTicket", closeTicket, self.repeat)
+        self.run(size, "removeTicket", removeTicket, self.repeat)
+        todo.clearChangeList()
+
+        self.runSerializers(size, todo, newTicket)
+        self.runShell(size, todo)
+        self.runThreads(size, todo, ticketIds, newTicket)
+
+    def runSerializers(self, size, todo, newTicket):
+        tmpDir = tempfile.mkdtemp()
+        ioRepeat = max(1, self.repeat / 200)
+
+        try:
+            filePath = os.path.join(tmpDir, "todolist.bin")
+
+            serializer = PickleSerializer(filePath)
+            self.run(size, "PickleSerializer.save", lambda i: serializer.save(todo), ioRepeat)
+            self.run(size, "PickleSerializer.load", lambda i: serializer.load(), ioRepeat)
+
+            journalSerializer = JournalSerializer(filePath)
+            (res, journalTodo) = journalSerializer.load()
+
+            def saveJournal(i):
+                journalTodo.addTicket(newTicket)
+                journalTodo.save()
+
+            self.run(size, "JournalSerializer.save", saveJournal, self.repeat / 10)
+            self.run(size, "JournalSerializer.load", lambda i: JournalSerializer(filePath).load(), ioRepeat)
+
+            sqliteSerializer = SqliteSerializer(os.path.join(tmpDir, "todolist.db"))
+            sqliteSerializer.importTodoManager(todo)
+            sqliteSerializer.close()
+
+            def loadSqlite(i):
+                (res, sqliteTodo) = sqliteSerializer.load()
+                sqliteSerializer.close()
+
+            self.run(size, "SqliteSerializer.load", loadSqlite, ioRepeat)
+
+            (res, sqliteTodo) = sqliteSerializer.load()
+
+            def saveSqlite(i):
+                sqliteTodo.addTicket(newTicket)
+                sqliteTodo.save()
+
+            self.run(size, "SqliteSerializer.save", saveSqlite, self.repeat / 10)
+            sqliteSerializer.close()
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def runShell(self, size, todo):
+        todo.setSerializer(NullSerializer())
+
+        shell = Shell(todo)
+        shell.register_command_list([
+            CommandPrintTagList(),
+            CommandAddTag(),
+            CommandPrintOpenedTicketList(),
+            CommandOpenTicket(),
+            CommandPrintTicket(),
+            CommandCloseTicket(),
+            CommandAddTagToTicket(),
+        ])
+
+        ticketId = todo.ticketLastId
+        lineList = [
+            ("printTicket", "printTicket %d" % ticketId),
+            ("printTagList", "printTagList"),
+            ("openTicket", "openTicket \"benchmark ticket\""),
+            ("addTagToTicket", "addTagToTicket %d tag1" % ticketId),
+            ("closeTicket", "closeTicket %d" % ticketId),
+        ]
+
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            for (name, line) in lineList:
+                self.run(size, "Shell.onecmd %s" % name, lambda i: shell.onecmd(line), self.repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    def runThreads(self, size, todo, ticketIds, newTicket):
+        todo.enableThreadSafety()
+        tag = todo.getTagList()[0]
+
+        def read(i):
+            todo.getTicketById(ticketIds[i % len(ticketIds)])
+            todo.getOpenedTicketsPage(10, afterId=ticketIds[i % len(ticketIds)])
+            todo.getOpenedTicketsCountByTag(tag)
+
+        def write():
+            while stopEvent.is_set() == False:
+                todo.addTicket(newTicket)
+
+        for withWriter in [False, True]:
+            for threadCount in self.threadCounts:
+                stopEvent = threading.Event()
+                readerList = [threading.Thread(target=lambda: [read(i) for i in range(self.repeat)])
+                              for j in range(threadCount)]
+                writer = threading.Thread(target=write)
+
+                start = timeit.default_timer()
+                if withWriter:
+                    writer.start()
+                for reader in readerList:
+                    reader.start()
+                for reader in readerList:
+                    reader.join()
+                duration = timeit.default_timer() - start
+
+                stopEvent.set()
+                if withWriter:
+                    writer.join()
+
+                # Time of one read, throughput scales when it goes down with more threads
+                callCount = threadCount * self.repeat
+                name = "threads %d readers%s" % (threadCount, " + writer" if withWriter else "")
+                self.results.setdefault(str(size), {})[name] = {
+                    "count":  callCount,
+                    "mean":   duration / callCount,
+                    "median": duration / callCount,
+                    "min":    duration / callCount,
+                }
+                print >> self.out, "%8d %-34s %12.3f us %10d reads/s" % (size, name, duration / callCount * 1e6,
+                                                                          callCount / duration)
+
+        todo.clearChangeList()
+
+def compareResults(results, baseline, maxRatio):
+    regressionCount = 0
+    comparedCount   = 0
+
+    for (size, operations) in sorted(results.items(), key=lambda item: int(item[0])):
+        for (name, result) in sorted(operations.items()):
+            baselineResult = baseline.get(size, {}).get(name)
+            if baselineResult == None or baselineResult.get("min", 0) == 0:
+                continue
+
+            # The fastest batch is the least sensitive to the load of the machine
+            comparedCount = comparedCount + 1
+            ratio = result["min"] / baselineResult["min"]
+            if ratio > maxRatio:
+                regressionCount = regressionCount + 1
+                print "REGRESSION %8s %-34s %.2fx slower than baseline" % (size, name, ratio)
+
+    print "%d results compared with the baseline, %d regressions" % (comparedCount, regressionCount)
+    return regressionCount
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark libtodomanager and the command line dispatch")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="ticket counts of the generated stores")
+    parser.add_argument("--repeat", type=int, default=1000,
+                        help="number of calls of each single-ticket operation, split in %d batches" % BATCH_COUNT)
+    parser.add_argument("--threads", type=int, nargs="+", default=DEFAULT_THREAD_COUNTS,
+                        help="reader thread counts of the thread safe mode stress")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated stores")
+    parser.add_argument("--output", default="benchmark-results.json", help="file where results are written")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--max-ratio", type=float, default=1.5, help="slowdown above which an operation is a regression")
+    args = parser.parse_args()
+
+    # Read first, a missing baseline is reported before the long run
+    baseline = None
+    if args.baseline != None:
+        try:
+            baselineFile = open(args.baseline)
+        except IOError, e:
+            print "Unable to read the baseline : %s" % (e)
+            print "Write one with --output %s on the revision to compare with" % (args.baseline)
+            return 2
+
+        baseline = json.load(baselineFile)
+        baselineFile.close()
+
+    benchmark = Benchmark(args.repeat, args.threads)
+    for size in args.sizes:
+        benchmark.runStore(size, args.seed)
+
+    output = {
+        "python":   platform.python_version(),
+        "platform": platform.platform(),
+        "repeat":   args.repeat,
+        "seed":     args.seed,
+        "results":  benchmark.results,
+    }
+
+    outputFile = open(args.output, "w")
+    json.dump(output, outputFile, indent=2, sort_keys=True)
+    outputFile.close()
+
+    if baseline != None:
+        if compareResults(benchmark.results, baseline["results"], args.max_ratio) > 0:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import unittest
+import asyncore
+import json
+import socket
+import threading
+from libtodomanager.todomanager import *
+from libtodomanager.httpserver import *
+from libtodomanager.stats import *
+
+def fillTodoManager(todo):
+    tag = Tag()
+    tag.setName("bug")
+    (res, createdTag) = todo.addTag(tag)
+
+    for i in range(5):
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kHigh if i < 2 else TicketPriority.kLow)
+        ticket.setDescription("Ticket %d" % (i + 1))
+        (res, createdTicket) = todo.addTicket(ticket)
+        if i % 2 == 0:
+            todo.addTagToTicket(createdTicket, createdTag)
+
+    todo.closeTicket(todo.getTicketById(3))
+    return createdTag
+
+class TestHttpApi(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+        self.tag  = fillTodoManager(self.todo)
+        self.api  = HttpApi(self.todo)
+
+    def get(self, target, headerByName = {}):
+        (status, headerList, body) = self.api.handleRequest("GET", target, headerByName)
+        if body == "":
+            return (status, dict(headerList), None)
+
+        return (status, dict(headerList), json.loads(body))
+
+    def runTest(self):
+        (status, headerByName, content) = self.get("/tags")
+        self.assertEqual(status, 200)
+        self.assertEqual(content, {"tags": [{"id": 1, "name": "bug"}]})
+
+        (status, headerByName, content) = self.get("/tickets/1")
+        self.assertEqual(content, {"id": 1, "description": "Ticket 1", "priority": "high", "status": "opened",
+                                   "tags": ["bug"]})
+        self.assertEqual(self.get("/tickets/3")[2]["status"], "closed")
+        self.assertEqual(self.get("/tickets/9")[0], 404)
+        self.assertEqual(self.get("/tags/9")[0], 404)
+        self.assertEqual(self.get("/unknown")[0], 404)
+
+        # Pages of opened tickets, "next" is the cursor of the following one
+        (status, headerByName, content) = self.get("/tickets/opened?limit=2")
+        self.assertEqual([ticket["id"] for ticket in content["tickets"]], [1, 2])
+        self.assertEqual(content["next"], 2)
+        (status, headerByName, content) = self.get("/tickets/opened?limit=2&after=2")
+        self.assertEqual([ticket["id"] for ticket in content["tickets"]], [4, 5])
+        (status, headerByName, content) = self.get("/tickets/opened?after=4")
+        self.assertEqual([ticket["id"] for ticket in content["tickets"]], [5])
+        self.assertEqual(content["next"], None)
+
+        self.assertEqual([ticket["id"] for ticket in self.get("/tickets/opened?tag=bug")[2]["tickets"]], [1, 5])
+        self.assertEqual([ticket["id"] for ticket in self.get("/tickets/opened?priority=low")[2]["tickets"]], [4, 5])
+        self.assertEqual(self.get("/tickets/opened/count")[2], {"count": 4})
+        self.assertEqual(self.get("/tickets/opened/count?tag=bug")[2], {"count": 2})
+        self.assertEqual(self.get("/tickets/opened/count?priority=HIGH")[2], {"count": 2})
+        self.assertEqual([ticket["id"] for ticket in self.get("/search?q=ticket+4")[2]["tickets"]], [4])
+
+        self.assertEqual(self.get("/tickets/opened?tag=unknown")[0], 404)
+        self.assertEqual(self.get("/tickets/opened?priority=urgent")[0], 400)
+        self.assertEqual(self.get("/tickets/opened?limit=ten")[0], 400)
+        self.assertEqual(self.get("/tickets/opened?limit=0")[0], 400)
+        self.assertEqual(self.get("/tickets/opened?limit=-1")[0], 400)
+        self.assertEqual(self.get("/search?q=ticket&limit=0")[0], 400)
+        self.assertEqual(self.get("/search")[0], 400)
+        self.assertEqual(self.api.handleRequest("POST", "/tags", {})[0], 405)
+
+        # Text which is not UTF-8 is sent with replacement characters
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kLow)
+        ticket.setDescription("caf\xe9")
+        (res, createdTicket) = self.todo.addTicket(ticket)
+        (status, headerByName, content) = self.get("/tickets/%d" % createdTicket.getId())
+        self.assertEqual(status, 200)
+        self.assertEqual(content["description"], u"caf\ufffd")
+        self.assertEqual(self.get("/tickets/opened?tag=%ff")[0], 404)
+        self.todo.removeTicket(createdTicket)
+
+        # Unchanged content is not queried again
+        (status, headerByName, content) = self.get("/tags")
+        etag = headerByName["ETag"]
+        self.assertEqual(self.get("/tags", {"if-none-match": etag}), (304, {"ETag": etag}, None))
+        self.assertEqual(self.get("/tickets/1", {"if-none-match": "\"other\", %s" % etag})[0], 304)
+        self.assertEqual(self.get("/tickets/1", {"if-none-match": "*"})[0], 304)
+
+        self.todo.closeTicket(self.todo.getTicketById(1))
+        (status, headerByName, content) = self.get("/tags", {"if-none-match": etag})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headerByName["ETag"], etag)
+
+        # Another process has its own ETags even at the same generation
+        self.assertNotEqual(HttpApi(self.todo).getETag(), self.api.getETag())
+
+        # Stats are never answered with a 304
+        globalStats.reset()
+        globalStats.enable()
+        try:
+            self.get("/tags")
+            self.get("/unknown")
+            (status, headerByName, content) = self.get("/stats", {"if-none-match": "*"})
+        finally:
+            globalStats.enable(False)
+            globalStats.reset()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(content["phases"]["http.request"]["count"], 2)
+        self.assertEqual(content["counters"], {"http.status.200": 1, "http.status.404": 1})
+
+class TestHttpServer(unittest.TestCase):
+    def setUp(self):
+        self.todo      = TodoManager()
+        fillTodoManager(self.todo)
+        self.socketMap = {}
+        self.server    = HttpServer(("127.0.0.1", 0), self.todo, self.socketMap)
+        self.stopEvent = threading.Event()
+        self.thread    = threading.Thread(target=self.loop)
+        self.thread.start()
+
+    def tearDown(self):
+        self.stopEvent.set()
+        self.thread.join()
+        asyncore.close_all(self.socketMap)
+
+    def loop(self):
+        while self.stopEvent.is_set() == False:
+            asyncore.loop(timeout=0.05, map=self.socketMap, count=1)
+
+    def request(self, data):
+        clientSocket = socket.create_connection(self.server.getAddress())
+        clientSocket.sendall(data)
+
+        # The server closes the connection after the last response
+        chunkList = []
+        while True:
+            chunk = clientSocket.recv(65536)
+            if chunk == "":
+                break
+            chunkList.append(chunk)
+        clientSocket.close()
+
+        responseList = []
+        data = "".join(chunkList)
+        while data != "":
+            (header, separator, data) = data.partition("\r\n\r\n")
+            lineList = header.split("\r\n")
+            headerByName = dict([line.split(": ", 1) for line in lineList[1:]])
+            size = int(headerByName.get("Content-Length", "0"))
+            responseList.append((lineList[0], headerByName, data[:size]))
+            data = data[size:]
+
+        return responseList
+
+    def runTest(self):
+        # Pipelined requests are answered in order on the same connection
+        responseList = self.request("GET /tickets/opened/count HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                                    "GET /tickets/2 HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                                    "GET /tags/1 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+        self.assertEqual([statusLine for (statusLine, headerByName, body) in responseList],
+                         ["HTTP/1.1 200 OK"] * 3)
+        self.assertEqual(json.loads(responseList[0][2]), {"count": 4})
+        self.assertEqual(json.loads(responseList[1][2])["description"], "Ticket 2")
+        self.assertEqual(json.loads(responseList[2][2]), {"id": 1, "name": "bug"})
+        self.assertEqual(responseList[0][1]["Connection"], "keep-alive")
+        self.assertEqual(responseList[2][1]["Connection"], "close")
+
+        # The length of the body is given without the body
+        clientSocket = socket.create_connection(self.server.getAddress())
+        clientSocket.sendall("HEAD /tags HTTP/1.1\r\nConnection: close\r\n\r\n")
+        response = "".join(iter(lambda: clientSocket.recv(65536), ""))
+        clientSocket.close()
+        self.assertTrue(response.endswith("\r\n\r\n"))
+        self.assertTrue("Content-Length: %d" % len(json.dumps({"tags": [{"id": 1, "name": "bug"}]})) in response)
+
+        # Conditional read, HTTP/1.0 closes by default
+        etag = responseList[0][1]["ETag"]
+        responseList = self.request("GET /tags HTTP/1.0\r\nIf-None-Match: %s\r\n\r\n" % etag)
+        self.assertEqual(responseList, [("HTTP/1.1 304 Not Modified", {"ETag": etag, "Connection": "close"}, "")])
+
+        responseList = self.request("garbage\r\n\r\n")
+        self.assertEqual(responseList[0][0], "HTTP/1.1 400 Bad Request")
+
+        responseList = self.request("GET /tags HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc")
+        self.assertEqual(responseList[0][0], "HTTP/1.1 400 Bad Request")
+
+        # A failing handler answers a 500, the pipelined requests are kept
+        def failTagList():
+            raise ValueError("Broken tag list")
+        self.todo.getTagList = failTagList
+        responseList = self.request("GET /tags HTTP/1.1\r\n\r\n"
+                                    "GET /tags/1 HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertEqual([statusLine for (statusLine, headerByName, body) in responseList],
+                         ["HTTP/1.1 500 Internal Server Error", "HTTP/1.1 200 OK"])
+        self.assertEqual(json.loads(responseList[0][2]), {"error": "Internal error: ValueError"})
+
+if __name__ == '__main__':
+    unittest.main()
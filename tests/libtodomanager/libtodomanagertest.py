@@ -20,7 +20,19 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import unittest
+import pickle
+import copy
+import warnings
+import json
+import threading
 from libtodomanager.todomanager import *
+from libtodomanager.columnstore import *
+from libtodomanager.textindex import *
+from libtodomanager.locking import *
+from libtodomanager.lazytodomanager import *
+from libtodomanager.stats import *
+from libtodomanager.query import *
+import libtodomanager.columnstore
 
 class TestTagManagement(unittest.TestCase):
     def setUp(self):
@@ -92,6 +104,49 @@ class TestTagManagement(unittest.TestCase):
 
         self.assertEqual(self.todo.getTagCount(), 0)
 
+class TestTicketTagList(unittest.TestCase):
+    def runTest(self):
+        todo = TodoManager()
+        tag = Tag()
+        tag.setName("Tag 1")
+        (res, createdTag) = todo.addTag(tag)
+
+        ticket = Ticket()
+        ticket.addTag(createdTag)
+
+        # Still answered for the callers written before tag ids, with a warning
+        with warnings.catch_warnings(record=True) as warningList:
+            warnings.simplefilter("always")
+            self.assertEqual([tag.getId() for tag in ticket.getTagList()], [createdTag.getId()])
+            self.assertEqual([tag.getName() for tag in ticket.getTagList(todo)], ["Tag 1"])
+
+        self.assertEqual([warning.category for warning in warningList], [DeprecationWarning] * 2)
+
+class TestTagNamePrefix(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+
+        for tagName in ["release", "bug", "backend", "refactor", "bugfix", "regression", "build"]:
+            tag = Tag()
+            tag.setName(tagName)
+            (res, createdTag) = self.todo.addTag(tag)
+            self.assertEqual(res, ErrorCode.kOk)
+
+    def runTest(self):
+        self.assertEqual(self.todo.getTagNamesByPrefix("b"), ["backend", "bug", "bugfix", "build"])
+        self.assertEqual(self.todo.getTagNamesByPrefix("b", 2), ["backend", "bug"])
+        self.assertEqual(self.todo.getTagNamesByPrefix("re"), ["refactor", "regression", "release"])
+        self.assertEqual(self.todo.getTagNamesByPrefix("bugfix"), ["bugfix"])
+        self.assertEqual(self.todo.getTagNamesByPrefix("z"), [])
+        self.assertEqual(len(self.todo.getTagNamesByPrefix("")), 7)
+
+        res = self.todo.removeTag(self.todo.getTagByName("bug"))
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(self.todo.getTagNamesByPrefix("bu"), ["bugfix", "build"])
+
+        loadedTodo = pickle.loads(pickle.dumps(self.todo))
+        self.assertEqual(loadedTodo.getTagNamesByPrefix("b"), ["backend", "bugfix", "build"])
+
 class TestTicketManagement(unittest.TestCase):
     def setUp(self):
         self.todo = TodoManager()
@@ -202,6 +257,789 @@ class TestTicketManagement(unittest.TestCase):
         self.assertEqual(self.todo.getTicketCount(), 1)
         self.assertEqual(self.todo.getOpenedTicketsCount(), 0)
 
+class TestIndexRebuild(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+
+        tag = Tag()
+        tag.setName("Tag 1")
+        (res, self.tag) = self.todo.addTag(tag)
+        self.assertEqual(res, ErrorCode.kOk)
+
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("Ticket 1")
+        (res, self.ticket) = self.todo.addTicket(ticket)
+        self.assertEqual(res, ErrorCode.kOk)
+
+    def runTest(self):
+        # Indexes are not pickled, so this is also what an old pickle looks like
+        todo = pickle.loads(pickle.dumps(self.todo))
+
+        tag = todo.getTagByName("Tag 1")
+        self.assertNotEqual(tag, None)
+        self.assertEqual(tag.getId(), self.tag.getId())
+
+        tag = todo.getTagById(self.tag.getId())
+        self.assertNotEqual(tag, None)
+        self.assertEqual(tag.getName(), "Tag 1")
+
+        ticket = todo.getTicketById(self.ticket.getId())
+        self.assertNotEqual(ticket, None)
+        self.assertEqual(ticket.getDescription(), "Ticket 1")
+
+        res = todo.addTagToTicket(ticket, tag)
+        self.assertEqual(res, ErrorCode.kOk)
+
+        res = todo.removeTicket(ticket)
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(todo.getTicketById(self.ticket.getId()), None)
+
+        res = todo.removeTag(tag)
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(todo.getTagByName("Tag 1"), None)
+
+class TestOpenedTicketQueries(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+
+        tag = Tag()
+        tag.setName("Tag 1")
+        (res, self.tag) = self.todo.addTag(tag)
+        self.assertEqual(res, ErrorCode.kOk)
+
+        self.ticketList = []
+        for i in range(6):
+            ticket = Ticket()
+            ticket.setStatus(TicketStatus.kOpened)
+            if i % 2 == 0:
+                ticket.setPriority(TicketPriority.kHigh)
+            else:
+                ticket.setPriority(TicketPriority.kLow)
+            ticket.setDescription("Ticket %d" % (i + 1))
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            self.assertEqual(res, ErrorCode.kOk)
+            self.ticketList.append(createdTicket)
+
+    def getIds(self, ticketList):
+        return [ticket.getId() for ticket in ticketList.getContent()]
+
+    def runTest(self):
+        ticketIds = [ticket.getId() for ticket in self.ticketList]
+
+        for ticket in self.ticketList[:3]:
+            res = self.todo.addTagToTicket(ticket, self.tag)
+            self.assertEqual(res, ErrorCode.kOk)
+
+        self.assertEqual(self.getIds(self.todo.getOpenedTickets()), ticketIds)
+        self.assertEqual(self.getIds(self.todo.getOpenedTicketsByTag(self.tag)), ticketIds[:3])
+        self.assertEqual(self.getIds(self.todo.getOpenedTicketsByPriority(TicketPriority.kHigh)), ticketIds[0::2])
+        self.assertEqual(self.getIds(self.todo.getOpenedTicketsByPriority(TicketPriority.kNormal)), [])
+
+        res = self.todo.closeTicket(self.ticketList[0])
+        self.assertEqual(res, ErrorCode.kOk)
+        res = self.todo.removeTicket(self.ticketList[1])
+        self.assertEqual(res, ErrorCode.kOk)
+
+        for todo in [self.todo, pickle.loads(pickle.dumps(self.todo))]:
+            self.assertEqual(self.getIds(todo.getOpenedTickets()), ticketIds[2:])
+            self.assertEqual(self.getIds(todo.getOpenedTicketsByTag(self.tag)), ticketIds[2:3])
+            self.assertEqual(self.getIds(todo.getOpenedTicketsByPriority(TicketPriority.kHigh)), ticketIds[2::2])
+            self.assertEqual(self.getIds(todo.getOpenedTicketsByPriority(TicketPriority.kLow)), ticketIds[3::2])
+
+class TestTicketPagination(unittest.TestCase):
+    def setUp(self):
+        self.todoList = [TodoManager(), TodoManager(ticketStore=createColumnTicketStore())]
+
+        for todo in self.todoList:
+            for i in range(2):
+                tag = Tag()
+                tag.setName("Tag %d" % (i + 1))
+                (res, createdTag) = todo.addTag(tag)
+                self.assertEqual(res, ErrorCode.kOk)
+
+            for i in range(2500):
+                ticket = Ticket()
+                ticket.setStatus(TicketStatus.kOpened)
+                ticket.setPriority([TicketPriority.kHigh, TicketPriority.kNormal][i % 2])
+                ticket.setDescription("Ticket %d" % (i + 1))
+                (res, createdTicket) = todo.addTicket(ticket)
+                self.assertEqual(res, ErrorCode.kOk)
+
+                # Tag 2 is sparse, its pages are not found by walking the ids
+                if i % 3 == 0:
+                    todo.addTagToTicket(createdTicket, todo.getTagByName("Tag 1"))
+                if i % 500 == 0:
+                    todo.addTagToTicket(createdTicket, todo.getTagByName("Tag 2"))
+                if i % 4 == 0:
+                    todo.closeTicket(createdTicket)
+                if i % 7 == 0:
+                    todo.removeTicket(createdTicket)
+
+    def getIds(self, ticketList):
+        return [ticket.getId() for ticket in ticketList]
+
+    def readPages(self, todo, limit):
+        ticketIds = []
+        afterId = 0
+        while True:
+            page = self.getIds(todo.getOpenedTicketsPage(limit, afterId).getContent())
+            self.assertTrue(len(page) <= limit)
+            ticketIds.extend(page)
+            if len(page) < limit:
+                return ticketIds
+            afterId = page[-1]
+
+    def runTest(self):
+        for todo in self.todoList:
+            openedIds = self.getIds(todo.getOpenedTickets().getContent())
+
+            self.assertEqual(self.getIds(todo.iterOpenedTickets()), openedIds)
+            self.assertEqual(self.getIds(todo.iterOpenedTickets(openedIds[10])), openedIds[11:])
+            self.assertEqual(self.readPages(todo, 1), openedIds)
+            self.assertEqual(self.readPages(todo, 50), openedIds)
+            self.assertEqual(self.getIds(todo.getOpenedTicketsPage(50, openedIds[-1]).getContent()), [])
+            self.assertEqual(self.getIds(todo.getOpenedTicketsPage(0).getContent()), [])
+            self.assertEqual(self.getIds(todo.getOpenedTicketsPage(-1).getContent()), [])
+
+            for priority in [TicketPriority.kHigh, TicketPriority.kNormal, TicketPriority.kLow]:
+                self.assertEqual(self.getIds(todo.iterOpenedTicketsByPriority(priority)),
+                                 self.getIds(todo.getOpenedTicketsByPriority(priority).getContent()))
+
+            for tag in todo.getTagList():
+                self.assertEqual(self.getIds(todo.iterOpenedTicketsByTag(tag)),
+                                 self.getIds(todo.getOpenedTicketsByTag(tag).getContent()))
+
+        self.assertEqual(self.readPages(self.todoList[0], 7), self.readPages(self.todoList[1], 7))
+
+        # Iterators fetch the next page from the cursor, a ticket closed meanwhile is skipped
+        todo = self.todoList[0]
+        openedIds = self.getIds(todo.getOpenedTickets().getContent())
+        ticketIterator = todo.iterOpenedTickets()
+        self.assertEqual(ticketIterator.next().getId(), openedIds[0])
+        self.assertEqual(todo.closeTicket(todo.getTicketById(openedIds[-1])), ErrorCode.kOk)
+        self.assertEqual([ticket.getId() for ticket in ticketIterator], openedIds[1:-1])
+
+class TestBulkMutations(unittest.TestCase):
+    def setUp(self):
+        self.todoList = [TodoManager(), TodoManager(ticketStore=createColumnTicketStore())]
+
+        for todo in self.todoList:
+            tag = Tag()
+            tag.setName("Tag 1")
+            (res, createdTag) = todo.addTag(tag)
+            self.assertEqual(res, ErrorCode.kOk)
+
+    def createTicket(self, description):
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription(description)
+        return ticket
+
+    def runTest(self):
+        for todo in self.todoList:
+            # Counters are built first to check they follow the bulk updates
+            self.assertEqual(todo.getOpenedTicketsCount(), 0)
+
+            ticketList = [self.createTicket("Ticket %d" % (i + 1)) for i in range(5)]
+            ticketList.insert(2, None)
+            ticketList.insert(4, Ticket())
+
+            resList = todo.addTickets(ticketList)
+            self.assertEqual([res for (res, createdTicket) in resList],
+                             [ErrorCode.kOk, ErrorCode.kOk, ErrorCode.kWrongParam, ErrorCode.kOk,
+                              ErrorCode.kWrongParam, ErrorCode.kOk, ErrorCode.kOk])
+            self.assertEqual([createdTicket.getId() for (res, createdTicket) in resList if createdTicket != None], range(1, 6))
+            self.assertEqual(todo.getTicketById(5).getDescription(), "Ticket 5")
+            self.assertEqual(todo.getOpenedTicketsCount(), 5)
+            self.assertEqual(todo.getGeneration(), 6)
+
+            tag = todo.getTagByName("Tag 1")
+            self.assertEqual(todo.closeTickets([2, 9, 2]),
+                             [ErrorCode.kOk, ErrorCode.kTicketNotFound, ErrorCode.kTicketAlreadyClosed])
+            self.assertEqual(todo.addTagToTickets([1, 2, 3, 3, 9], tag),
+                             [ErrorCode.kOk, ErrorCode.kTicketClosed, ErrorCode.kOk, ErrorCode.kTicketAlreadyHasTag,
+                              ErrorCode.kTicketNotFound])
+            self.assertEqual(todo.addTagToTickets([1, 4], None), [ErrorCode.kWrongParam, ErrorCode.kWrongParam])
+
+            self.assertEqual(todo.getOpenedTicketsCount(), 4)
+            self.assertEqual(todo.getOpenedTicketsCountByTag(tag), 2)
+            self.assertEqual([ticket.getId() for ticket in todo.getOpenedTicketsByTag(tag).getContent()], [1, 3])
+            self.assertEqual(todo.getTicketCounters().countByTag, todo.ticketStore.buildTicketCounters().countByTag)
+
+            # The bulk changes are replayed like the single ones
+            replayedTodo = TodoManager()
+            for change in todo.getChangeList():
+                replayedTodo.applyChange(change)
+            self.assertEqual([ticket.getId() for ticket in replayedTodo.getOpenedTicketsByTag(tag).getContent()], [1, 3])
+            self.assertEqual(replayedTodo.getOpenedTicketsCount(), 4)
+
+class TestTextSearch(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+
+        for description in ["Fix the crash on startup", "Write the user manual", "Crash when saving, crash again",
+                            "Speed up startup", "Fix typo in the manual"]:
+            ticket = Ticket()
+            ticket.setStatus(TicketStatus.kOpened)
+            ticket.setPriority(TicketPriority.kNormal)
+            ticket.setDescription(description)
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            self.assertEqual(res, ErrorCode.kOk)
+
+    def search(self, todo, query, limit = None):
+        return [ticket.getId() for ticket in todo.searchTickets(query, limit).getContent()]
+
+    def runTest(self):
+        self.assertEqual(TextIndex.tokenize("Fix the CRASH, again!"), ["fix", "the", "crash", "again"])
+
+        # The ticket which repeats the term ranks first
+        self.assertEqual(self.search(self.todo, "crash"), [3, 1])
+        self.assertEqual(self.search(self.todo, "crash", 1), [3])
+        self.assertEqual(self.search(self.todo, "STARTUP fix"), [1])
+        self.assertEqual(self.search(self.todo, "manual"), [2, 5])
+        self.assertEqual(self.search(self.todo, "crash manual"), [])
+        self.assertEqual(self.search(self.todo, "unknown"), [])
+        self.assertEqual(self.search(self.todo, " ,"), [])
+
+        # The index follows the tickets once it is built
+        self.assertEqual(self.todo.removeTicket(self.todo.getTicketById(3)), ErrorCode.kOk)
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("Crash in the manual")
+        (res, createdTicket) = self.todo.addTicket(ticket)
+        self.assertEqual(res, ErrorCode.kOk)
+
+        self.assertEqual(self.search(self.todo, "crash"), [6, 1])
+        self.assertEqual(self.search(self.todo, "crash manual"), [6])
+
+        loadedTodo = pickle.loads(pickle.dumps(self.todo))
+        self.assertEqual(self.search(loadedTodo, "crash"), self.search(self.todo, "crash"))
+
+class TestViewIsolation(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+
+        tag = Tag()
+        tag.setName("Tag 1")
+        (res, createdTag) = self.todo.addTag(tag)
+        self.assertEqual(res, ErrorCode.kOk)
+
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("Ticket 1")
+        ticket.addTag(createdTag)
+        (res, self.ticket) = self.todo.addTicket(ticket)
+        self.assertEqual(res, ErrorCode.kOk)
+
+    def runTest(self):
+        ticket = self.todo.getTicketById(self.ticket.getId())
+        ticket.setDescription("Modified")
+        ticket.setPriority(TicketPriority.kHigh)
+        ticket.getTagList()[0].setName("Modified")
+        self.assertEqual(ticket.getDescription(), "Modified")
+
+        tag = self.todo.getTagByName("Tag 1")
+        tag.setName("Modified")
+        self.assertEqual(tag.getName(), "Modified")
+        self.assertEqual(self.todo.getTagByName("Modified"), None)
+        self.assertEqual(self.todo.getTagList()[0].getName(), "Tag 1")
+
+        for ticket in [self.todo.getTicketById(self.ticket.getId()), self.todo.getOpenedTickets().getTicketByIndex(0)]:
+            self.assertEqual(ticket.getDescription(), "Ticket 1")
+            self.assertEqual(ticket.getPriority(), TicketPriority.kNormal)
+            self.assertEqual(ticket.getTagList()[0].getName(), "Tag 1")
+
+        # A modified view can be used to create a new ticket
+        ticket = self.todo.getTicketById(self.ticket.getId())
+        ticket.setDescription("Ticket 2")
+        (res, createdTicket) = self.todo.addTicket(ticket)
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(self.todo.getTicketById(createdTicket.getId()).getDescription(), "Ticket 2")
+        self.assertEqual(self.todo.getTicketById(self.ticket.getId()).getDescription(), "Ticket 1")
+
+def checkViewSnapshot(test, todo):
+    # A view keeps the ticket it was returned with, whatever changes after it
+    tag = Tag()
+    tag.setName("Tag 1")
+    (res, createdTag) = todo.addTag(tag)
+    test.assertEqual(res, ErrorCode.kOk)
+
+    ticket = Ticket()
+    ticket.setStatus(TicketStatus.kOpened)
+    ticket.setPriority(TicketPriority.kNormal)
+    ticket.setDescription("Ticket 1")
+    (res, createdTicket) = todo.addTicket(ticket)
+    test.assertEqual(res, ErrorCode.kOk)
+
+    view = todo.getTicketById(createdTicket.getId())
+    test.assertEqual(todo.addTagToTicket(view, createdTag), ErrorCode.kOk)
+    test.assertEqual(todo.closeTicket(view), ErrorCode.kOk)
+    test.assertEqual(view.getStatus(), TicketStatus.kOpened)
+    test.assertEqual(view.getTagIdList(), ())
+
+    view = todo.getTicketById(createdTicket.getId())
+    test.assertEqual(view.getStatus(), TicketStatus.kClosed)
+    test.assertEqual([tag.getName() for tag in view.getTagList()], ["Tag 1"])
+
+    # Views are pickled and copied without the manager
+    for copiedView in [pickle.loads(pickle.dumps(view)), pickle.loads(pickle.dumps(view, 2)), copy.copy(view)]:
+        test.assertEqual(copiedView.getId(), createdTicket.getId())
+        test.assertEqual(copiedView.getStatus(), TicketStatus.kClosed)
+        test.assertEqual(copiedView.getDescription(), "Ticket 1")
+        test.assertEqual([tag.getName() for tag in copiedView.getTagList()], ["Tag 1"])
+
+    tagView = todo.getTagByName("Tag 1")
+    for copiedTag in [pickle.loads(pickle.dumps(tagView)), copy.copy(tagView), copy.deepcopy(tagView)]:
+        test.assertEqual(copiedTag.getName(), "Tag 1")
+        copiedTag.setName("Modified")
+    test.assertEqual(todo.getTagByName("Tag 1").getName(), "Tag 1")
+
+    test.assertRaises(AttributeError, getattr, TicketView.__new__(TicketView), "ticket")
+    test.assertRaises(AttributeError, getattr, TagView.__new__(TagView), "tag")
+    test.assertFalse(hasattr(view, "__length_hint__"))
+
+class TestViewSnapshot(unittest.TestCase):
+    def runTest(self):
+        for todo in [TodoManager(), TodoManager(ticketStore=createColumnTicketStore())]:
+            checkViewSnapshot(self, todo)
+
+class TestColumnTicketStore(unittest.TestCase):
+    def setUp(self):
+        self.todoList = [TodoManager(), TodoManager(ticketStore=createColumnTicketStore())]
+
+        for todo in self.todoList:
+            for i in range(3):
+                tag = Tag()
+                tag.setName("Tag %d" % (i + 1))
+                (res, createdTag) = todo.addTag(tag)
+                self.assertEqual(res, ErrorCode.kOk)
+
+            # Enough tickets to grow and compact the columns
+            for i in range(3000):
+                ticket = Ticket()
+                ticket.setStatus(TicketStatus.kOpened)
+                ticket.setPriority([TicketPriority.kHigh, TicketPriority.kNormal, TicketPriority.kLow][i % 3])
+                ticket.setDescription("Ticket %d" % (i + 1))
+                (res, createdTicket) = todo.addTicket(ticket)
+                self.assertEqual(res, ErrorCode.kOk)
+
+                if i % 5 == 0:
+                    todo.addTagToTicket(createdTicket, todo.getTagByName("Tag %d" % (i % 3 + 1)))
+                if i % 4 == 0:
+                    todo.closeTicket(createdTicket)
+                if i % 7 == 0:
+                    todo.removeTicket(createdTicket)
+
+            for i in range(3000, 1, -2):
+                ticket = todo.getTicketById(i)
+                if ticket != None:
+                    todo.removeTicket(ticket)
+
+    def getIds(self, ticketList):
+        return [ticket.getId() for ticket in ticketList.getContent()]
+
+    @unittest.skipUnless(ColumnTicketStore.isAvailable(), "NumPy is not installed")
+    def testColumnStore(self):
+        self.assertTrue(isinstance(self.todoList[1].ticketStore, ColumnTicketStore))
+        self.compareQueries()
+
+    def testFallback(self):
+        numpyModule = libtodomanager.columnstore.numpy
+        libtodomanager.columnstore.numpy = None
+        try:
+            self.assertTrue(isinstance(createColumnTicketStore(), TicketStore))
+        finally:
+            libtodomanager.columnstore.numpy = numpyModule
+
+    def compareQueries(self):
+        (todo, columnTodo) = self.todoList
+
+        self.assertEqual(columnTodo.getTicketCount(), todo.getTicketCount())
+        self.assertEqual(columnTodo.getOpenedTicketsCount(), todo.getOpenedTicketsCount())
+        self.assertEqual(columnTodo.ticketStore.buildTicketCounters().countByTag,
+                         todo.ticketStore.buildTicketCounters().countByTag)
+        self.assertEqual(columnTodo.ticketStore.buildTicketCounters().countByPriority,
+                         todo.ticketStore.buildTicketCounters().countByPriority)
+        self.assertEqual(self.getIds(columnTodo.getOpenedTickets()), self.getIds(todo.getOpenedTickets()))
+
+        for priority in [TicketPriority.kHigh, TicketPriority.kNormal, TicketPriority.kLow]:
+            self.assertEqual(self.getIds(columnTodo.getOpenedTicketsByPriority(priority)),
+                             self.getIds(todo.getOpenedTicketsByPriority(priority)))
+
+        for tag in todo.getTagList():
+            self.assertEqual(self.getIds(columnTodo.getOpenedTicketsByTag(tag)),
+                             self.getIds(todo.getOpenedTicketsByTag(tag)))
+
+class TestTicketCounters(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+
+        for i in range(2):
+            tag = Tag()
+            tag.setName("Tag %d" % (i + 1))
+            (res, createdTag) = self.todo.addTag(tag)
+            self.assertEqual(res, ErrorCode.kOk)
+
+    def checkCounters(self, todo):
+        ticketCounters = todo.getTicketCounters()
+        builtCounters  = todo.ticketStore.buildTicketCounters()
+
+        self.assertEqual(ticketCounters.countByStatus, builtCounters.countByStatus)
+        self.assertEqual(todo.getTicketCount(), todo.ticketStore.getTicketCount())
+        self.assertEqual(todo.getOpenedTicketsCount(), todo.getOpenedTickets().getTicketCount())
+
+        for priority in [TicketPriority.kHigh, TicketPriority.kNormal, TicketPriority.kLow]:
+            self.assertEqual(todo.getOpenedTicketsCountByPriority(priority),
+                             todo.getOpenedTicketsByPriority(priority).getTicketCount())
+
+        for tag in todo.getTagList():
+            self.assertEqual(todo.getOpenedTicketsCountByTag(tag), todo.getOpenedTicketsByTag(tag).getTicketCount())
+
+    def runTest(self):
+        # Counters are built now and maintained by the mutations below
+        self.assertEqual(self.todo.getOpenedTicketsCount(), 0)
+
+        tag1 = self.todo.getTagByName("Tag 1")
+        tag2 = self.todo.getTagByName("Tag 2")
+
+        for i in range(30):
+            ticket = Ticket()
+            ticket.setStatus(TicketStatus.kOpened)
+            ticket.setPriority([TicketPriority.kHigh, TicketPriority.kNormal, TicketPriority.kLow][i % 3])
+            ticket.setDescription("Ticket %d" % (i + 1))
+            if i % 2 == 0:
+                ticket.addTag(tag1)
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            self.assertEqual(res, ErrorCode.kOk)
+
+            if i % 3 == 0:
+                self.todo.addTagToTicket(createdTicket, tag2)
+            if i % 4 == 0:
+                self.todo.closeTicket(createdTicket)
+            if i % 5 == 0:
+                self.todo.removeTicket(createdTicket)
+
+        self.assertEqual(self.todo.getTicketCountByStatus(TicketStatus.kClosed), 6)
+        self.assertEqual(self.todo.getOpenedTicketsCountByTag(tag2), 6)
+        self.checkCounters(self.todo)
+
+        # Counters are not stored, they are built again after a load
+        self.checkCounters(pickle.loads(pickle.dumps(self.todo)))
+
+class TestReadWriteLock(unittest.TestCase):
+    def setUp(self):
+        self.lock = ReadWriteLock()
+
+    def runInThread(self, func):
+        event = threading.Event()
+        thread = threading.Thread(target=lambda: (func(), event.set()))
+        thread.daemon = True
+        thread.start()
+        return event
+
+    def runTest(self):
+        # Readers share the lock
+        self.lock.acquireRead()
+        event = self.runInThread(lambda: (self.lock.acquireRead(), self.lock.releaseRead()))
+        self.assertTrue(event.wait(5))
+
+        # A writer waits for the readers
+        event = self.runInThread(lambda: (self.lock.acquireWrite(), self.lock.releaseWrite()))
+        self.assertFalse(event.wait(0.2))
+        self.lock.releaseRead()
+        self.assertTrue(event.wait(5))
+
+        # Readers wait for the writer, which may read and write again
+        self.lock.acquireWrite()
+        self.lock.acquireRead()
+        self.lock.acquireWrite()
+        self.lock.releaseWrite()
+        self.lock.releaseRead()
+        event = self.runInThread(lambda: (self.lock.acquireRead(), self.lock.releaseRead()))
+        self.assertFalse(event.wait(0.2))
+        self.lock.releaseWrite()
+        self.assertTrue(event.wait(5))
+
+        # A read taken by the writer may be released after the write
+        self.lock.acquireWrite()
+        self.lock.acquireRead()
+        self.lock.releaseWrite()
+        self.lock.releaseRead()
+        self.assertEqual(self.lock.readerCount, 0)
+        event = self.runInThread(lambda: (self.lock.acquireWrite(), self.lock.releaseWrite()))
+        self.assertTrue(event.wait(5))
+
+        # A reader cannot become a writer
+        self.lock.acquireRead()
+        self.assertRaises(RuntimeError, self.lock.acquireWrite)
+        self.lock.releaseRead()
+        self.assertEqual(self.lock.readerCount, 0)
+
+class TestThreadSafeTodoManager(unittest.TestCase):
+    kWriterCount = 4
+    kReaderCount = 4
+    kTicketCount = 200
+
+    def setUp(self):
+        self.todo = TodoManager()
+        tag = Tag()
+        tag.setName("Tag")
+        (res, self.tag) = self.todo.addTag(tag)
+        self.errorList = []
+
+    def runAndRecordErrors(self, func, *args):
+        # Exceptions of the threads would otherwise only be printed
+        try:
+            func(*args)
+        except Exception, e:
+            self.errorList.append(e)
+
+    def write(self, index):
+        ticket = Ticket()
+        ticket.setDescription("Writer %d" % index)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setStatus(TicketStatus.kOpened)
+
+        for i in range(TestThreadSafeTodoManager.kTicketCount):
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            if i % 2 == 0:
+                self.todo.closeTicket(createdTicket)
+            else:
+                self.todo.addTagToTicket(createdTicket, self.tag)
+
+    def read(self):
+        while self.writerDone.is_set() == False:
+            ticketIds = [ticket.getId() for ticket in self.todo.iterOpenedTickets()]
+            if ticketIds != sorted(set(ticketIds)):
+                self.errorList.append(ticketIds)
+            self.todo.getOpenedTicketsCountByTag(self.tag)
+            self.todo.searchTickets("writer")
+
+    def runTest(self):
+        self.todo.enableThreadSafety()
+        self.assertTrue(self.todo.isThreadSafe())
+        self.assertTrue(isinstance(self.todo, ThreadSafeTodoManager))
+
+        self.writerDone = threading.Event()
+        writerList = [threading.Thread(target=self.runAndRecordErrors, args=(self.write, i))
+                      for i in range(TestThreadSafeTodoManager.kWriterCount)]
+        readerList = [threading.Thread(target=self.runAndRecordErrors, args=(self.read,))
+                      for i in range(TestThreadSafeTodoManager.kReaderCount)]
+
+        for thread in writerList + readerList:
+            thread.start()
+        for thread in writerList:
+            thread.join()
+        self.writerDone.set()
+        for thread in readerList:
+            thread.join()
+
+        self.assertEqual(self.errorList, [])
+
+        # No id was given twice and the counters match the store
+        ticketCount = TestThreadSafeTodoManager.kWriterCount * TestThreadSafeTodoManager.kTicketCount
+        self.assertEqual(self.todo.getTicketCount(), ticketCount)
+        self.assertEqual(self.todo.getOpenedTicketsCount(), ticketCount / 2)
+        self.assertEqual(self.todo.getOpenedTicketsCountByTag(self.tag), ticketCount / 2)
+        self.assertEqual(self.todo.getOpenedTickets().getTicketCount(), ticketCount / 2)
+        self.assertEqual(len(self.todo.getChangeList()), 1 + ticketCount * 2)
+        self.assertEqual(self.todo.searchTickets("writer 0").getTicketCount(), TestThreadSafeTodoManager.kTicketCount)
+
+        # The mode is kept through pickling
+        todo = pickle.loads(pickle.dumps(self.todo))
+        self.assertTrue(todo.isThreadSafe())
+        self.assertEqual(todo.getOpenedTicketsCount(), ticketCount / 2)
+        self.assertFalse(TodoManager().isThreadSafe())
+
+# TodoManager pickled by the first release, "Tag 2" has been removed but is still on ticket 1
+LEGACY_PICKLE = (
+    "(ilibtodomanager.todomanager\nTodoManager\np0\n(dp1\nS'serializer'\np2\nNsS'ticketLastId'\np3\n"
+    "I2\nsS'tagLastId'\np4\nI2\nsS'ticketList'\np5\n(lp6\n(ilibtodomanager.todomanager\nTicket\np7\n"
+    "(dp8\nS'priority'\np9\nI1\nsS'status'\np10\nI1\nsS'description'\np11\nS'Ticket 1'\np12\nsS'id'\n"
+    "p13\nI1\nsS'tagList'\np14\n(lp15\n(ilibtodomanager.todomanager\nTag\np16\n(dp17\ng13\nI1\nsS'name'\n"
+    "p18\nS'Tag 1'\np19\nsba(ilibtodomanager.todomanager\nTag\np20\n(dp21\ng13\nI2\nsg18\nS'Tag 2'\n"
+    "p22\nsbasba(ilibtodomanager.todomanager\nTicket\np23\n(dp24\ng9\nI1\nsg10\nI2\nsg11\nS'Ticket 2'\n"
+    "p25\nsg13\nI2\nsg14\n(lp26\n(ilibtodomanager.todomanager\nTag\np27\n(dp28\ng13\nI1\nsg18\ng19\n"
+    "sbasbasg14\n(lp29\n(ilibtodomanager.todomanager\nTag\np30\n(dp31\ng13\nI1\nsg18\ng19\nsbasb."
+)
+
+class TestLazyTodoManager(unittest.TestCase):
+    def setUp(self):
+        self.backgroundStarted = threading.Event()
+        self.backgroundDone    = threading.Event()
+        self.eventList = []
+
+    def loadInBackground(self):
+        self.backgroundStarted.set()
+        self.backgroundDone.wait()
+        self.eventList.append("background")
+
+    def load(self):
+        self.eventList.append("load")
+        return TodoManager()
+
+    def runTest(self):
+        lazyTodo = LazyTodoManager(self.load, self.loadInBackground)
+        self.backgroundStarted.wait()
+        self.assertFalse(lazyTodo.isLoaded())
+        self.assertEqual(self.eventList, [])
+
+        # The background part is not interrupted by the exit
+        self.assertFalse(lazyTodo.loaderThread.daemon)
+
+        # The first use waits for the background part
+        self.backgroundDone.set()
+        self.assertEqual(lazyTodo.getTicketCount(), 0)
+        self.assertEqual(self.eventList, ["background", "load"])
+
+        todo = lazyTodo.getTodoManager()
+        self.assertTrue(lazyTodo.isLoaded())
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("Ticket 1")
+        self.assertEqual(lazyTodo.addTicket(ticket)[0], ErrorCode.kOk)
+        self.assertEqual(todo.getTicketCount(), 1)
+        self.assertEqual(self.eventList, ["background", "load"])
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = Stats()
+
+    def runTest(self):
+        # Nothing is recorded while disabled
+        self.stats.stop("phase", self.stats.start())
+        self.stats.addCount("counter")
+        self.assertEqual(self.stats.toDict(), {"enabled": False, "phases": {}, "counters": {}})
+
+        self.stats.enable()
+        self.stats.stop("phase", self.stats.start())
+        self.stats.addCount("counter", 3)
+        self.stats.addCount("counter")
+        self.assertEqual(self.stats.getHistogram("phase").count, 1)
+        self.assertEqual(self.stats.getCount("counter"), 4)
+
+        content = json.loads(self.stats.toJson())
+        self.assertEqual(content["phases"]["phase"]["count"], 1)
+        self.assertEqual(content["counters"], {"counter": 4})
+        self.assertTrue("phase" in self.stats.toString())
+
+        self.stats.reset()
+        self.assertEqual(self.stats.getHistogram("phase"), None)
+        self.assertEqual(self.stats.getCount("counter"), 0)
+
+        # Percentiles are the upper bound of their bucket
+        histogram = Histogram()
+        for duration in [0.000003] * 90 + [0.001] * 10:
+            histogram.add(duration)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.getPercentile(0.5), 0.000004)
+        self.assertEqual(histogram.getPercentile(0.9), 0.000004)
+        self.assertEqual(histogram.getPercentile(0.99), 0.001)
+        self.assertEqual(histogram.toDict()["buckets"][2], 90)
+        self.assertEqual(Histogram().getPercentile(0.5), None)
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+
+        tagList = []
+        for tagName in ["A", "B", "C"]:
+            tag = Tag()
+            tag.setName(tagName)
+            (res, createdTag) = self.todo.addTag(tag)
+            tagList.append(createdTag)
+
+        statusList   = [TicketStatus.kOpened, TicketStatus.kDelayed, TicketStatus.kClosed]
+        priorityList = [TicketPriority.kHigh, TicketPriority.kNormal, TicketPriority.kLow, TicketPriority.kNormal]
+        wordList     = ["crash", "build", "crash build", "manual"]
+        for i in range(60):
+            ticket = Ticket()
+            ticket.setStatus(statusList[i % 3])
+            ticket.setPriority(priorityList[i % 4])
+            ticket.setDescription("%s %d" % (wordList[i % 4], i + 1))
+            for (j, tag) in enumerate(tagList):
+                if i % (j + 2) == 0:
+                    ticket.addTag(tag)
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            self.assertEqual(res, ErrorCode.kOk)
+
+        self.ticketList = self.todo.getTicketsFromIds(range(1, 61)).getContent()
+
+    def findIds(self, text):
+        term = parseQuery(self.todo, text)
+
+        # The planner finds the same tickets as a check of each of them
+        ticketIds = QueryPlanner(self.todo).findTicketIds(term)
+        self.assertEqual(ticketIds, [ticket.getId() for ticket in self.ticketList if term.matches(ticket)])
+        return ticketIds
+
+    def runTest(self):
+        self.assertEqual(self.findIds("status:opened,delayed priority:high tag:A -tag:B"), [5, 17, 29, 41, 53])
+        self.assertEqual(len(self.findIds("status:delayed")), 20)
+        self.assertEqual(len(self.findIds("not status:closed")), 40)
+        self.assertEqual(self.findIds("tag:A tag:C"), range(1, 61, 4))
+        self.assertEqual(self.findIds("tag:B,C"), self.findIds("tag:B or tag:C"))
+        self.assertEqual(self.findIds("crash -build"), range(1, 61, 4))
+        self.assertEqual(len(self.findIds('text:"crash build" priority:low')), 15)
+        self.assertEqual(self.findIds("(priority:high or tag:C) and status:delayed"), [5, 17, 29, 41, 53])
+        self.assertEqual(self.findIds("NOT priority:normal -status:opened"), sorted(range(3, 61, 6) + range(5, 61, 6)))
+        self.assertEqual(self.findIds("status:opened status:closed"), [])
+        self.assertEqual(self.findIds("missing"), [])
+        self.assertEqual(len(self.findIds("-(tag:A or tag:B)")), 20)
+
+        # Negated statuses are looked up by the store, the most selective tag
+        # is given to the scan and the other one checked
+        planner = QueryPlanner(self.todo)
+        planner.findTicketIds(parseQuery(self.todo, "-status:closed tag:A tag:C"))
+        stepList = planner.getStepList()
+        self.assertTrue(stepList[0].startswith('find scan status:opened,delayed tag:"C"'), stepList)
+        self.assertEqual(len(stepList), 2)
+
+        for (text, message) in [("", "Empty query"), ("status:bogus", "Unknown status 'bogus'"),
+                                ("tag:D", "Unknown tag 'D'"), ("color:red", "Unknown field 'color'"),
+                                ("(tag:A", "Missing ')'"), ("tag:A )", "Unexpected ')'"), ("tag:A or", "Unexpected end of query"),
+                                ("priority:", "Missing value of 'priority'")]:
+            try:
+                parseQuery(self.todo, text)
+                self.fail("'%s' was parsed" % text)
+            except QueryError, e:
+                self.assertEqual(str(e), message)
+
+        textIndex = self.todo.getTextIndex()
+        self.assertEqual(textIndex.findDocumentIds("Build crash"), set(range(3, 61, 4)))
+        self.assertEqual(textIndex.getMatchCountBound("build manual"), 15)
+        self.assertEqual(textIndex.getMatchCountBound(""), 0)
+
+class TestLegacyPickle(unittest.TestCase):
+    def runTest(self):
+        todo = pickle.loads(LEGACY_PICKLE)
+
+        self.assertEqual(todo.getTagCount(), 1)
+        self.assertEqual(todo.getTicketCount(), 2)
+        self.assertEqual(todo.getOpenedTicketsCount(), 1)
+
+        tag1 = todo.getTagByName("Tag 1")
+        self.assertEqual(todo.getOpenedTicketsByTag(tag1).getTicketCount(), 1)
+
+        ticket = todo.getTicketById(1)
+        self.assertEqual(ticket.getDescription(), "Ticket 1")
+        self.assertEqual(ticket.getPriority(), TicketPriority.kHigh)
+        self.assertEqual([tag.getName() for tag in ticket.getTagList()], ["Tag 1", "Tag 2"])
+
+        ticket = todo.getTicketById(2)
+        self.assertEqual(ticket.getStatus(), TicketStatus.kClosed)
+        self.assertEqual([tag.getName() for tag in ticket.getTagList()], ["Tag 1"])
+
+        # The upgraded content can be pickled again
+        todo = pickle.loads(pickle.dumps(todo))
+        self.assertEqual([tag.getName() for tag in todo.getTicketById(1).getTagList()], ["Tag 1", "Tag 2"])
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,644 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import unittest
+import tempfile
+import shutil
+import os
+import pickle
+import multiprocessing
+from libtodomanager.todomanager import *
+from libtodomanager.persistency.pickleserializer import *
+from libtodomanager.persistency.journalserializer import *
+from libtodomanager.persistency.sqliteserializer import *
+from libtodomanager.persistency.mmapserializer import *
+from libtodomanager.persistency.segmentserializer import *
+
+def fillTodoManager(todo, ticketCount):
+    tag = Tag()
+    tag.setName("Tag 1")
+    (res, createdTag) = todo.addTag(tag)
+
+    for i in range(ticketCount):
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("Ticket %d" % (i + 1))
+        (res, createdTicket) = todo.addTicket(ticket)
+        if i % 2 == 0:
+            todo.addTagToTicket(createdTicket, createdTag)
+
+    return createdTag
+
+def dumpTodoManager(todo):
+    tagList = [(tag.getId(), tag.getName()) for tag in todo.getTagList()]
+
+    ticketList = []
+    for ticketId in range(1, todo.ticketLastId + 1):
+        ticket = todo.getTicketById(ticketId)
+        if ticket != None:
+            ticketList.append((ticket.getId(), ticket.getDescription(), ticket.getPriority(), ticket.getStatus(),
+                               [tag.getId() for tag in ticket.getTagList()]))
+
+    return (tagList, ticketList, todo.tagLastId, todo.ticketLastId)
+
+class TestJournalSerializer(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        serializer = JournalSerializer(self.filePath)
+        (res, todo) = serializer.load()
+        self.assertEqual(res, ErrorCode.kFailToOpenFile)
+
+        tag = fillTodoManager(todo, 100)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertFalse(os.path.exists(self.filePath))
+
+        # A single mutation only appends a small record
+        journalSize = os.path.getsize(serializer.journalPath)
+        self.assertEqual(todo.closeTicket(todo.getTicketById(1)), ErrorCode.kOk)
+        self.assertEqual(todo.removeTicket(todo.getTicketById(2)), ErrorCode.kOk)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertTrue(os.path.getsize(serializer.journalPath) - journalSize < 200)
+
+        (res, loadedTodo) = JournalSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+
+        # Replaying the journal over a snapshot which already has its changes
+        PickleSerializer(self.filePath).save(todo)
+        (res, loadedTodo) = JournalSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+
+        # A truncated record is dropped
+        journalFile = open(serializer.journalPath, 'ab')
+        journalFile.write("\x80\x02(K")
+        journalFile.close()
+        (res, loadedTodo) = JournalSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+
+def addTicketsInProcess(serializerClass, filePath, ticketCount, name):
+    # Loaded once, every save has to merge the saves of the other processes
+    (res, todo) = serializerClass(filePath).load()
+    for i in range(ticketCount):
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("%s %d" % (name, i))
+        todo.addTicket(ticket)
+        todo.save()
+
+class TestConcurrentSave(unittest.TestCase):
+    kProcessCount = 4
+    kTicketCount  = 25
+
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def checkSerializer(self, serializerClass):
+        # Two shells working on the same file
+        (res, todo) = serializerClass(self.filePath).load()
+        tag = fillTodoManager(todo, 4)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+
+        (res, todo1) = serializerClass(self.filePath).load()
+        (res, todo2) = serializerClass(self.filePath).load()
+
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("From shell 1")
+        todo1.addTicket(ticket)
+        todo1.removeTicket(todo1.getTicketById(4))
+        self.assertEqual(todo1.save(), ErrorCode.kOk)
+
+        ticket.setDescription("From shell 2")
+        tag2 = Tag()
+        tag2.setName("Tag 2")
+        (res, tag2) = todo2.addTag(tag2)
+        (res, createdTicket) = todo2.addTicket(ticket)
+        todo2.addTagToTicket(createdTicket, tag2)
+        todo2.closeTicket(todo2.getTicketById(1))
+        todo2.addTagToTicket(todo2.getTicketById(4), tag2)
+        self.assertEqual(todo2.save(), ErrorCode.kOk)
+
+        # The ticket of the second shell got the next id, the tag added to the
+        # ticket removed by the first shell was dropped
+        self.assertEqual(todo2.getTicketById(5).getDescription(), "From shell 1")
+        self.assertEqual(todo2.getTicketById(6).getDescription(), "From shell 2")
+        self.assertEqual([tag.getName() for tag in todo2.getTicketById(6).getTagList()], ["Tag 2"])
+        self.assertEqual(todo2.getTicketById(4), None)
+        self.assertEqual(todo2.getTicketById(1).getStatus(), TicketStatus.kClosed)
+        self.assertFalse(todo2.isDirty())
+
+        (res, loadedTodo) = serializerClass(self.filePath).load()
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo2))
+
+        # The first shell catches up on its next save
+        todo1.closeTicket(todo1.getTicketById(2))
+        self.assertEqual(todo1.save(), ErrorCode.kOk)
+        (res, loadedTodo) = serializerClass(self.filePath).load()
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo1))
+        self.assertEqual(loadedTodo.getOpenedTicketsCount(), 3)
+
+    def checkProcesses(self, serializerClass):
+        processList = [multiprocessing.Process(target=addTicketsInProcess,
+                                               args=(serializerClass, self.filePath, TestConcurrentSave.kTicketCount, "P%d" % i))
+                       for i in range(TestConcurrentSave.kProcessCount)]
+        for process in processList:
+            process.start()
+        for process in processList:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        (res, todo) = serializerClass(self.filePath).load()
+        ticketCount = TestConcurrentSave.kProcessCount * TestConcurrentSave.kTicketCount
+        self.assertEqual(todo.getTicketCount(), ticketCount)
+        self.assertEqual(todo.ticketLastId, ticketCount)
+        self.assertEqual(sorted([ticket.getDescription() for ticket in todo.getOpenedTickets().getContent()]),
+                         sorted(["P%d %d" % (i, j) for i in range(TestConcurrentSave.kProcessCount)
+                                 for j in range(TestConcurrentSave.kTicketCount)]))
+
+    def runTest(self):
+        self.checkSerializer(PickleSerializer)
+        os.remove(self.filePath)
+        self.checkSerializer(JournalSerializer)
+        os.remove("%s.journal" % self.filePath)
+
+        self.checkProcesses(PickleSerializer)
+        os.remove(self.filePath)
+        self.checkProcesses(JournalSerializer)
+
+        # Files written before the version was stored are still read
+        todo = TodoManager()
+        fillTodoManager(todo, 3)
+        legacyFile = open(self.filePath, 'wb')
+        pickle.dump(todo, legacyFile)
+        legacyFile.close()
+        (res, loadedTodo) = PickleSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+        self.assertEqual(loadedTodo.save(), ErrorCode.kOk)
+
+class TestJournalStaleLoadError(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        (res, todo) = JournalSerializer(self.filePath).load()
+        fillTodoManager(todo, 4)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+
+        (res, todo1) = JournalSerializer(self.filePath).load()
+        serializer2 = JournalSerializer(self.filePath)
+        (res, todo2) = serializer2.load()
+
+        todo1.closeTicket(todo1.getTicketById(1))
+        self.assertEqual(todo1.save(), ErrorCode.kOk)
+
+        # The content saved by the first shell cannot be read back, the save
+        # of the second one is refused instead of replacing it
+        serializer2.fileLock.acquireShared = lambda: ErrorCode.kFailToOpenFile
+        todo2.closeTicket(todo2.getTicketById(2))
+        self.assertEqual(todo2.save(), ErrorCode.kFailToOpenFile)
+        self.assertTrue(todo2.isDirty())
+
+        (res, loadedTodo) = JournalSerializer(self.filePath).load()
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo1))
+        self.assertEqual(loadedTodo.getTicketCount(), 4)
+
+class TestJournalCompaction(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        serializer = JournalSerializer(self.filePath, maxJournalSize=1024)
+        (res, todo) = serializer.load()
+
+        fillTodoManager(todo, 100)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertTrue(os.path.exists(self.filePath))
+        self.assertFalse(os.path.exists(serializer.journalPath))
+
+        self.assertEqual(todo.closeTicket(todo.getTicketById(3)), ErrorCode.kOk)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertTrue(os.path.exists(serializer.journalPath))
+
+        (res, loadedTodo) = JournalSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+
+class TestSegmentSerializer(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        serializer = SegmentSerializer(self.filePath, segmentSize=10)
+        (res, todo) = serializer.load()
+        self.assertEqual(res, ErrorCode.kFailToOpenFile)
+
+        tag = fillTodoManager(todo, 95)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertEqual(len(os.listdir(self.tmpDir)), 11)
+
+        # Only the segment of the closed ticket is written, a missing segment stays missing
+        os.remove(serializer.getSegmentPath(5))
+        self.assertEqual(todo.closeTicket(todo.getTicketById(15)), ErrorCode.kOk)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertFalse(os.path.exists(serializer.getSegmentPath(5)))
+
+        (res, loadedTodo) = SegmentSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(loadedTodo.getTicketById(15).getStatus(), TicketStatus.kClosed)
+        self.assertEqual(loadedTodo.getTicketById(55), None)
+        self.assertEqual(loadedTodo.getTicketCount(), 85)
+
+        serializer.saveSegment(todo, 5)
+        for ticketId in range(1, 11):
+            self.assertEqual(todo.removeTicket(todo.getTicketById(ticketId)), ErrorCode.kOk)
+        self.assertEqual(todo.addTagToTicket(todo.getTicketById(94), tag), ErrorCode.kOk)
+        fillTodoManager(todo, 10)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertFalse(os.path.exists(serializer.getSegmentPath(0)))
+
+        (res, loadedTodo) = SegmentSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+        self.assertEqual(loadedTodo.getOpenedTicketsCountByTag(tag), todo.getOpenedTicketsCountByTag(tag))
+
+        # Segments loaded by several processes give the same content as a serial load
+        (res, serialTodo) = SegmentSerializer(self.filePath, processCount=1).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        (res, parallelTodo) = SegmentSerializer(self.filePath, processCount=3).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(parallelTodo), dumpTodoManager(serialTodo))
+        self.assertEqual(pickle.dumps(parallelTodo.ticketStore.getTicketList()),
+                         pickle.dumps(serialTodo.ticketStore.getTicketList()))
+
+        # A save stopped before the manifest, the written ids are not given again
+        ticketLastId = todo.ticketLastId
+        fillTodoManager(todo, 3)
+        self.assertEqual(serializer.saveSegment(todo, serializer.getSegment(todo.ticketLastId)), ErrorCode.kOk)
+        for processCount in [1, 3]:
+            (res, loadedTodo) = SegmentSerializer(self.filePath, processCount=processCount).load()
+            self.assertEqual(res, ErrorCode.kOk)
+            self.assertEqual(loadedTodo.ticketLastId, ticketLastId + 3)
+            self.assertEqual(loadedTodo.tagLastId, todo.tagLastId)
+
+class TestSqliteSerializer(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        serializer = SqliteSerializer(self.filePath)
+        (res, todo) = serializer.load()
+        self.assertEqual(res, ErrorCode.kFailToOpenFile)
+
+        tag = fillTodoManager(todo, 100)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertEqual(todo.closeTicket(todo.getTicketById(1)), ErrorCode.kOk)
+        self.assertEqual(todo.removeTicket(todo.getTicketById(2)), ErrorCode.kOk)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+
+        self.assertEqual(todo.getOpenedTicketsCount(), 98)
+        self.assertEqual(todo.getOpenedTicketsCountByTag(tag), 49)
+        self.assertEqual(todo.getOpenedTicketsByTag(tag).getTicketCount(), 49)
+        self.assertEqual(todo.getOpenedTicketsByPriority(TicketPriority.kNormal).getTicketCount(), 98)
+
+        page = todo.getOpenedTicketsPage(10, 20).getContent()
+        self.assertEqual([ticket.getId() for ticket in page], range(21, 31))
+        self.assertEqual(todo.getOpenedTicketsPage(0).getContent(), [])
+        self.assertEqual(todo.getOpenedTicketsPage(-1).getContent(), [])
+        self.assertEqual(len(list(todo.iterOpenedTicketsByTag(tag))), 49)
+
+        loadedSerializer = SqliteSerializer(self.filePath)
+        (res, loadedTodo) = loadedSerializer.load()
+        self.assertEqual(res, ErrorCode.kOk)
+
+        # No ticket is read until it is needed
+        self.assertEqual(len(loadedTodo.ticketStore.ticketCache), 0)
+        self.assertEqual(loadedTodo.getTicketById(3).getTagList()[0].getName(), "Tag 1")
+        self.assertEqual(len(loadedTodo.ticketStore.ticketCache), 1)
+
+        # The text index reads the descriptions without loading the tickets
+        self.assertEqual([ticket.getId() for ticket in loadedTodo.searchTickets("ticket 42").getContent()], [42])
+        self.assertEqual(len(loadedTodo.ticketStore.ticketCache), 2)
+
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+        self.assertEqual(loadedTodo.getOpenedTicketsCountByTag(tag), 49)
+        self.assertEqual(loadedTodo.getTicketCount(), 99)
+
+        # Bulk changes are written with the store
+        self.assertEqual(loadedTodo.closeTickets([3, 4, 2]), [ErrorCode.kOk, ErrorCode.kOk, ErrorCode.kTicketNotFound])
+        self.assertEqual(loadedTodo.addTagToTickets([5, 6, 3], tag), [ErrorCode.kTicketAlreadyHasTag, ErrorCode.kOk,
+                                                                      ErrorCode.kTicketClosed])
+        resList = loadedTodo.addTickets([ticket for ticket in todo.getOpenedTicketsPage(3).getContent()])
+        self.assertEqual([createdTicket.getId() for (res, createdTicket) in resList], [101, 102, 103])
+        self.assertEqual(loadedTodo.save(), ErrorCode.kOk)
+
+        (res, reloadedTodo) = SqliteSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(reloadedTodo), dumpTodoManager(loadedTodo))
+        self.assertEqual(reloadedTodo.getOpenedTicketsCountByTag(tag), 51)
+        self.assertEqual(reloadedTodo.getOpenedTicketsCount(), 99)
+
+        serializer.close()
+        loadedSerializer.close()
+
+class TestSqliteConcurrentWriters(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def createTag(self, name):
+        tag = Tag()
+        tag.setName(name)
+        return tag
+
+    def createTicket(self, description):
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription(description)
+        return ticket
+
+    def runTest(self):
+        serializer1 = SqliteSerializer(self.filePath)
+        serializer2 = SqliteSerializer(self.filePath)
+        (res, todo1) = serializer1.load()
+        (res, todo2) = serializer2.load()
+
+        # Ids are allocated after the ones saved by the other process
+        (res, tag1) = todo1.addTag(self.createTag("Tag 1"))
+        self.assertEqual(todo1.save(), ErrorCode.kOk)
+        (res, tag2) = todo2.addTag(self.createTag("Tag 2"))
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(tag2.getId(), 2)
+        self.assertEqual(todo2.save(), ErrorCode.kOk)
+
+        # A stale content is read again before a change, a change which fails
+        # does not keep the lock
+        self.assertEqual(todo2.addTag(self.createTag("Tag 1")), (ErrorCode.kTagAlreadyExist, None))
+        self.assertEqual(todo2.getTagCount(), 2)
+        self.assertFalse(serializer2.inTransaction)
+
+        (res, ticket1) = todo1.addTicket(self.createTicket("Ticket 1"))
+        self.assertEqual(todo1.save(), ErrorCode.kOk)
+        (res, ticket2) = todo2.addTicket(self.createTicket("Ticket 2"))
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(ticket2.getId(), 2)
+        self.assertEqual(todo2.getOpenedTicketsCount(), 2)
+
+        # The lock is held from the first change to the save
+        serializer1.connection.execute("PRAGMA busy_timeout = 10")
+        self.assertEqual(todo1.addTicket(self.createTicket("Ticket 3")), (ErrorCode.kWriteConflict, None))
+        self.assertEqual(todo2.save(), ErrorCode.kOk)
+
+        # An id which is already taken is refused, not replaced
+        ticket = self.createTicket("Ticket 1 again")
+        ticket.setId(1)
+        self.assertEqual(todo1.beginChange(), ErrorCode.kOk)
+        self.assertEqual(todo1.insertTicket(ticket), ErrorCode.kWriteConflict)
+        self.assertEqual(todo1.getTicketCount(), 2)
+        self.assertEqual(todo1.closeTicket(todo1.getTicketById(2)), ErrorCode.kOk)
+        self.assertEqual(todo1.getTagCount(), 2)
+        self.assertEqual(todo1.save(), ErrorCode.kOk)
+
+        (res, loadedTodo) = SqliteSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual([(tag.getId(), tag.getName()) for tag in loadedTodo.getTagList()], [(1, "Tag 1"), (2, "Tag 2")])
+        self.assertEqual([loadedTodo.getTicketById(ticketId).getDescription() for ticketId in [1, 2]], ["Ticket 1", "Ticket 2"])
+        self.assertEqual((loadedTodo.tagLastId, loadedTodo.ticketLastId), (2, 2))
+        self.assertEqual(loadedTodo.getOpenedTicketsCount(), 1)
+
+        serializer1.close()
+        serializer2.close()
+
+class TestViewSnapshotAfterFlush(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+        SqliteTicketStore.kMaxCachedTickets = 10000
+        MmapTicketStore.kMaxCachedTickets   = 10000
+
+    def runTest(self):
+        # Every ticket read flushes the cache, a view never shares its ticket
+        # with the store
+        SqliteTicketStore.kMaxCachedTickets = 1
+        MmapTicketStore.kMaxCachedTickets   = 1
+
+        for serializer in [SqliteSerializer(os.path.join(self.tmpDir, "todolist.db")),
+                           MmapSerializer(os.path.join(self.tmpDir, "todolist.mmap"))]:
+            (res, todo) = serializer.load()
+            fillTodoManager(todo, 4)
+            self.assertEqual(todo.save(), ErrorCode.kOk)
+
+            view = todo.getTicketById(1)
+            todo.getTicketById(2)
+            self.assertEqual(todo.closeTicket(view), ErrorCode.kOk)
+            self.assertEqual(view.getStatus(), TicketStatus.kOpened)
+            self.assertEqual(todo.getTicketById(1).getStatus(), TicketStatus.kClosed)
+
+            view = todo.getTicketById(2)
+            self.assertEqual(todo.addTagToTicket(view, todo.getTagByName("Tag 1")), ErrorCode.kOk)
+            self.assertEqual(view.getTagIdList(), ())
+            self.assertEqual([tag.getName() for tag in todo.getTicketById(2).getTagList()], ["Tag 1"])
+            self.assertEqual(todo.save(), ErrorCode.kOk)
+
+class TestSqliteImport(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        todo = TodoManager()
+        tag = fillTodoManager(todo, 10)
+        self.assertEqual(todo.removeTag(tag), ErrorCode.kOk)
+
+        serializer = SqliteSerializer(self.filePath)
+        self.assertEqual(serializer.importTodoManager(todo), ErrorCode.kOk)
+
+        (res, loadedTodo) = serializer.load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+
+        serializer.close()
+
+class TestMmapSerializer(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.mmap")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        serializer = MmapSerializer(self.filePath)
+        (res, todo) = serializer.load()
+        self.assertEqual(res, ErrorCode.kFailToOpenFile)
+
+        tag = fillTodoManager(todo, 100)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertEqual(todo.removeTicket(todo.getTicketById(2)), ErrorCode.kOk)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+
+        # Status updates are written in place, the files keep their size
+        fileSizes = (os.path.getsize(self.filePath), os.path.getsize(serializer.heapPath))
+        self.assertEqual(todo.closeTicket(todo.getTicketById(1)), ErrorCode.kOk)
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+        self.assertEqual((os.path.getsize(self.filePath), os.path.getsize(serializer.heapPath)), fileSizes)
+
+        # Changes to saved tickets are not in the files before the save either
+        self.assertEqual(todo.addTagToTicket(todo.getTicketById(4), tag), ErrorCode.kOk)
+        self.assertEqual(todo.closeTicket(todo.getTicketById(5)), ErrorCode.kOk)
+        self.assertEqual(todo.removeTicket(todo.getTicketById(6)), ErrorCode.kOk)
+        self.assertEqual(todo.getOpenedTicketsCount(), 96)
+        self.assertEqual(todo.getOpenedTicketsCountByTag(tag), 49)
+
+        otherSerializer = MmapSerializer(self.filePath)
+        (res, otherTodo) = otherSerializer.load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(otherTodo.getTicketById(4).getTagIdList(), ())
+        self.assertEqual(otherTodo.getTicketById(5).getStatus(), TicketStatus.kOpened)
+        self.assertNotEqual(otherTodo.getTicketById(6), None)
+        otherSerializer.close()
+
+        self.assertEqual(todo.save(), ErrorCode.kOk)
+
+        loadedSerializer = MmapSerializer(self.filePath)
+        (res, loadedTodo) = loadedSerializer.load()
+        self.assertEqual(res, ErrorCode.kOk)
+
+        # No ticket is decoded until it is needed
+        self.assertEqual(len(loadedTodo.ticketStore.ticketCache), 0)
+        self.assertEqual(loadedTodo.getTicketById(4).getTagList()[0].getName(), "Tag 1")
+        self.assertEqual(len(loadedTodo.ticketStore.ticketCache), 1)
+
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+        self.assertEqual(loadedTodo.getOpenedTicketsCount(), 96)
+        self.assertEqual(loadedTodo.getOpenedTicketsCountByTag(tag), 49)
+        self.assertEqual([ticket.getId() for ticket in loadedTodo.getOpenedTicketsPage(3, 2).getContent()], [3, 4, 7])
+        self.assertEqual(loadedTodo.getOpenedTicketsPage(0).getContent(), [])
+        self.assertEqual(loadedTodo.getOpenedTicketsPage(-1).getContent(), [])
+        self.assertEqual([ticket.getId() for ticket in loadedTodo.searchTickets("ticket 42").getContent()], [42])
+
+        # Tickets added without a save are not referenced by the header
+        ticket = Ticket()
+        ticket.setStatus(TicketStatus.kOpened)
+        ticket.setPriority(TicketPriority.kNormal)
+        ticket.setDescription("Not saved")
+        (res, createdTicket) = loadedTodo.addTicket(ticket)
+        self.assertEqual(res, ErrorCode.kOk)
+
+        (res, reloadedTodo) = MmapSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(reloadedTodo), dumpTodoManager(todo))
+
+        self.assertEqual(loadedTodo.save(), ErrorCode.kOk)
+        (res, reloadedTodo) = MmapSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(reloadedTodo.getTicketById(createdTicket.getId()).getDescription(), "Not saved")
+
+        # The files grow geometrically, the mappings are not rebuilt on each insert
+        ticketStore = loadedTodo.ticketStore
+        remapList = []
+        ticketStore.remap = lambda remap=ticketStore.remap: (remapList.append(1), remap())
+        for i in range(1000):
+            (res, createdTicket) = loadedTodo.addTicket(ticket)
+            self.assertEqual(res, ErrorCode.kOk)
+        self.assertTrue(len(remapList) < 20)
+        self.assertEqual(loadedTodo.save(), ErrorCode.kOk)
+
+        # Files written before the heap size was kept use their whole heap
+        (res, reloadedTodo) = MmapSerializer(self.filePath).load()
+        expectedDump = dumpTodoManager(reloadedTodo)
+        recordFile = open(self.filePath, 'r+b')
+        recordFile.seek(56)
+        recordFile.write("\0" * 8)
+        recordFile.close()
+        (res, reloadedTodo) = MmapSerializer(self.filePath).load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(reloadedTodo), expectedDump)
+        self.assertEqual(reloadedTodo.getTicketCount(), 1099)
+
+        serializer.close()
+        loadedSerializer.close()
+
+class TestMmapImport(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir   = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tmpDir, "todolist.mmap")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        todo = TodoManager()
+        tag = fillTodoManager(todo, 10)
+        self.assertEqual(todo.removeTag(tag), ErrorCode.kOk)
+
+        serializer = MmapSerializer(self.filePath)
+        self.assertEqual(serializer.importTodoManager(todo), ErrorCode.kOk)
+
+        (res, loadedTodo) = serializer.load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(dumpTodoManager(loadedTodo), dumpTodoManager(todo))
+        self.assertEqual(loadedTodo.getTicketById(1).getTagList()[0].getName(), "Tag 1")
+
+        serializer.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,4 @@
+export PYTHONPATH=$PYTHONPATH:..:.
+
+echo "Run benchmarks of libtodomanager and todomanagercli"
+./benchmark/todomanagerbenchmark.py "$@"
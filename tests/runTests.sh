@@ -3,6 +3,12 @@ export PYTHONPATH=$PYTHONPATH:..:.
 echo "Run tests of libtodomanager"
 ./libtodomanager/libtodomanagertest.py
 
+echo "Run tests of libtodomanager persistency"
+./libtodomanager/persistencytest.py
+
+echo "Run tests of libtodomanager HTTP server"
+./libtodomanager/httpservertest.py
+
 echo "Run tests of todomanagercli"
 ./todomanagercli/todomanagerclitest.py
 
@@ -20,9 +20,34 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import unittest
+import asyncore
+import signal
+import socket
+import subprocess
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+import StringIO
+import json
 from libtodomanager.todomanager import *
+from libtodomanager.persistency.pickleserializer import *
+from libtodomanager.persistency.sqliteserializer import *
 from todomanagercli.commands import *
 from todomanagercli.shell import *
+from todomanagercli.client import *
+from todomanagercli.daemon import *
+from libtodomanager.lazytodomanager import *
+
+class CountingSerializer:
+    def __init__(self):
+        self.saveCount = 0
+
+    def save(self, todo):
+        self.saveCount = self.saveCount + 1
+        return ErrorCode.kOk
 
 class TestPrintTagList(unittest.TestCase):
     def setUp(self):
@@ -78,6 +103,51 @@ class TestPrintOpenedTicketList(unittest.TestCase):
         res = self.cmd.runCommand(self.todo, cmdParamCount, cmdParam)
         self.assertEqual(res, CommandError.kOk)
 
+class TestPrintOpenedTicketPage(unittest.TestCase):
+    def setUp(self):
+        self.todo  = TodoManager(serializer=CountingSerializer())
+        self.shell = Shell(self.todo)
+        self.shell.register_command_list([CommandPrintOpenedTicketList()])
+
+        for i in range(5):
+            ticket = Ticket()
+            ticket.setDescription("Ticket %d" % (i + 1))
+            ticket.setStatus(TicketStatus.kOpened)
+            ticket.setPriority(TicketPriority.kNormal)
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            self.assertEqual(res, ErrorCode.kOk)
+
+    def runCommandLine(self, line):
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            self.shell.onecmd(line)
+            return sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+
+    def runTest(self):
+        output = self.runCommandLine("printOpenedTicketList")
+        self.assertEqual(output[0], "Opened tickets count : 5")
+        self.assertEqual(len(output), 6)
+
+        output = self.runCommandLine("printOpenedTicketList --limit 2")
+        self.assertEqual(output[1:], ["Id 1 - 'Ticket 1' - Tags : No tag", "Id 2 - 'Ticket 2' - Tags : No tag",
+                                      "Next page : --after 2"])
+
+        output = self.runCommandLine("printOpenedTicketList --after 2 --limit 3")
+        self.assertEqual([line[:4] for line in output[1:]], ["Id 3", "Id 4", "Id 5"])
+
+        output = self.runCommandLine("printOpenedTicketList --after 4")
+        self.assertEqual(output[1:], ["Id 5 - 'Ticket 5' - Tags : No tag"])
+
+        output = self.runCommandLine("printOpenedTicketList --limit")
+        self.assertEqual(output[0], "Missing value for option '--limit'")
+        output = self.runCommandLine("printOpenedTicketList --limit two")
+        self.assertEqual(output[0], "Unable to cast 'two' to integer")
+        output = self.runCommandLine("printOpenedTicketList --first 2")
+        self.assertEqual(output[0], "Unknown option '--first'")
+
 class TestOpenTicket(unittest.TestCase):
     def setUp(self):
         self.todo = TodoManager()
@@ -247,5 +317,500 @@ class TestAddTagToTicket(unittest.TestCase):
         self.assertTrue(ticket.hasTag(self.tag1))
         self.assertTrue(ticket.hasTag(self.tag2))
 
+class TestCompleteTagName(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+        self.cmd  = CommandAddTagToTicket()
+
+        for tagName in ["bug", "build", "feature"]:
+            tag = Tag()
+            tag.setName(tagName)
+            (res, createdTag) = self.todo.addTag(tag)
+            self.assertEqual(res, ErrorCode.kOk)
+
+    def runTest(self):
+        self.assertEqual(self.cmd.completeParameter(self.todo, CommandAddTagToTicket.kTagName, "bu"), ["bug", "build", None])
+        self.assertEqual(self.cmd.completeParameter(self.todo, CommandAddTagToTicket.kTagName, "x"), [None])
+        self.assertEqual(self.cmd.completeParameter(self.todo, CommandAddTagToTicket.kTicketId, "1"), [None])
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.todo  = TodoManager(serializer=CountingSerializer())
+        self.cmd   = CommandSearch()
+        self.shell = Shell(self.todo)
+        self.shell.register_command_list([CommandSearch()])
+
+        for description in ["Fix the crash", "Write the manual", "Fix the crash in the manual", "Crash on start"]:
+            ticket = Ticket()
+            ticket.setDescription(description)
+            ticket.setStatus(TicketStatus.kOpened)
+            ticket.setPriority(TicketPriority.kNormal)
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            self.assertEqual(res, ErrorCode.kOk)
+
+    def runTest(self):
+        cmdParam = HandlerParam()
+        setattr(cmdParam, "query", "crash")
+        cmdParamCount = 1
+
+        res = self.cmd.runCommand(self.todo, cmdParamCount, cmdParam)
+        self.assertEqual(res, CommandError.kOk)
+
+        setattr(cmdParam, "limit", 0)
+        res = self.cmd.runCommand(self.todo, cmdParamCount, cmdParam)
+        self.assertEqual(res, CommandError.kError)
+
+        # The words are one query without quotes, the count is not limited
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            self.shell.onecmd("search crash manual")
+            self.shell.onecmd("search crash --limit 1")
+            output = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual(output[0], "Matching tickets count : 1")
+        self.assertTrue(output[1].startswith("Id 3 - "))
+        self.assertEqual(output[2], "Matching tickets count : 3")
+        self.assertEqual(len(output), 4)
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.todo = TodoManager()
+        self.cmd  = CommandQuery()
+
+        tag = Tag()
+        tag.setName("bug")
+        (res, self.tag) = self.todo.addTag(tag)
+
+        for i in range(5):
+            ticket = Ticket()
+            ticket.setDescription("Ticket %d" % (i + 1))
+            ticket.setStatus(TicketStatus.kOpened if i < 4 else TicketStatus.kDelayed)
+            ticket.setPriority(TicketPriority.kNormal)
+            (res, createdTicket) = self.todo.addTicket(ticket)
+            if i % 2 == 0:
+                self.todo.addTagToTicket(createdTicket, self.tag)
+
+    def runQuery(self, query, limit = None, after = None):
+        cmdParam = HandlerParam()
+        setattr(cmdParam, "query", query)
+        if limit != None:
+            setattr(cmdParam, "limit", limit)
+        if after != None:
+            setattr(cmdParam, "after", after)
+
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            res = self.cmd.runCommand(self.todo, 1, cmdParam)
+            return (res, sys.stdout.getvalue().splitlines())
+        finally:
+            sys.stdout = stdout
+
+    def runTest(self):
+        (res, lineList) = self.runQuery("status:opened,delayed tag:bug -ticket:5", None)
+        self.assertEqual(res, CommandError.kError)
+        self.assertEqual(lineList, ["Invalid query : Unknown field 'ticket'"])
+
+        (res, lineList) = self.runQuery("status:opened,delayed tag:bug", limit=1)
+        self.assertEqual(res, CommandError.kOk)
+        self.assertEqual(lineList, ["Matching tickets count : 3", "Id 1 - Opened - 'Ticket 1' - Tags : bug",
+                                    "Next page : --after 1"])
+
+        (res, lineList) = self.runQuery("status:opened,delayed tag:bug", limit=2, after=1)
+        self.assertEqual(lineList, ["Matching tickets count : 3", "Id 3 - Opened - 'Ticket 3' - Tags : bug",
+                                    "Id 5 - Delayed - 'Ticket 5' - Tags : bug"])
+
+        self.assertEqual(self.runQuery("-tag:bug")[1][0], "Matching tickets count : 2")
+        self.assertEqual(self.runQuery("ticket", limit=0), (CommandError.kError, ["Invalid limit 0"]))
+
+class TestSaveOnlyWhenDirty(unittest.TestCase):
+    def setUp(self):
+        self.serializer = CountingSerializer()
+        self.todo = TodoManager(serializer=self.serializer)
+
+    def runTest(self):
+        cmdParam = HandlerParam()
+
+        CommandPrintTagList().run(self.todo, 0, cmdParam)
+        CommandPrintOpenedTicketList().run(self.todo, 0, cmdParam)
+        self.assertEqual(self.serializer.saveCount, 0)
+
+        setattr(cmdParam, "name", "Tag1")
+        CommandAddTag().run(self.todo, 1, cmdParam)
+        self.assertEqual(self.serializer.saveCount, 1)
+        self.assertFalse(self.todo.isDirty())
+
+        # Failing command does not change anything
+        CommandAddTag().run(self.todo, 1, cmdParam)
+        self.assertEqual(self.serializer.saveCount, 1)
+
+        cmdParam = HandlerParam()
+        setattr(cmdParam, "ticketId", 1)
+        CommandPrintTicket().run(self.todo, 1, cmdParam)
+        self.assertEqual(self.serializer.saveCount, 1)
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.serializer = CountingSerializer()
+        self.todo  = TodoManager(serializer=self.serializer)
+        self.shell = Shell(self.todo)
+        self.shell.register_command_list([CommandAddTag(), CommandOpenTicket(), CommandAddTagToTicket()])
+
+    def runTest(self):
+        self.assertEqual(self.shell.get_registered_command("openTicket").name, "openTicket")
+        self.assertEqual(self.shell.get_registered_command("unknown"), None)
+
+        script = StringIO.StringIO("""# Backlog import
+addTag bug
+
+openTicket "Ticket 1"
+openTicket "Ticket 2"
+addTagToTicket 2 bug
+""")
+
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            res = runBatch(self.shell, self.todo, script)
+        finally:
+            sys.stdout = stdout
+
+        # Blank lines do not repeat the previous command, the content is saved once
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(self.todo.getTicketCount(), 2)
+        self.assertEqual(self.todo.getTicketById(2).getTagList()[0].getName(), "bug")
+        self.assertEqual(self.serializer.saveCount, 1)
+        self.assertFalse(self.todo.isDirty())
+        self.assertFalse(TodoManagerCommand.saveDeferred)
+
+class TestLazyStartup(unittest.TestCase):
+    def setUp(self):
+        self.serializer = CountingSerializer()
+        self.builtList = []
+        self.todo  = LazyTodoManager(self.loadTodoManager)
+        self.shell = Shell(self.todo)
+
+        for (cmdName, cmdClass) in [("addTag", CommandAddTag), ("openTicket", CommandOpenTicket)]:
+            self.shell.register_command_factory(cmdName, self.getFactory(cmdName, cmdClass))
+
+    def getFactory(self, cmdName, cmdClass):
+        def factory():
+            self.builtList.append(cmdName)
+            return cmdClass()
+        return factory
+
+    def loadTodoManager(self):
+        return TodoManager(serializer=self.serializer)
+
+    def runTest(self):
+        # Nothing is built or loaded before it is used
+        self.assertEqual(self.shell.completenames("o"), ["openTicket"])
+        self.assertEqual(self.builtList, [])
+        self.assertFalse(self.todo.isLoaded())
+
+        cmd = self.shell.get_registered_command("openTicket")
+        self.assertEqual(cmd.name, "openTicket")
+        self.assertTrue(self.shell.get_registered_command("openTicket") is cmd)
+        self.assertEqual(self.shell.get_registered_command("unknown"), None)
+        self.assertEqual(self.builtList, ["openTicket"])
+        self.assertFalse(self.todo.isLoaded())
+
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            res = runBatch(self.shell, self.todo, StringIO.StringIO('openTicket "Ticket 1"\n'))
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertTrue(self.todo.isLoaded())
+        self.assertEqual(self.todo.getTodoManager().getTicketCount(), 1)
+        self.assertEqual(self.serializer.saveCount, 1)
+        self.assertEqual(self.builtList, ["openTicket"])
+
+class TestStatsCommand(unittest.TestCase):
+    def setUp(self):
+        self.serializer = CountingSerializer()
+        self.todo  = TodoManager(serializer=self.serializer)
+        self.shell = Shell(self.todo)
+        self.shell.register_command_list([CommandOpenTicket(), CommandStats()])
+
+    def tearDown(self):
+        globalStats.enable(False)
+        globalStats.reset()
+
+    def runCommands(self, lineList):
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            for line in lineList:
+                self.shell.onecmd(line)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def runTest(self):
+        self.runCommands(["stats reset", 'openTicket "Ticket 1"'])
+        self.assertEqual(globalStats.getHistogram("command.openTicket"), None)
+
+        self.runCommands(["stats on", 'openTicket "Ticket 2"', "openTicket", 'openTicket "Ticket 3'])
+        self.assertEqual(globalStats.getHistogram("command.openTicket").count, 1)
+        self.assertEqual(globalStats.getHistogram("save").count, 1)
+        self.assertEqual(globalStats.getHistogram("shell.parse").count, 1)
+        self.assertEqual(globalStats.getCount("shell.invalidCommands"), 2)
+
+        output = self.runCommands(["stats"])
+        self.assertTrue("command.openTicket" in output)
+        self.assertTrue("shell.invalidCommands" in output)
+
+        content = json.loads(self.runCommands(["stats json"]))
+        self.assertEqual(content["phases"]["command.openTicket"]["count"], 1)
+
+        self.assertTrue("Unknown action" in self.runCommands(["stats bogus"]))
+        self.assertEqual(CommandStats().completeParameter(self.todo, CommandStats.kParamAction, "o"), ["on", "off", None])
+
+        self.runCommands(["stats off", 'openTicket "Ticket 4"'])
+        self.assertEqual(globalStats.getHistogram("command.openTicket").count, 1)
+        self.assertEqual(self.todo.getTicketCount(), 3)
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir     = tempfile.mkdtemp()
+        self.socketPath = os.path.join(self.tmpDir, "todolist.sock")
+        self.serializer = CountingSerializer()
+        self.todo  = TodoManager(serializer=self.serializer)
+        self.shell = Shell(self.todo)
+        self.shell.register_command_list([CommandAddTag(), CommandPrintTagList(), CommandOpenTicket()])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        self.assertEqual(runRemoteScript(self.socketPath, "printTagList\n"), None)
+        self.assertFalse(isDaemonRunning(self.socketPath))
+
+        # A socket left by a daemon which was killed is replaced
+        open(self.socketPath, "w").close()
+        socketMap = {}
+        server    = TodoServer(self.socketPath, self.shell, self.todo, socketMap)
+        stopEvent = threading.Event()
+
+        def loop():
+            while stopEvent.is_set() == False:
+                asyncore.loop(timeout=0.05, map=socketMap, count=1)
+
+        thread = threading.Thread(target=loop)
+        thread.start()
+
+        # A client which never finishes its script does not hold the others
+        stalledSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalledSocket.connect(self.socketPath)
+        stalledSocket.sendall("printTag")
+
+        try:
+            self.assertTrue(isDaemonRunning(self.socketPath))
+
+            (res, output) = runRemoteScript(self.socketPath, "addTag bug\nopenTicket \"Ticket 1\"\nunknown\n")
+            self.assertEqual(res, ErrorCode.kOk)
+            self.assertEqual(output, "Tag 'bug' created with Id 1\nTicket 'Ticket 1' created with Id 1\n"
+                                     "*** Unknown syntax: unknown\n")
+            self.assertEqual(self.serializer.saveCount, 1)
+
+            # The content stays in memory between the requests
+            (res, output) = runRemoteScript(self.socketPath, "printTagList\n")
+            self.assertEqual(output, "Tag count : 1\nId 1 : 'bug'\n")
+            self.assertEqual(self.serializer.saveCount, 1)
+            self.assertEqual(self.shell.stdout, sys.stdout)
+        finally:
+            stalledSocket.close()
+            stopEvent.set()
+            thread.join()
+            asyncore.close_all(socketMap)
+
+        self.assertFalse(os.path.exists(self.socketPath))
+
+class CommandFail(TodoManagerCommand):
+    def __init__(self):
+        Command.__init__(self, name="fail")
+
+    def runCommand(self, todo, paramCount, args):
+        raise ValueError("broken")
+
+class TestDaemonCommandError(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir     = tempfile.mkdtemp()
+        self.filePath   = os.path.join(self.tmpDir, "todolist.db")
+        self.serializer = SqliteSerializer(self.filePath)
+        (res, self.todo) = self.serializer.load()
+        self.shell = Shell(self.todo)
+        self.shell.register_command_list([CommandAddTag(), CommandPrintTagList(), CommandFail()])
+        self.server = TodoServer(os.path.join(self.tmpDir, "todolist.sock"), self.shell, self.todo)
+
+    def tearDown(self):
+        self.server.close()
+        self.serializer.close()
+        shutil.rmtree(self.tmpDir)
+
+    def runTest(self):
+        self.assertEqual(self.server.runScript("addTag bug\n"), "1\nTag 'bug' created with Id 1\n")
+
+        # The changes of the script which raised are dropped
+        self.assertEqual(self.server.runScript("addTag lost\nfail\n"),
+                         "2\nTag 'lost' created with Id 2\n*** ValueError: broken\n")
+        self.assertEqual(self.server.runScript("printTagList\n"), "1\nTag count : 1\nId 1 : 'bug'\n")
+        self.assertFalse(self.todo.isDirty())
+        self.assertEqual(sys.stdout, self.shell.stdout)
+
+        self.assertEqual(self.server.runScript("addTag feature\n"), "1\nTag 'feature' created with Id 2\n")
+        (res, loadedTodo) = SqliteSerializer(self.filePath).load()
+        self.assertEqual([tag.getName() for tag in loadedTodo.getTagList()], ["bug", "feature"])
+
+class TestEntryPoint(unittest.TestCase):
+    kRootPath = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+        todo = TodoManager()
+        tag = Tag()
+        tag.setName("bug")
+        (res, createdTag) = todo.addTag(tag)
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual(PickleSerializer(self.getPath("todolist.bin")).save(todo), ErrorCode.kOk)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def getPath(self, fileName):
+        return os.path.join(self.tmpDir, fileName)
+
+    def startTodo(self, argList, stdin = None):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = TestEntryPoint.kRootPath
+
+        return subprocess.Popen([sys.executable, os.path.join(TestEntryPoint.kRootPath, "todo")] + argList,
+                                cwd=self.tmpDir, env=env, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def runTodo(self, argList, stdin = None):
+        process = self.startTodo(argList, stdin)
+        output = process.communicate()[0]
+        return (process.returncode, output)
+
+    def runTest(self):
+        # The legacy content is imported in the background, then renamed in place
+        (returnCode, output) = self.runTodo(["-c", "printTagList"])
+        self.assertEqual(returnCode, 0)
+        self.assertEqual(output, "Importing content from todolist.bin\nTag count : 1\nId 1 : 'bug'\n")
+        self.assertEqual([fileName for fileName in os.listdir(self.tmpDir) if fileName.startswith("todolist.db")],
+                         ["todolist.db"])
+
+        # Quitting before the first command waits for the import
+        os.remove(self.getPath("todolist.db"))
+        with open(os.devnull) as stdin:
+            (returnCode, output) = self.runTodo([], stdin)
+        self.assertEqual(returnCode, 0)
+        self.assertEqual([fileName for fileName in os.listdir(self.tmpDir) if fileName.startswith("todolist.db")],
+                         ["todolist.db"])
+
+        # A todolist.db without content does not hide the legacy one
+        os.remove(self.getPath("todolist.db"))
+        serializer = SqliteSerializer(self.getPath("todolist.db"))
+        self.assertEqual(serializer.open(), ErrorCode.kOk)
+        serializer.close()
+        (returnCode, output) = self.runTodo(["-c", "printTagList"])
+        self.assertEqual(output, "Importing content from todolist.bin\nTag count : 1\nId 1 : 'bug'\n")
+
+        # Commands are sent to a running daemon
+        socketPath = self.getPath("todolist.sock")
+        daemon = self.startTodo(["--daemon", "--socket", socketPath])
+        try:
+            for i in range(200):
+                if isDaemonRunning(socketPath):
+                    break
+                time.sleep(0.05)
+
+            (returnCode, output) = self.runTodo(["--socket", socketPath, "-c", "addTag feature"])
+            self.assertEqual(returnCode, 0)
+            self.assertEqual(output, "Tag 'feature' created with Id 2\n")
+
+            (returnCode, output) = self.runTodo(["--socket", socketPath, "-c", "printTagList"])
+            self.assertEqual(returnCode, 0)
+            self.assertEqual(output, "Tag count : 2\nId 1 : 'bug'\nId 2 : 'feature'\n")
+
+            # The prompt would not see the changes of the daemon
+            with open(os.devnull) as stdin:
+                (returnCode, output) = self.runTodo(["--socket", socketPath], stdin)
+            self.assertEqual(returnCode, 1)
+            self.assertEqual(output, "A daemon is running on %s, send the commands with -c or -f\n" % (socketPath))
+        finally:
+            daemon.send_signal(signal.SIGINT)
+            daemon.communicate()
+
+        self.assertFalse(os.path.exists(socketPath))
+
+class TestConcurrentShells(unittest.TestCase):
+    kPrompt = "(Cmd) "
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def startShell(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = TestEntryPoint.kRootPath
+
+        process = subprocess.Popen([sys.executable, os.path.join(TestEntryPoint.kRootPath, "todo")], cwd=self.tmpDir,
+                                   env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.readOutput(process)
+        return process
+
+    def readOutput(self, process):
+        # Up to the next prompt
+        output = ""
+        while output.endswith(TestConcurrentShells.kPrompt) == False:
+            data = os.read(process.stdout.fileno(), 4096)
+            if data == "":
+                break
+            output = output + data
+
+        return output[:-len(TestConcurrentShells.kPrompt)]
+
+    def runCommand(self, process, command):
+        process.stdin.write(command + "\n")
+        process.stdin.flush()
+        return self.readOutput(process)
+
+    def runTest(self):
+        # Each shell changes todolist.db after the other one read it
+        shell1 = self.startShell()
+        shell2 = self.startShell()
+        try:
+            self.assertEqual(self.runCommand(shell2, "printTagList"), "Starting from empty content\nTag count : 0\n")
+            self.assertEqual(self.runCommand(shell1, "addTag bug"),
+                             "Starting from empty content\nTag 'bug' created with Id 1\n")
+            self.assertEqual(self.runCommand(shell2, "addTag feature"), "Tag 'feature' created with Id 2\n")
+            self.assertEqual(self.runCommand(shell2, "printTagList"), "Tag count : 2\nId 1 : 'bug'\nId 2 : 'feature'\n")
+
+            self.assertEqual(self.runCommand(shell1, 'openTicket "Ticket 1"'), "Ticket 'Ticket 1' created with Id 1\n")
+            self.assertEqual(self.runCommand(shell2, 'openTicket "Ticket 2"'), "Ticket 'Ticket 2' created with Id 2\n")
+            self.assertEqual(self.runCommand(shell1, "closeTicket 2"), "Ticket 2 closed\n")
+        finally:
+            for shell in [shell1, shell2]:
+                shell.stdin.close()
+                shell.wait()
+
+        serializer = SqliteSerializer(os.path.join(self.tmpDir, "todolist.db"))
+        (res, todo) = serializer.load()
+        self.assertEqual(res, ErrorCode.kOk)
+        self.assertEqual([tag.getName() for tag in todo.getTagList()], ["bug", "feature"])
+        self.assertEqual([(ticket.getDescription(), ticket.getStatus()) for ticket in [todo.getTicketById(1), todo.getTicketById(2)]],
+                         [("Ticket 1", TicketStatus.kOpened), ("Ticket 2", TicketStatus.kClosed)])
+        serializer.close()
+
 if __name__ == '__main__':
     unittest.main()
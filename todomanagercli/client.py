@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import socket
+from libtodomanager.todomanager import ErrorCode
+
+__all__ = ["connectDaemon", "isDaemonRunning", "runRemoteScript"]
+
+def connectDaemon(socketPath):
+    clientSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        clientSocket.connect(socketPath)
+    except socket.error:
+        clientSocket.close()
+        return None
+
+    return clientSocket
+
+def isDaemonRunning(socketPath):
+    clientSocket = connectDaemon(socketPath)
+    if clientSocket == None:
+        return False
+
+    clientSocket.close()
+    return True
+
+def runRemoteScript(socketPath, script):
+    # Returns the result code of the script and its output, or None when no
+    # daemon listens on socketPath
+    clientSocket = connectDaemon(socketPath)
+    if clientSocket == None:
+        return None
+
+    clientSocket.sendall(script)
+    clientSocket.shutdown(socket.SHUT_WR)
+
+    chunkList = []
+    while True:
+        chunk = clientSocket.recv(65536)
+        if chunk == "":
+            break
+        chunkList.append(chunk)
+    clientSocket.close()
+
+    # The daemon answers with the result code on the first line, then the output
+    (resLine, separator, output) = "".join(chunkList).partition("\n")
+    if separator == "":
+        return (ErrorCode.kErr, "")
+
+    return (int(resLine), output)
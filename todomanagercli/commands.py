@@ -18,8 +18,11 @@
 # along with Todomanager; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import bisect
 from libtodomanager.todomanager import *
 from shell import *
+from libtodomanager.stats import *
+from libtodomanager.query import *
 
 def tagListToString(tagList):
     if len(tagList) == 0:
@@ -41,12 +44,39 @@ class CommandError:
     kError = 1
 
 class TodoManagerCommand(Command):
+    # Set while a batch runs
+    saveDeferred = False
+
     def __init__(self, name, param_list = []):
         Command.__init__(self, name, param_list)
 
     def run(self, todo, paramCount, args):
+        start = globalStats.start()
         self.runCommand(todo, paramCount, args)
-        todo.save()
+        if start != None:
+            globalStats.stop("command.%s" % (self.name), start)
+
+        if TodoManagerCommand.saveDeferred == False and todo.isDirty():
+            start = globalStats.start()
+            todo.save()
+            globalStats.stop("save", start)
+
+def runBatch(shell, todo, stream):
+    # Commands of the batch only change the content in memory, it is saved once
+    # at the end. A command which raises leaves the batch unsaved.
+    TodoManagerCommand.saveDeferred = True
+    try:
+        shell.runscript(stream)
+    finally:
+        TodoManagerCommand.saveDeferred = False
+
+    res = ErrorCode.kOk
+    if todo.isDirty():
+        start = globalStats.start()
+        res = todo.save()
+        globalStats.stop("save", start)
+
+    return res
 
 class CommandPrintTagList(TodoManagerCommand):
     def __init__(self):
@@ -84,13 +114,41 @@ class CommandAddTag(TodoManagerCommand):
 class CommandPrintOpenedTicketList(TodoManagerCommand):
     def __init__(self):
         cmdName = "printOpenedTicketList"
-        Command.__init__(self, name=cmdName)
+        optList = [
+            Parameter("limit", ParameterType.INTEGER, optional=True),
+            Parameter("after", ParameterType.INTEGER, optional=True),
+        ]
+
+        Command.__init__(self, name=cmdName, option_list=optList)
 
     def runCommand(self, todo, paramCount, args):
-        ticketList = todo.getOpenedTickets()
-        print "Opened tickets count : %d" % (ticketList.getTicketCount())
-        for ticket in ticketList.getContent():
+        limit   = getattr(args, "limit", None)
+        afterId = getattr(args, "after", None)
+        if afterId == None:
+            afterId = 0
+
+        if limit != None and limit <= 0:
+            print "Invalid limit %d" % (limit)
+            return CommandError.kError
+
+        print "Opened tickets count : %d" % (todo.getOpenedTicketsCount())
+        if limit == None:
+            # Tickets are printed while they are fetched
+            ticketIterator = todo.iterOpenedTickets(afterId)
+        else:
+            # One more ticket tells whether there is a next page
+            ticketIterator = todo.getOpenedTicketsPage(limit + 1, afterId).getContent()
+
+        printedCount = 0
+        lastTicketId = None
+        for ticket in ticketIterator:
+            if printedCount == limit:
+                print "Next page : --after %d" % (lastTicketId)
+                break
+
             print "Id %d - '%s' - Tags : %s" % (ticket.getId(), ticket.getDescription(), tagListToString(ticket.getTagList()))
+            printedCount = printedCount + 1
+            lastTicketId = ticket.getId()
 
         return CommandError.kOk
 
@@ -166,6 +224,8 @@ class CommandAddTagToTicket(TodoManagerCommand):
     kTicketId = 0
     kTagName  = 1
 
+    kMaxCompletionCount = 100
+
     def __init__(self):
         cmdName = "addTagToTicket"
         argList = [
@@ -197,6 +257,129 @@ class CommandAddTagToTicket(TodoManagerCommand):
 #        print "Param %d - '%s'" % (parameterIndex, parameterContent)
 
         if parameterIndex == CommandAddTagToTicket.kTagName:
-            return [tag.getName() for tag in todo.getTagList() if tag.getName().startswith(parameterContent)] + [None]
+            return todo.getTagNamesByPrefix(parameterContent, CommandAddTagToTicket.kMaxCompletionCount) + [None]
+        else:
+            return [None]
+
+class CommandSearch(TodoManagerCommand):
+    kDefaultLimit = 20
+
+    def __init__(self):
+        cmdName = "search"
+        argList = [
+            Parameter("query", ParameterType.STRING, remainder=True),
+        ]
+        optList = [
+            Parameter("limit", ParameterType.INTEGER, optional=True),
+        ]
+
+        Command.__init__(self, name=cmdName, param_list=argList, option_list=optList)
+
+    def runCommand(self, todo, paramCount, args):
+        limit = getattr(args, "limit", None)
+        if limit == None:
+            limit = CommandSearch.kDefaultLimit
+        elif limit <= 0:
+            print "Invalid limit %d" % (limit)
+            return CommandError.kError
+
+        ticketList = todo.searchTickets(args.query, limit)
+        print "Matching tickets count : %d" % (todo.getSearchTicketsCount(args.query))
+        for ticket in ticketList.getContent():
+            print "Id %d - %s - '%s' - Tags : %s" % (ticket.getId(), TicketStatus.toString(ticket.getStatus()),
+                                                     ticket.getDescription(), tagListToString(ticket.getTagList()))
+
+        return CommandError.kOk
+
+class CommandQuery(TodoManagerCommand):
+    kDefaultLimit = 20
+
+    def __init__(self):
+        cmdName = "query"
+        argList = [
+            Parameter("query", ParameterType.STRING),
+        ]
+        optList = [
+            Parameter("limit", ParameterType.INTEGER, optional=True),
+            Parameter("after", ParameterType.INTEGER, optional=True),
+        ]
+
+        Command.__init__(self, name=cmdName, param_list=argList, option_list=optList)
+
+    def runCommand(self, todo, paramCount, args):
+        limit   = getattr(args, "limit", None)
+        afterId = getattr(args, "after", None)
+        if afterId == None:
+            afterId = 0
+
+        if limit == None:
+            limit = CommandQuery.kDefaultLimit
+        elif limit <= 0:
+            print "Invalid limit %d" % (limit)
+            return CommandError.kError
+
+        try:
+            term = parseQuery(todo, args.query)
+        except QueryError, e:
+            print "Invalid query : %s" % (e)
+            return CommandError.kError
+
+        # Ids are sorted, the page starts after the cursor
+        ticketIds = QueryPlanner(todo).findTicketIds(term)
+        start = bisect.bisect_right(ticketIds, afterId)
+        pageIds = ticketIds[start:start + limit]
+
+        print "Matching tickets count : %d" % (len(ticketIds))
+        for ticket in todo.getTicketsFromIds(pageIds).getContent():
+            print "Id %d - %s - '%s' - Tags : %s" % (ticket.getId(), TicketStatus.toString(ticket.getStatus()),
+                                                     ticket.getDescription(), tagListToString(ticket.getTagList()))
+
+        if start + limit < len(ticketIds):
+            print "Next page : --after %d" % (pageIds[-1])
+
+        return CommandError.kOk
+
+class CommandStats(Command):
+    # Not a TodoManagerCommand, the content is neither needed nor saved
+    kParamAction = 0
+    kActionList  = ["json", "on", "off", "reset"]
+
+    def __init__(self):
+        cmdName = "stats"
+        argList = [
+            Parameter("action", ParameterType.STRING, optional=True),
+        ]
+
+        Command.__init__(self, name=cmdName, param_list=argList)
+
+    def run(self, todo, paramCount, args):
+        action = getattr(args, "action", None)
+
+        if action == None:
+            if globalStats.isEnabled() == False:
+                print "Stats are disabled, 'stats on' enables them"
+            content = globalStats.toString()
+            if content != "":
+                print content
+        elif action == "json":
+            print globalStats.toJson()
+        elif action == "on":
+            globalStats.enable()
+            print "Stats enabled"
+        elif action == "off":
+            globalStats.enable(False)
+            print "Stats disabled"
+        elif action == "reset":
+            globalStats.reset()
+            print "Stats reset"
+        else:
+            print "Unknown action '%s', expected one of %s" % (action, ", ".join(CommandStats.kActionList))
+            return CommandError.kError
+
+        return CommandError.kOk
+
+    def completeParameter(self, todo, parameterIndex, parameterContent):
+        if parameterIndex == CommandStats.kParamAction:
+            return [action for action in CommandStats.kActionList if action.startswith(parameterContent)] + [None]
         else:
             return [None]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 Romain Roffé
+#
+# This file is part of Todomanager
+# 
+# Todomanager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# Todomanager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Todomanager; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import asynchat
+import asyncore
+import os
+import socket
+import sys
+import StringIO
+from libtodomanager.todomanager import *
+from todomanagercli.commands import *
+from todomanagercli.client import *
+
+__all__ = ["TodoChannel", "TodoServer"]
+
+class TodoChannel(asynchat.async_chat):
+    # Reads the script without blocking the loop, a client which stalls only
+    # holds its own connection
+    def __init__(self, sock, server, socketMap = None):
+        asynchat.async_chat.__init__(self, sock, socketMap)
+        self.server    = server
+        self.inputList = []
+        self.answered  = False
+        self.set_terminator(None)
+
+    def collect_incoming_data(self, data):
+        self.inputList.append(data)
+
+    def found_terminator(self):
+        pass
+
+    def readable(self):
+        # Once answered, the end of the script would be read again and close
+        # the channel before the output is sent
+        return self.answered == False and asynchat.async_chat.readable(self)
+
+    def handle_close(self):
+        if self.answered:
+            self.close()
+            return
+
+        # The client sends a script and closes its side. It is run as a batch,
+        # so it is saved once.
+        self.answered = True
+        self.push(self.server.runScript("".join(self.inputList)))
+        self.inputList = []
+        self.close_when_done()
+
+class TodoServer(asyncore.dispatcher):
+    # Served from the asyncore loop, so the HTTP server can run in the same
+    # thread and see its mutations. Scripts are run one at a time, the
+    # commands print to sys.stdout and runBatch is not reentrant.
+    def __init__(self, socketPath, shell, todo, socketMap = None):
+        asyncore.dispatcher.__init__(self, map=socketMap)
+        self.shell      = shell
+        self.todo       = todo
+        self.socketPath = socketPath
+        self.socketMap  = socketMap
+
+        # Left behind by a daemon which did not exit cleanly
+        if os.path.exists(socketPath) and isDaemonRunning(socketPath) == False:
+            os.remove(socketPath)
+
+        self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.bind(socketPath)
+        self.listen(5)
+
+    def runScript(self, script):
+        output = StringIO.StringIO()
+        shell  = self.shell
+
+        (stdout, shellStdout) = (sys.stdout, shell.stdout)
+        sys.stdout = shell.stdout = output
+        try:
+            res = runBatch(shell, self.todo, StringIO.StringIO(script))
+        except Exception, e:
+            # Nothing of the script is kept, the client gets the error
+            self.todo.rollback()
+            print "*** %s: %s" % (e.__class__.__name__, e)
+            res = ErrorCode.kErr
+        finally:
+            (sys.stdout, shell.stdout) = (stdout, shellStdout)
+
+        return "%d\n%s" % (res, output.getvalue())
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair != None:
+            TodoChannel(pair[0], self, self.socketMap)
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
@@ -70,6 +70,7 @@ they automatically support Emacs-like command history and editing features.
 import string
 import shlex
 import sys
+from libtodomanager.stats import *
 
 __all__ = ["Shell", "ParameterType", "Parameter", "Command", "HandlerParam"]
 
@@ -81,15 +82,19 @@ class ParameterType:
     INTEGER = 2
 
 class Parameter:
-    def __init__(self, name, param_type, optional = False):
+    # A last STRING parameter with remainder set gets all the words left on
+    # the line, joined by spaces
+    def __init__(self, name, param_type, optional = False, remainder = False):
         self.name       = name
         self.param_type = param_type
         self.optional   = optional
+        self.remainder  = remainder
 
 class Command:
-    def __init__(self, name, param_list = []):
-        self.name       = name
-        self.param_list = param_list
+    def __init__(self, name, param_list = [], option_list = []):
+        self.name        = name
+        self.param_list  = param_list
+        self.option_list = option_list
 
         self.min_params = 0
         for param in self.param_list:
@@ -120,6 +125,13 @@ class Command:
     def completeParameter(self, todo, parameterIndex, parameterContent):
         return []
 
+    def get_option(self, optname):
+        for option in self.option_list:
+            if optname == option.name:
+                return option
+
+        return None
+
 class HandlerParam:
     None
 
@@ -170,6 +182,9 @@ class Shell:
         self.cmdqueue = []
         self.completekey = completekey
         self.reg_cmd_list = []
+        self.reg_cmd_by_name = {}
+        self.reg_cmd_name_list = []
+        self.cmd_factory_by_name = {}
         self.data = data
 
     def cmdloop(self, intro=None):
@@ -226,6 +241,19 @@ class Shell:
                     pass
 
 
+    def runscript(self, stream):
+        # Blank lines and comments are skipped, they do not repeat the last command
+        for line in stream:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+
+            line = self.precmd(line)
+            stop = self.onecmd(line)
+            stop = self.postcmd(stop, line)
+            if stop:
+                break
+
     def precmd(self, line):
         """Hook method executed just before the command line is
         interpreted, but after the input prompt is generated and issued.
@@ -289,7 +317,9 @@ class Shell:
         else:
             regcmd = self.get_registered_command(cmd)
             if regcmd != None:
+                start = globalStats.start()
                 res = self.call_registered_command(regcmd, arg)
+                globalStats.stop("shell.command", start)
                 if res == False:
                     return self.default(line)
             else:
@@ -328,7 +358,7 @@ class Shell:
         return []
 
     def completenames(self, text, *ignored):
-        return [a.name for a in self.reg_cmd_list if a.name.startswith(text)]
+        return [name for name in self.reg_cmd_name_list if name.startswith(text)]
 
     def complete(self, text, state):
         """Return the next possible completion for 'text'.
@@ -492,28 +522,84 @@ class Shell:
     def register_command_list(self, cmdlist):
         for cmd in cmdlist:
             self.reg_cmd_list.append(cmd)
+            self.reg_cmd_by_name[cmd.name] = cmd
+            self.reg_cmd_name_list.append(cmd.name)
+
+    def register_command_factory(self, cmdname, factory):
+        # The command is built when it is first used
+        self.cmd_factory_by_name[cmdname] = factory
+        self.reg_cmd_name_list.append(cmdname)
 
     def get_registered_command(self, cmdname):
-        for cmd in self.reg_cmd_list:
-            if cmdname == cmd.name:
-                return cmd
+        regcmd = self.reg_cmd_by_name.get(cmdname)
+        if regcmd == None and cmdname in self.cmd_factory_by_name:
+            regcmd = self.cmd_factory_by_name.pop(cmdname)()
+            self.reg_cmd_list.append(regcmd)
+            self.reg_cmd_by_name[cmdname] = regcmd
 
-        return None
+        return regcmd
 
     def call_registered_command(self, regcmd, raw_param):
+        start = globalStats.start()
         try:
             paramlist = shlex.split(raw_param)
         except ValueError:
+            globalStats.addCount("shell.invalidCommands")
             return False
             
+        optionlist = self.extract_options(regcmd, paramlist)
+        if optionlist == None:
+            globalStats.addCount("shell.invalidCommands")
+            return False
+
+        self.join_remainder(regcmd, paramlist)
         paramlistvalid = self.is_paramlist_valid(regcmd, paramlist)
         if paramlistvalid == True:
-            parsed_paramlist = self.build_callbackparam(regcmd, paramlist)
+            parsed_paramlist = self.build_callbackparam(regcmd, paramlist, optionlist)
+            globalStats.stop("shell.parse", start)
             regcmd.run(self.data, len(paramlist), parsed_paramlist)
             return True
         else:
+            globalStats.addCount("shell.invalidCommands")
             return False
 
+    def extract_options(self, regcmd, param_list):
+        # Options are given as "--name value" anywhere on the line, they are
+        # removed from param_list which only keeps the positional parameters
+        optionlist = {}
+        if len(regcmd.option_list) == 0:
+            return optionlist
+
+        i = 0
+        while i < len(param_list):
+            if param_list[i].startswith("--") == False:
+                i = i + 1
+                continue
+
+            option = regcmd.get_option(param_list[i][2:])
+            if option == None:
+                print "Unknown option '%s'" % param_list[i]
+                return None
+            elif i + 1 == len(param_list):
+                print "Missing value for option '%s'" % param_list[i]
+                return None
+            elif option.param_type == ParameterType.INTEGER:
+                try:
+                    tmp = int(param_list[i + 1])
+                except ValueError:
+                    print "Unable to cast '%s' to integer" % param_list[i + 1]
+                    return None
+
+            optionlist[option.name] = self.cast_value(option, param_list[i + 1])
+            del param_list[i:i + 2]
+
+        return optionlist
+
+    def join_remainder(self, regcmd, param_list):
+        count = len(regcmd.param_list)
+        if count > 0 and regcmd.param_list[-1].remainder and len(param_list) > count:
+            param_list[count - 1:] = [" ".join(param_list[count - 1:])]
+
     def is_paramlist_valid(self, regcmd, param_list):
         if len(param_list) < regcmd.min_params:
             print "Invalid parameters count (got %d, at least %d expected)" % (len(param_list), regcmd.min_params)
@@ -538,9 +624,13 @@ class Shell:
 
             return ret
 
-    def build_callbackparam(self, regcmd, param_list):
+    def build_callbackparam(self, regcmd, param_list, option_list = {}):
         ret = HandlerParam()
 
+        # Options which are not given are set to None
+        for option in regcmd.option_list:
+            setattr(ret, option.name, option_list.get(option.name))
+
         i = 0
         for param in param_list:
             val = self.cast_value(regcmd.param_list[i], param_list[i])